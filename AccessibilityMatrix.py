@@ -0,0 +1,211 @@
+import json
+import os
+import numpy as np
+import TransitSearch
+
+
+# Sparse origin block x destination block travel times, streamed to disk as they are found
+#   A matrix is a directory:
+#     matrix.json       minutes searched, the chunks written so far, and whether it was finished
+#     chunk_00000.npz   compressed columns of consecutive rows (np.savez_compressed):
+#       origins[rows]         origin block fids, int64
+#       offsets[rows + 1]     start of each origin's entries, int64
+#       destinations[entries] destination block fids, sorted within each row, int64
+#       minutes[entries]      travel time to each destination in minutes, float32
+#   Only blocks reached within the time searched have entries. Rows are never split across
+#   chunks, and the manifest is rewritten after every chunk, so an interrupted run leaves
+#   a readable matrix of the rows written before it stopped.
+matrix_format = 'PTMATRIX1'
+manifest_name = 'matrix.json'
+
+
+class MatrixWriter:
+    def __init__(self, path, minutes, chunk_entries=1000000):
+        self.path = path
+        self.minutes = minutes
+        self.chunk_entries = chunk_entries
+        self.chunks = []
+        self.origin_count = 0
+        self.entry_count = 0
+        self.origins = []
+        self.destinations = []
+        self.times = []
+        self.buffered = 0
+        os.makedirs(path, exist_ok=True)
+        self.write_manifest(False)
+
+    def __repr__(self):
+        return (f"MatrixWriter({self.path}, origins: {self.origin_count}, entries: {self.entry_count}, "
+                f"chunks: {len(self.chunks)})")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(exc_type is None)
+        return False
+
+
+    # Adds an origin's row, destination block fids with their times in minutes
+    def add_row(self, origin, destinations, minutes):
+        destinations = np.asarray(destinations, dtype=np.int64)
+        minutes = np.asarray(minutes, dtype=np.float32)
+        order = np.argsort(destinations, kind='stable')
+        self.origins.append(origin)
+        self.destinations.append(destinations[order])
+        self.times.append(minutes[order])
+        self.buffered += len(destinations)
+        self.origin_count += 1
+        self.entry_count += len(destinations)
+        if self.buffered >= self.chunk_entries:
+            self.flush()
+
+
+    # Writes the buffered rows out as a chunk
+    def flush(self):
+        if not self.origins:
+            return
+        offsets = np.zeros(len(self.origins) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(destinations) for destinations in self.destinations])
+        name = f"chunk_{len(self.chunks):05d}.npz"
+        np.savez_compressed(os.path.join(self.path, name),
+                            origins=np.array(self.origins, dtype=np.int64),
+                            offsets=offsets,
+                            destinations=np.concatenate(self.destinations),
+                            minutes=np.concatenate(self.times))
+        self.chunks.append({'file': name, 'origins': len(self.origins), 'entries': int(offsets[-1])})
+        self.origins, self.destinations, self.times = [], [], []
+        self.buffered = 0
+        self.write_manifest(False)
+
+
+    # complete: whether every origin asked for has its row
+    def close(self, complete=True):
+        self.flush()
+        self.write_manifest(complete)
+
+
+    def write_manifest(self, complete):
+        manifest = {'format': matrix_format,
+                    'minutes': self.minutes,
+                    'origins': sum(chunk['origins'] for chunk in self.chunks),
+                    'entries': sum(chunk['entries'] for chunk in self.chunks),
+                    'complete': complete,
+                    'chunks': self.chunks}
+        # Replaced whole, so a crash never leaves half a manifest
+        temporary_path = os.path.join(self.path, manifest_name + '.tmp')
+        with open(temporary_path, 'w') as file:
+            json.dump(manifest, file, indent=1)
+        os.replace(temporary_path, os.path.join(self.path, manifest_name))
+
+
+
+# A matrix written by MatrixWriter, read a chunk at a time
+class Matrix:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, manifest_name)) as file:
+            self.manifest = json.load(file)
+        if self.manifest.get('format') != matrix_format:
+            raise ValueError(f"{path} is not an accessibility matrix")
+        self.minutes = self.manifest['minutes']
+
+    def __repr__(self):
+        return (f"Matrix({self.path}, minutes: {self.minutes:g}, origins: {self.manifest['origins']}, "
+                f"entries: {self.manifest['entries']}, complete: {self.manifest['complete']})")
+
+
+    # The columns of a chunk, name -> array
+    def chunk(self, index):
+        with np.load(os.path.join(self.path, self.manifest['chunks'][index]['file'])) as chunk:
+            return {name: chunk[name] for name in chunk.files}
+
+
+    # Yields (origin block fid, destination block fids, minutes) of every row
+    def rows(self):
+        for index in range(len(self.manifest['chunks'])):
+            chunk = self.chunk(index)
+            offsets = chunk['offsets']
+            for row, origin in enumerate(chunk['origins'].tolist()):
+                start, end = offsets[row], offsets[row + 1]
+                yield origin, chunk['destinations'][start:end], chunk['minutes'][start:end]
+
+
+
+# Weighted sum of the destinations each origin reaches within one or more cutoffs,
+#   e.g. jobs reachable within 45 minutes, added up row by row as the matrix is written
+#   weights: destination block fid -> weight (blocks without one count as 0)
+#   cutoffs: minutes
+#   totals: origin block fid -> [sum within each cutoff]
+class WeightedSum:
+    def __init__(self, weights, cutoffs):
+        fids = np.fromiter(weights.keys(), dtype=np.int64, count=len(weights))
+        values = np.fromiter(weights.values(), dtype=np.float64, count=len(weights))
+        order = np.argsort(fids, kind='stable')
+        self.fids = fids[order]
+        self.weights = values[order]
+        self.cutoffs = sorted(cutoffs)
+        self.totals = {}
+
+    def __repr__(self):
+        return f"WeightedSum(weights: {len(self.fids)}, cutoffs: {self.cutoffs}, origins: {len(self.totals)})"
+
+
+    def add_row(self, origin, destinations, minutes):
+        destinations = np.asarray(destinations, dtype=np.int64)
+        minutes = np.asarray(minutes)
+        weights = np.zeros(len(destinations))
+        if len(self.fids):
+            indices = np.minimum(np.searchsorted(self.fids, destinations), len(self.fids) - 1)
+            known = self.fids[indices] == destinations
+            weights[known] = self.weights[indices[known]]
+        self.totals[origin] = [float(weights[minutes <= cutoff].sum()) for cutoff in self.cutoffs]
+
+
+
+# The blocks of a search kept with its edge times (get_result's keep_times) and when each is
+#   first reached, as (block fids, minutes) arrays (see BlockTable.block_times)
+def block_row(network, block_table, result):
+    block_times = block_table.block_times(network.street_times(result.walking_edge_times))
+    fids = np.fromiter(block_times.keys(), dtype=np.int64, count=len(block_times))
+    minutes = np.fromiter(block_times.values(), dtype=np.float64, count=len(block_times)) * 60
+    return fids, minutes
+
+
+# Searches from one origin for the matrix, keeping each node's earliest time
+def search_block_row(network, block_table, origin, origin_point, time_limit):
+    search = TransitSearch.Search(time_limit, network)
+    search.exact_labels = True
+    search.init_search(origin_point)
+    return block_row(network, block_table, search.get_result(origin, keep_times=True))
+
+
+# Yields (origin, block fids, minutes) of (origin, (x, y)) origins, one after another
+#   The stops' walk sheds are kept between origins (see TransitSearch.WalkShedCache)
+#   For many origins BatchSearch.run_block_rows gives the same rows across worker processes
+def block_rows(network, block_table, origins, time_limit, feedback=None, walk_shed_bytes=256 * 1024 * 1024):
+    network = TransitSearch.WalkShedCache(network, walk_shed_bytes)
+    for origin, origin_point in origins:
+        if feedback is not None and feedback.isCanceled():
+            print("Cancelling matrix, rows written so far are kept")
+            return
+        yield (origin,) + search_block_row(network, block_table, origin, origin_point, time_limit)
+
+
+# Streams rows into a MatrixWriter, adding each to the aggregates as it goes
+#   The writer is closed at the end, as complete when origin_count rows (or, without it,
+#   every row) were written
+#   Returns the number of rows written
+def write_matrix(rows, writer, aggregates=(), origin_count=None):
+    row_count = 0
+    complete = False
+    try:
+        for origin, destinations, minutes in rows:
+            writer.add_row(origin, destinations, minutes)
+            for aggregate in aggregates:
+                aggregate.add_row(origin, destinations, minutes)
+            row_count += 1
+        complete = origin_count is None or row_count == origin_count
+    finally:
+        writer.close(complete)
+    return row_count
@@ -0,0 +1,107 @@
+import multiprocessing
+import os
+import sys
+import TransitSearch
+import NetworkSnapshot
+import AccessibilityMatrix
+
+
+# Network data (and block table, for matrix rows) of a worker process, received once when the worker starts
+worker_network = None
+worker_block_table = None
+
+
+# network: NetworkData, or the path of a snapshot to memory map it from
+#   Walk sheds of the stops are kept for every search the worker runs (see TransitSearch.WalkShedCache)
+def init_worker(network, walk_shed_bytes, block_table=None):
+    global worker_network, worker_block_table
+    if isinstance(network, str):
+        network = NetworkSnapshot.load_snapshot(network).network_data
+    worker_network = TransitSearch.WalkShedCache(network, walk_shed_bytes)
+    worker_block_table = block_table
+
+
+def search_origin(name, origin_point, time_limit):
+    search = TransitSearch.Search(time_limit, worker_network)
+    search.init_search(origin_point)
+    return search.get_result(name)
+
+
+def search_origin_blocks(name, origin_point, time_limit):
+    return (name,) + AccessibilityMatrix.search_block_row(worker_network, worker_block_table, name,
+                                                          origin_point, time_limit)
+
+
+# Runs one (search, name, origin point, time limit) task of run_pool in a worker
+def run_task(task):
+    search, name, origin_point, time_limit = task
+    return search(name, origin_point, time_limit)
+
+
+# Searches from many origins across a pool of worker processes
+#   origins: iterable of (name, (x, y)) in the network's coordinate system
+#   network: NetworkData, copied into each worker when it starts
+#     (or, when it came from a snapshot, memory mapped by each worker from the same file)
+#   feedback: optional QgsProcessingFeedback-like object, checked for cancelling
+#   walk_shed_bytes: memory each worker keeps stop walk sheds within
+# Yields each SearchResult as soon as it is finished (not in the order of origins)
+def run_batch(network, origins, time_limit, workers, feedback=None, walk_shed_bytes=256 * 1024 * 1024):
+    return run_pool(search_origin, network, origins, time_limit, workers, feedback, walk_shed_bytes)
+
+
+# Accessibility matrix rows of many origins across a pool of worker processes
+#   block_table: BlockTable, copied into each worker
+#   Yields (name, block fids, minutes) as each origin is finished, see AccessibilityMatrix.block_rows
+def run_block_rows(network, block_table, origins, time_limit, workers, feedback=None,
+                   walk_shed_bytes=256 * 1024 * 1024):
+    return run_pool(search_origin_blocks, network, origins, time_limit, workers, feedback, walk_shed_bytes,
+                    block_table)
+
+
+# Runs search(name, point, time_limit) in the workers for every origin, yielding what each returns
+#   Cancelling (or stopping the iteration early) terminates the workers instead of waiting
+#   for the searches they are running, so it returns straight away
+def run_pool(search, network, origins, time_limit, workers, feedback, walk_shed_bytes, block_table=None):
+    # Workers only import the QGIS-free modules, so they can run on a plain python
+    context = multiprocessing.get_context('spawn')
+    context.set_executable(python_executable())
+
+    pool = context.Pool(workers, init_worker, (network.snapshot_path or network, walk_shed_bytes, block_table))
+    finished = False
+    try:
+        tasks = [(search, name, point, time_limit) for name, point in origins]
+        results = pool.imap_unordered(run_task, tasks)
+        remaining = len(tasks)
+        while remaining:
+            try:
+                result = results.next(timeout=0.5)
+            except multiprocessing.TimeoutError:
+                pass
+            else:
+                remaining -= 1
+                yield result
+
+            if feedback is not None and feedback.isCanceled():
+                print(f"Cancelling batch, {remaining} searches not finished")
+                return
+        finished = True
+    finally:
+        if finished:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+
+
+# Python interpreter to start workers with
+#   Inside QGIS sys.executable is the QGIS application itself, not python
+def python_executable():
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return sys.executable
+    for candidate in (os.path.join(sys.exec_prefix, 'python.exe'),
+                      os.path.join(sys.exec_prefix, 'python3.exe'),
+                      os.path.join(sys.exec_prefix, 'bin', 'python3'),
+                      os.path.join(sys.exec_prefix, 'bin', 'python')):
+        if os.path.exists(candidate):
+            return candidate
+    return sys.executable
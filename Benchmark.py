@@ -0,0 +1,271 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import WalkingNetwork
+import TransitIndex
+import StopIndex
+import NetworkData
+import TransitSearch
+
+
+# Benchmarks of the search on synthetic networks, runnable anywhere numpy is (no QGIS)
+#   python Benchmark.py --scale small
+#   python Benchmark.py --scale portland --save-baseline benchmark_baseline.json
+#   python Benchmark.py --scale small --baseline benchmark_baseline.json
+# The networks stand in for the project's layers: they are built from plain street, stop
+#   and route data with the same builders the layers go through (see NetworkLoader)
+# Every scenario records wall time (the best of --repeat runs), peak memory (traced in a separate run),
+#   nodes labelled and expanded, repeated searches, boardings and walks pruned, and a digest
+#   of what was reached.
+#   Against a baseline, a different digest is a failure (results changed), and so is
+#   a time more than --tolerance slower.
+
+# Grid size (streets per side), street spacing (feet), and every how many streets a route runs
+scales = {'small': (60, 264, 6),
+          'medium': (150, 264, 8),
+          'portland': (300, 264, 10)}
+
+# name -> (kind, minutes, origin count)
+scenarios = {'single-15': ('single', 15, 5),
+             'single-30': ('single', 30, 5),
+             'single-60': ('single', 60, 5),
+             'batch-1000': ('batch', 15, 1000)}
+# Batch origins also searched without the walk shed cache, to check it finds the same
+batch_check_count = 10
+
+
+# Synthetic street grid with routes, stops and headways, as NetworkData
+#   Streets form a size x size grid with spacing feet between them; a few percent of
+#   the blocks' sides are missing so walks aren't all Manhattan distance. Every step'th
+#   street carries a route each way with a stop every third intersection, each route
+#   with its own speed and trips per hour. Everything comes from random.Random(seed),
+#   so a scale and seed always build the same network.
+def make_network(size, spacing, step, seed=1):
+    rng = random.Random(seed)
+    street_parts = []
+    for i in range(size):
+        for j in range(size - 1):
+            for part in (((j * spacing, i * spacing), ((j + 1) * spacing, i * spacing)),
+                         ((i * spacing, j * spacing), (i * spacing, (j + 1) * spacing))):
+                # Keep every route's street whole
+                if i % step and rng.random() < 0.04:
+                    continue
+                street_parts.append((len(street_parts), list(part)))
+
+    routes, route_stops, stops, headways = [], [], [], []
+    route_stop_records = {}
+    stop_lookup = {}
+    length = (size - 1) * spacing
+    for line in range(0, size, step):
+        for horizontal in (True, False):
+            rte = len(routes) // 2 + 1
+            points = [(k * spacing, line * spacing) if horizontal else (line * spacing, k * spacing)
+                      for k in range(0, size, 3)]
+            speed = rng.choice((10, 12, 15, 18, 25))
+            trips = rng.choice((2, 3, 4, 6, 8))
+            for direction in (0, 1):
+                ends = [(0, line * spacing), (length, line * spacing)] if horizontal else \
+                       [(line * spacing, 0), (line * spacing, length)]
+                if direction:
+                    ends.reverse()
+                routes.append((rte, direction, speed, [ends]))
+                headways.append((rte, direction, trips))
+                for x, y in points:
+                    stop = stop_lookup.get((x, y))
+                    if stop is None:
+                        stop = stop_lookup[(x, y)] = len(stops)
+                        stops.append((stop, 10000 + stop, x, y))
+                    fid = len(route_stops)
+                    route_stops.append((fid, rte, direction, x, y))
+                    route_stop_records[fid] = {'fid': fid, 'stop_id': 10000 + stop, 'rte': rte, 'dir': direction}
+
+    walking_network = WalkingNetwork.build_walking_network(street_parts,
+                                                           [(fid, x, y) for fid, rte, direction, x, y in route_stops])
+    return NetworkData.NetworkData(walking_network, StopIndex.build_stop_index(stops, 'EPSG:2913'),
+                                   TransitIndex.build_route_pattern_index(routes, route_stops),
+                                   TransitIndex.build_headway_table(headways), route_stop_records)
+
+
+# count origins spread over the middle of the grid, the same for a scale and seed
+def make_origins(size, spacing, count, seed=1):
+    rng = random.Random(seed + 1)
+    low, high = size * spacing * 0.2, size * spacing * 0.8
+    return [(f"origin {index}", (rng.uniform(low, high), rng.uniform(low, high))) for index in range(count)]
+
+
+# Short hash of the reached edges and route sections of some SearchResults
+def result_digest(results):
+    digest = hashlib.sha256()
+    for result in results:
+        digest.update(json.dumps([sorted(result.walking_edges),
+                                  [[pattern, round(start, 3), round(end, 3)]
+                                   for pattern, start, end in result.transit_spans]]).encode())
+    return digest.hexdigest()[:16]
+
+
+def run_single(network, origins, time_limit):
+    searches = []
+    for name, point in origins:
+        search = TransitSearch.Search(time_limit, network)
+        search.init_search(point)
+        searches.append((search, search.get_result(name)))
+    return searches
+
+
+# Searches one after another sharing their walks from stops, as a batch in one process does
+def run_batch(network, origins, time_limit):
+    return run_single(TransitSearch.WalkShedCache(network), origins, time_limit)
+
+
+# Runs a scenario, returning its record
+def run_scenario(network, name, size, spacing, seed, repeat=3, trace_memory=True):
+    kind, minutes, origin_count = scenarios[name]
+    origins = make_origins(size, spacing, origin_count, seed)
+    run = run_single if kind == 'single' else run_batch
+
+    # Search output isn't part of the benchmark
+    with contextlib.redirect_stdout(io.StringIO()):
+        elapsed = None
+        for run_count in range(repeat):
+            start_time = time.perf_counter()
+            searches = run(network, origins, minutes / 60)
+            run_time = time.perf_counter() - start_time
+            elapsed = run_time if elapsed is None else min(elapsed, run_time)
+
+        peak_memory = None
+        if trace_memory:
+            tracemalloc.start()
+            run(network, origins, minutes / 60)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        equivalent = None
+        if kind == 'batch':
+            check = origins[:batch_check_count]
+            singles = [result for search, result in run_single(network, check, minutes / 60)]
+            equivalent = result_digest(singles) == result_digest([result for search, result in searches[:len(check)]])
+
+    results = [result for search, result in searches]
+    record = {'scenario': name,
+              'origins': len(origins),
+              'minutes': minutes,
+              'seconds': elapsed,
+              'peak_memory': peak_memory,
+              'walk_nodes': sum(result.walk_node_count for result in results),
+              'transit_nodes': sum(result.transit_node_count for result in results),
+              'expanded': sum(search.push_count - search.stale_pops for search, result in searches),
+              'dominated': sum(search.dominated_boardings for search, result in searches),
+              'pruned': sum(search.pruned_walk_searches for search, result in searches),
+              'prune_checks': sum(search.pruning_checks for search, result in searches),
+              'repeats': sum(result.repeat_count for result in results),
+              'edges': sum(len(result.walking_edges) for result in results),
+              'digest': result_digest(results)}
+    if equivalent is not None:
+        record['uncached_equivalent'] = equivalent
+    return record
+
+
+# Problems with a run against a baseline run of the same scale and seed
+def compare(report, baseline, tolerance):
+    problems = []
+    if (baseline['scale'], baseline['seed']) != (report['scale'], report['seed']):
+        return [f"baseline is of scale {baseline['scale']} seed {baseline['seed']}, "
+                f"not {report['scale']} seed {report['seed']}"]
+    baseline_records = {record['scenario']: record for record in baseline['scenarios']}
+    for record in report['scenarios']:
+        base = baseline_records.get(record['scenario'])
+        if base is None:
+            continue
+        if record['digest'] != base['digest']:
+            problems.append(f"{record['scenario']}: results differ from the baseline")
+        if record['seconds'] > base['seconds'] * (1 + tolerance):
+            problems.append(f"{record['scenario']}: {record['seconds']:.3f} s, "
+                            f"{record['seconds'] / base['seconds'] - 1:.0%} slower than the baseline")
+        if record.get('uncached_equivalent') is False:
+            problems.append(f"{record['scenario']}: results with the walk shed cache differ from searches without it")
+    return problems
+
+
+def print_record(record, base=None):
+    line = (f"{record['scenario']:>11}: {record['origins']:5d} origins, {record['seconds']:8.3f} s")
+    if base is not None:
+        line += f" ({record['seconds'] / base['seconds'] - 1:+.0%})"
+    if record['peak_memory'] is not None:
+        line += f", peak {record['peak_memory'] / 1024 / 1024:7.1f} MiB"
+    line += (f", {record['expanded']} expanded, {record['walk_nodes']} walk / {record['transit_nodes']} transit nodes, "
+             f"{record['repeats']} repeats, ")
+    if record.get('dominated'):
+        line += f"{record['dominated']} boardings dominated, "
+    if record.get('prune_checks'):
+        line += f"{record['pruned']} of {record['prune_checks']} walks pruned, "
+    line += f"digest {record['digest']}"
+    if 'uncached_equivalent' in record:
+        line += f", same as uncached searches: {record['uncached_equivalent']}"
+    print(line)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmarks the transit search on a synthetic network')
+    parser.add_argument('--scale', default='small', choices=sorted(scales))
+    parser.add_argument('--seed', default=1, type=int)
+    parser.add_argument('--scenarios', default=','.join(scenarios),
+                        help=f"comma separated, from {', '.join(scenarios)}")
+    parser.add_argument('--baseline', default=None, help='baseline JSON to compare against')
+    parser.add_argument('--save-baseline', default=None, help='file to write this run to, as a baseline')
+    parser.add_argument('--tolerance', default=0.25, type=float,
+                        help='fraction slower than the baseline that still passes')
+    parser.add_argument('--repeat', default=3, type=int, help='runs of each scenario, the fastest is kept')
+    parser.add_argument('--no-memory', action='store_true', help='skip the memory tracing runs')
+    args = parser.parse_args(argv)
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    for name in args.scenarios:
+        if name not in scenarios:
+            parser.error(f"unknown scenario {name}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    size, spacing, step = scales[args.scale]
+    start_time = time.perf_counter()
+    network = make_network(size, spacing, step, args.seed)
+    print(f"Built {args.scale} network in {time.perf_counter() - start_time:.1f} s: {network}")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    baseline_records = {}
+    if baseline is not None and (baseline['scale'], baseline['seed']) == (args.scale, args.seed):
+        baseline_records = {record['scenario']: record for record in baseline['scenarios']}
+
+    report = {'scale': args.scale, 'seed': args.seed, 'python': platform.python_version(),
+              'machine': platform.machine(), 'scenarios': []}
+    for name in args.scenarios:
+        record = run_scenario(network, name, size, spacing, args.seed, max(args.repeat, 1), not args.no_memory)
+        report['scenarios'].append(record)
+        print_record(record, baseline_records.get(name))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump(report, file, indent=1)
+        print(f"Wrote baseline to {args.save_baseline}")
+
+    if baseline is not None:
+        problems = compare(report, baseline, args.tolerance)
+        for problem in problems:
+            print(problem)
+        if problems:
+            sys.exit(1)
+        print("Matches the baseline")
+
+
+if __name__ == '__main__':
+    main()
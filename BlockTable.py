@@ -0,0 +1,103 @@
+import numpy as np
+
+
+# Precomputed census blocks near every street feature
+#   Stored as one flat binary file, like the TransferTable, so it can be memory mapped:
+#     header                    (magic, street count, block count, distance)
+#     street_fids[street count] sorted street feature fids, int64
+#     offsets[street count + 1] start of each street's blocks, int64
+#     block_fids[block count]   fids of the blocks within distance of the street, int64
+#   The blocks a search reaches are then the union over its reached streets,
+#   with no geometry compared at query time
+block_table_magic = b'PTBLOCK1'
+header_dtype = np.dtype([('magic', 'S8'),
+                         ('street_count', '<i8'),
+                         ('block_count', '<i8'),
+                         ('distance', '<f8')])
+
+
+class BlockTable:
+    def __init__(self, street_fids, offsets, block_fids, distance):
+        self.street_fids = street_fids
+        self.offsets = offsets
+        self.block_fids = block_fids
+        self.distance = distance
+
+    def __repr__(self):
+        return (f"BlockTable(streets: {len(self.street_fids)}, street blocks: {len(self.block_fids)}, "
+                f"distance: {self.distance:g})")
+
+
+    # Sorted fids of the blocks near any of the street feature fids given
+    #   Streets the table doesn't know have no blocks
+    def blocks(self, street_fids):
+        street_fids = np.unique(np.asarray(street_fids, dtype=np.int64))
+        indices = np.searchsorted(self.street_fids, street_fids)
+        known = indices < len(self.street_fids)
+        indices, street_fids = indices[known], street_fids[known]
+        indices = indices[self.street_fids[indices] == street_fids]
+        if len(indices) == 0:
+            return self.block_fids[:0]
+        return np.unique(np.concatenate([self.block_fids[self.offsets[index]:self.offsets[index + 1]]
+                                         for index in indices.tolist()]))
+
+
+    # Earliest time each block is reached at, from the times of its nearby streets
+    #   street_times: street feature fid -> time
+    #   Returns block fid -> the least time of the streets near it
+    def block_times(self, street_times):
+        street_fids = np.fromiter(street_times.keys(), dtype=np.int64, count=len(street_times))
+        times = np.fromiter(street_times.values(), dtype=np.float64, count=len(street_times))
+        indices = np.searchsorted(self.street_fids, street_fids)
+        known = indices < len(self.street_fids)
+        indices, street_fids, times = indices[known], street_fids[known], times[known]
+        known = self.street_fids[indices] == street_fids
+        indices, times = indices[known], times[known]
+        if len(indices) == 0:
+            return {}
+        counts = self.offsets[indices + 1] - self.offsets[indices]
+        blocks = np.concatenate([self.block_fids[self.offsets[index]:self.offsets[index + 1]]
+                                 for index in indices.tolist()])
+        block_fids, block_indices = np.unique(blocks, return_inverse=True)
+        block_times = np.full(len(block_fids), np.inf)
+        np.minimum.at(block_times, block_indices, np.repeat(times, counts))
+        return dict(zip(block_fids.tolist(), block_times.tolist()))
+
+
+
+# Writes a block table from (street fid, [block fids]) rows
+#   distance: how far from a street its blocks were searched for, kept for reference
+def write_block_table(street_blocks, distance, path):
+    street_blocks = sorted(street_blocks, key=lambda row: row[0])
+    offsets = np.zeros(len(street_blocks) + 1, dtype='<i8')
+    offsets[1:] = np.cumsum([len(blocks) for fid, blocks in street_blocks])
+    block_fids = [block for fid, blocks in street_blocks for block in sorted(blocks)]
+
+    header = np.zeros(1, dtype=header_dtype)
+    header['magic'] = block_table_magic
+    header['street_count'] = len(street_blocks)
+    header['block_count'] = len(block_fids)
+    header['distance'] = distance
+    with open(path, 'wb') as file:
+        header.tofile(file)
+        np.array([fid for fid, blocks in street_blocks], dtype='<i8').tofile(file)
+        offsets.tofile(file)
+        np.array(block_fids, dtype='<i8').tofile(file)
+    return load_block_table(path)
+
+
+# Memory maps a block table written by write_block_table
+def load_block_table(path):
+    header = np.fromfile(path, dtype=header_dtype, count=1)
+    if len(header) == 0 or header['magic'][0] != block_table_magic:
+        raise ValueError(f"{path} is not a block table")
+    street_count = int(header['street_count'][0])
+    block_count = int(header['block_count'][0])
+
+    offset = header_dtype.itemsize
+    street_fids = np.memmap(path, dtype='<i8', mode='r', offset=offset, shape=(street_count,))
+    offset += street_fids.nbytes
+    offsets = np.memmap(path, dtype='<i8', mode='r', offset=offset, shape=(street_count + 1,))
+    offset += offsets.nbytes
+    block_fids = np.memmap(path, dtype='<i8', mode='r', offset=offset, shape=(block_count,))
+    return BlockTable(street_fids, offsets, block_fids, float(header['distance'][0]))
@@ -0,0 +1,183 @@
+import sqlite3
+import struct
+
+
+# Minimal GeoPackage reader, sqlite3 only, so the network can be loaded without QGIS
+#   Geometries are returned as (type name, coordinates) with only x and y kept:
+#     Point (x, y), LineString [(x, y), ...], Polygon [ring, ...],
+#     and Multi* types as lists of their parts
+geometry_types = {1: 'Point', 2: 'LineString', 3: 'Polygon', 4: 'MultiPoint',
+                  5: 'MultiLineString', 6: 'MultiPolygon', 7: 'GeometryCollection'}
+# Bytes of the envelope after a GeoPackage geometry header, by envelope indicator
+envelope_sizes = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+
+class GeoPackage:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+    def __repr__(self):
+        return f"GeoPackage({self.path})"
+
+    def close(self):
+        self.connection.close()
+
+
+    def layer_names(self):
+        rows = self.connection.execute("SELECT table_name FROM gpkg_contents WHERE data_type = 'features'")
+        return [row[0] for row in rows]
+
+
+    # Geometry column and spatial reference (e.g. 'EPSG:2913') of a feature table
+    def geometry_column(self, layer):
+        row = self.connection.execute(
+            "SELECT g.column_name, s.organization, s.organization_coordsys_id "
+            "FROM gpkg_geometry_columns g JOIN gpkg_spatial_ref_sys s ON g.srs_id = s.srs_id "
+            "WHERE g.table_name = ?", (layer,)).fetchone()
+        if row is None:
+            raise KeyError(f"No feature table {layer} in {self.path}")
+        column, organization, code = row
+        return column, f"{organization.upper()}:{code}"
+
+
+    def crs(self, layer):
+        return self.geometry_column(layer)[1]
+
+
+    def fid_column(self, layer):
+        for row in self.connection.execute(f'PRAGMA table_info("{layer}")'):
+            if row[5]:
+                return row[1]
+        return 'rowid'
+
+
+    # Yields (fid, geometry, {field: value}) for every feature of a layer
+    #   fields: names of the attribute columns to read, matched without regard to case
+    #   (as QGIS field lookups are), and keyed as given
+    def features(self, layer, fields=()):
+        geometry_column = self.geometry_column(layer)[0]
+        columns = {row[1].lower(): row[1] for row in self.connection.execute(f'PRAGMA table_info("{layer}")')}
+        missing = [field for field in fields if field.lower() not in columns]
+        if missing:
+            raise KeyError(f"{layer} has no fields {missing}")
+
+        selected = [self.fid_column(layer), geometry_column] + [columns[field.lower()] for field in fields]
+        query = "SELECT " + ", ".join(f'"{column}"' for column in selected) + f' FROM "{layer}"'
+        for row in self.connection.execute(query):
+            geometry = parse_geometry(row[1]) if row[1] is not None else None
+            yield row[0], geometry, dict(zip(fields, row[2:]))
+
+
+
+# Parses a GeoPackage geometry blob (header, envelope, then WKB)
+def parse_geometry(blob):
+    if blob[:2] != b'GP':
+        raise ValueError("Not a GeoPackage geometry")
+    flags = blob[3]
+    if flags & 0b10000:
+        return None
+    envelope = (flags >> 1) & 0b111
+    geometry, position = parse_wkb(blob, 8 + envelope_sizes[envelope])
+    return geometry
+
+
+# Parses one WKB geometry starting at position, returning it and the position after it
+def parse_wkb(data, position):
+    byte_order = '<' if data[position] == 1 else '>'
+    code = struct.unpack_from(byte_order + 'I', data, position + 1)[0]
+    position += 5
+
+    # ISO (1000s for Z, M and ZM) and extended (high bit flags) dimension codes
+    dimensions = 2
+    if code & 0x80000000:
+        dimensions += 1
+    if code & 0x40000000:
+        dimensions += 1
+    code &= 0x0FFFFFFF
+    dimensions += {0: 0, 1: 1, 2: 1, 3: 2}[code // 1000]
+    geometry_type = geometry_types[code % 1000]
+
+    def read_count():
+        nonlocal position
+        count = struct.unpack_from(byte_order + 'I', data, position)[0]
+        position += 4
+        return count
+
+    def read_points(count):
+        nonlocal position
+        values = struct.unpack_from(byte_order + 'd' * (count * dimensions), data, position)
+        position += 8 * count * dimensions
+        return [(values[i], values[i + 1]) for i in range(0, len(values), dimensions)]
+
+    if geometry_type == 'Point':
+        coordinates = read_points(1)[0]
+    elif geometry_type == 'LineString':
+        coordinates = read_points(read_count())
+    elif geometry_type == 'Polygon':
+        coordinates = [read_points(read_count()) for ring in range(read_count())]
+    else:
+        coordinates = []
+        for part in range(read_count()):
+            geometry, position = parse_wkb(data, position)
+            coordinates.append(geometry[1] if geometry_type != 'GeometryCollection' else geometry)
+    return (geometry_type, coordinates), position
+
+
+# Every polyline part of a (Multi)LineString, as get_polylines does for QGIS geometries
+def polylines(geometry):
+    geometry_type, coordinates = geometry
+    if geometry_type == 'MultiLineString':
+        return coordinates
+    if geometry_type == 'LineString':
+        return [coordinates]
+    raise ValueError(f"Expected a line geometry, not {geometry_type}")
+
+
+# The point of a (Multi)Point, the first for a MultiPoint as get_point does
+def point(geometry):
+    geometry_type, coordinates = geometry
+    if geometry_type == 'MultiPoint':
+        return coordinates[0]
+    if geometry_type == 'Point':
+        return coordinates
+    raise ValueError(f"Expected a point geometry, not {geometry_type}")
+
+
+# Area weighted centroid of a (Multi)Polygon, holes taken out, as QgsGeometry.centroid gives
+def centroid(geometry):
+    geometry_type, coordinates = geometry
+    if geometry_type == 'Polygon':
+        polygons = [coordinates]
+    elif geometry_type == 'MultiPolygon':
+        polygons = coordinates
+    else:
+        raise ValueError(f"Expected a polygon geometry, not {geometry_type}")
+
+    total_area = total_x = total_y = 0.0
+    for rings in polygons:
+        for index, ring in enumerate(rings):
+            area, x, y = ring_centroid(ring)
+            # The first ring is the outside, the rest are holes
+            if index:
+                area = -area
+            total_area += area
+            total_x += area * x
+            total_y += area * y
+    if total_area == 0:
+        points = [point for rings in polygons for point in rings[0]]
+        return (sum(x for x, y in points) / len(points), sum(y for x, y in points) / len(points))
+    return total_x / total_area, total_y / total_area
+
+
+# Unsigned area and centroid of a closed ring (shoelace formula)
+def ring_centroid(ring):
+    area = x = y = 0.0
+    for (x0, y0), (x1, y1) in zip(ring, ring[1:]):
+        cross = x0 * y1 - x1 * y0
+        area += cross
+        x += (x0 + x1) * cross
+        y += (y0 + y1) * cross
+    if area == 0:
+        return 0.0, 0.0, 0.0
+    return abs(area) / 2, x / (3 * area), y / (3 * area)
@@ -0,0 +1,269 @@
+import sqlite3
+import struct
+import time
+import GeoPackage
+
+
+# Writes the service areas of a batch into one GeoPackage feature table, sqlite3 only
+#   One row per origin, time limit and band:
+#     fid, geom (MULTIPOLYGON), origin TEXT, budget_min REAL, band_min REAL (NULL without bands)
+#   Everything goes through one connection, in transactions of batch_size origins, and an
+#   origin's rows are only committed together, so after a crash written lists exactly the
+#   (origin, budget_min) pairs that are complete and a rerun can skip them
+#   The rtree spatial index is built once, in close (it is dropped on opening a table to add
+#   to, rather than kept up to date insert by insert)
+#   crs: 'EPSG:2913' style id of the geometries, definition its WKT
+gpkg_application_id = 0x47504B47
+gpkg_user_version = 10300
+rtree_extension = 'http://www.geopackage.org/spec120/#extension_rtree'
+gpkg_schema = """
+CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (
+    srs_name TEXT NOT NULL,
+    srs_id INTEGER NOT NULL PRIMARY KEY,
+    organization TEXT NOT NULL,
+    organization_coordsys_id INTEGER NOT NULL,
+    definition TEXT NOT NULL,
+    description TEXT);
+CREATE TABLE IF NOT EXISTS gpkg_contents (
+    table_name TEXT NOT NULL PRIMARY KEY,
+    data_type TEXT NOT NULL,
+    identifier TEXT UNIQUE,
+    description TEXT DEFAULT '',
+    last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+    min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE,
+    srs_id INTEGER,
+    CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id));
+CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (
+    table_name TEXT NOT NULL,
+    column_name TEXT NOT NULL,
+    geometry_type_name TEXT NOT NULL,
+    srs_id INTEGER NOT NULL,
+    z TINYINT NOT NULL,
+    m TINYINT NOT NULL,
+    CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+    CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),
+    CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id));
+CREATE TABLE IF NOT EXISTS gpkg_extensions (
+    table_name TEXT,
+    column_name TEXT,
+    extension_name TEXT NOT NULL,
+    definition TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name));
+INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES
+    ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', 'undefined cartesian coordinate reference system'),
+    ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', 'undefined geographic coordinate reference system');
+"""
+
+
+class GeoPackageWriter:
+    def __init__(self, path, crs, definition='undefined', table='service_areas', batch_size=100):
+        self.path = path
+        self.table = table
+        self.batch_size = batch_size
+        organization, code = crs.split(':')
+        self.srs_id = int(code)
+
+        # Transactions are begun and committed here, not by sqlite3
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        register_geometry_functions(self.connection)
+        self.connection.execute(f"PRAGMA application_id = {gpkg_application_id}")
+        self.connection.execute(f"PRAGMA user_version = {gpkg_user_version}")
+        self.connection.executescript(gpkg_schema)
+        self.connection.execute("BEGIN")
+        self.connection.execute("INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, NULL)",
+                                (crs, self.srs_id, organization.upper(), self.srs_id, definition))
+        self.connection.execute(
+            f'CREATE TABLE IF NOT EXISTS "{table}" (fid INTEGER PRIMARY KEY AUTOINCREMENT, geom MULTIPOLYGON, '
+            f'origin TEXT NOT NULL, budget_min REAL NOT NULL, band_min REAL)')
+        self.connection.execute(f'CREATE INDEX IF NOT EXISTS "{table}_origin" ON "{table}" (origin, budget_min)')
+        self.connection.execute("INSERT OR IGNORE INTO gpkg_contents (table_name, data_type, identifier, srs_id) "
+                                "VALUES (?, 'features', ?, ?)", (table, table, self.srs_id))
+        self.connection.execute("INSERT OR IGNORE INTO gpkg_geometry_columns VALUES (?, 'geom', 'MULTIPOLYGON', ?, 0, 0)",
+                                (table, self.srs_id))
+        self.drop_spatial_index()
+        self.connection.execute("COMMIT")
+
+        self.written = set(self.connection.execute(f'SELECT DISTINCT origin, budget_min FROM "{table}"'))
+        self.resumed = len(self.written)
+        self.pending = 0
+        self.row_count = 0
+        self.connection.execute("BEGIN")
+
+    def __repr__(self):
+        return (f"GeoPackageWriter({self.path}, table: {self.table}, origins: {len(self.written)}, "
+                f"{self.resumed} from before)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+    # Whether an origin's rows for a time limit (hours) are already in the table
+    def has_origin(self, origin, time_limit):
+        return (str(origin), budget_minutes(time_limit)) in self.written
+
+
+    # Adds every row of an origin for a time limit (hours), committed with its batch
+    #   rows: (band limit in hours or None, geometry WKB, (min x, min y, max x, max y) or None)
+    #   The envelope is read from the WKB when not given. An origin without rows (nothing
+    #   reachable) gets one with a NULL geometry, so it counts as written too.
+    def add_origin(self, origin, time_limit, rows):
+        origin, budget = str(origin), budget_minutes(time_limit)
+        rows = list(rows) or [(None, None, None)]
+        self.connection.executemany(
+            f'INSERT INTO "{self.table}" (geom, origin, budget_min, band_min) VALUES (?, ?, ?, ?)',
+            ((None if wkb is None else geometry_blob(self.srs_id, wkb, envelope), origin, budget,
+              None if band is None else budget_minutes(band)) for band, wkb, envelope in rows))
+        self.written.add((origin, budget))
+        self.row_count += len(rows)
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.commit()
+
+
+    # Deletes every row, to write the table over instead of adding to it
+    def clear(self):
+        self.connection.execute(f'DELETE FROM "{self.table}"')
+        self.written.clear()
+        self.resumed = 0
+
+
+    def commit(self):
+        self.connection.execute("COMMIT")
+        self.pending = 0
+        self.connection.execute("BEGIN")
+
+
+    # Commits what's left, then builds the spatial index and the table's extent
+    def close(self):
+        if self.connection is None:
+            return
+        self.connection.execute("COMMIT")
+        self.connection.execute("BEGIN")
+        self.create_spatial_index()
+        self.connection.execute(
+            f'UPDATE gpkg_contents SET (min_x, min_y, max_x, max_y, last_change) = '
+            f'(SELECT MIN(minx), MIN(miny), MAX(maxx), MAX(maxy), strftime(\'%Y-%m-%dT%H:%M:%fZ\',\'now\') '
+            f'FROM "{self.rtree_name()}") WHERE table_name = ?', (self.table,))
+        self.connection.execute("COMMIT")
+        self.connection.close()
+        self.connection = None
+
+
+    def rtree_name(self):
+        return f"rtree_{self.table}_geom"
+
+
+    def drop_spatial_index(self):
+        rtree = self.rtree_name()
+        for trigger in ('insert', 'update1', 'update2', 'update3', 'update4', 'delete'):
+            self.connection.execute(f'DROP TRIGGER IF EXISTS "{rtree}_{trigger}"')
+        self.connection.execute(f'DROP TABLE IF EXISTS "{rtree}"')
+        self.connection.execute("DELETE FROM gpkg_extensions WHERE table_name = ? AND extension_name = 'gpkg_rtree_index'",
+                                (self.table,))
+
+
+    # The rtree of the GeoPackage spec, filled in one pass, with the triggers keeping it up
+    #   to date for whatever edits the table later (QGIS, GDAL)
+    def create_spatial_index(self):
+        table, rtree = self.table, self.rtree_name()
+        start_time = time.perf_counter()
+        self.connection.execute(f'CREATE VIRTUAL TABLE "{rtree}" USING rtree(id, minx, maxx, miny, maxy)')
+        self.connection.execute(f'INSERT INTO "{rtree}" SELECT fid, ST_MinX(geom), ST_MaxX(geom), ST_MinY(geom), '
+                                f'ST_MaxY(geom) FROM "{table}" WHERE geom NOT NULL AND NOT ST_IsEmpty(geom)')
+        bounds = "ST_MinX(NEW.geom), ST_MaxX(NEW.geom), ST_MinY(NEW.geom), ST_MaxY(NEW.geom)"
+        triggers = [
+            (f'CREATE TRIGGER "{rtree}_insert" AFTER INSERT ON "{table}" '
+             f'WHEN (NEW.geom NOT NULL AND NOT ST_IsEmpty(NEW.geom)) '
+             f'BEGIN INSERT OR REPLACE INTO "{rtree}" VALUES (NEW.fid, {bounds}); END'),
+            (f'CREATE TRIGGER "{rtree}_update1" AFTER UPDATE OF geom ON "{table}" '
+             f'WHEN OLD.fid = NEW.fid AND (NEW.geom NOTNULL AND NOT ST_IsEmpty(NEW.geom)) '
+             f'BEGIN INSERT OR REPLACE INTO "{rtree}" VALUES (NEW.fid, {bounds}); END'),
+            (f'CREATE TRIGGER "{rtree}_update2" AFTER UPDATE OF geom ON "{table}" '
+             f'WHEN OLD.fid = NEW.fid AND (NEW.geom ISNULL OR ST_IsEmpty(NEW.geom)) '
+             f'BEGIN DELETE FROM "{rtree}" WHERE id = OLD.fid; END'),
+            (f'CREATE TRIGGER "{rtree}_update3" AFTER UPDATE ON "{table}" '
+             f'WHEN OLD.fid != NEW.fid AND (NEW.geom NOTNULL AND NOT ST_IsEmpty(NEW.geom)) '
+             f'BEGIN DELETE FROM "{rtree}" WHERE id = OLD.fid; '
+             f'INSERT OR REPLACE INTO "{rtree}" VALUES (NEW.fid, {bounds}); END'),
+            (f'CREATE TRIGGER "{rtree}_update4" AFTER UPDATE ON "{table}" '
+             f'WHEN OLD.fid != NEW.fid AND (NEW.geom ISNULL OR ST_IsEmpty(NEW.geom)) '
+             f'BEGIN DELETE FROM "{rtree}" WHERE id IN (OLD.fid, NEW.fid); END'),
+            (f'CREATE TRIGGER "{rtree}_delete" AFTER DELETE ON "{table}" '
+             f'WHEN OLD.geom NOT NULL '
+             f'BEGIN DELETE FROM "{rtree}" WHERE id = OLD.fid; END'),
+        ]
+        for trigger in triggers:
+            self.connection.execute(trigger)
+        self.connection.execute("INSERT INTO gpkg_extensions VALUES (?, 'geom', 'gpkg_rtree_index', ?, 'write-only')",
+                                (table, rtree_extension))
+        print(f"Built the spatial index of {self.row_count} new rows ({len(self.written)} origins) "
+              f"in {time.perf_counter() - start_time:.2f} s")
+
+
+
+# Minutes rows are written under, rounded so hour fractions from different callers match
+def budget_minutes(time_limit):
+    return round(time_limit * 60, 3)
+
+
+# GeoPackage geometry blob: little endian header with the srs id and xy envelope, then the WKB
+def geometry_blob(srs_id, wkb, envelope=None):
+    if envelope is None:
+        envelope = wkb_envelope(wkb)
+    if envelope is None:
+        # Empty geometry flag, no envelope
+        return b'GP\x00\x11' + struct.pack('<i', srs_id) + wkb
+    min_x, min_y, max_x, max_y = envelope
+    return b'GP\x00\x03' + struct.pack('<i4d', srs_id, min_x, max_x, min_y, max_y) + wkb
+
+
+# (min x, min y, max x, max y) of a WKB geometry, None when it is empty
+def wkb_envelope(wkb):
+    geometry, position = GeoPackage.parse_wkb(wkb, 0)
+    points = list(geometry_points(geometry[1]))
+    if not points:
+        return None
+    xs = [x for x, y in points]
+    ys = [y for x, y in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def geometry_points(coordinates):
+    if isinstance(coordinates, tuple):
+        yield coordinates
+    else:
+        for part in coordinates:
+            yield from geometry_points(part)
+
+
+# Envelope of a geometry blob by its header, or None when it is empty or has no envelope
+def blob_envelope(blob):
+    if blob is None or blob[3] & 0b10000:
+        return None
+    if (blob[3] >> 1) & 0b111 == 0:
+        return wkb_envelope(blob[8:])
+    byte_order = '<' if blob[3] & 1 else '>'
+    min_x, max_x, min_y, max_y = struct.unpack_from(byte_order + '4d', blob, 8)
+    return min_x, min_y, max_x, max_y
+
+
+# The spatial functions the rtree triggers of the GeoPackage spec call
+#   QGIS and GDAL have their own, a plain sqlite3 connection needs these
+def register_geometry_functions(connection):
+    def bound(index):
+        def function(blob):
+            envelope = blob_envelope(blob)
+            return None if envelope is None else envelope[index]
+        return function
+
+    connection.create_function('ST_MinX', 1, bound(0), deterministic=True)
+    connection.create_function('ST_MinY', 1, bound(1), deterministic=True)
+    connection.create_function('ST_MaxX', 1, bound(2), deterministic=True)
+    connection.create_function('ST_MaxY', 1, bound(3), deterministic=True)
+    connection.create_function('ST_IsEmpty', 1, lambda blob: blob is None or blob_envelope(blob) is None,
+                               deterministic=True)
@@ -0,0 +1,151 @@
+import os
+import WalkingNetwork
+import TransferTable
+import BlockTable
+import TransitIndex
+import StopIndex
+import NetworkData
+
+# Layers the network is built from, named the same in the QGIS project and its GeoPackages
+streets_name = '1HrWalkableRoads_NoHighways'
+route_stops_name = 'trimet_route_stops'
+stops_name = 'trimet_stops'
+routes_name = 'trimet_routes'
+blocks_name = 'census_blocks_land_only'
+
+
+# Builds the network data a search needs from the project's layers, however they are read
+#   source: reads the features of a layer by name, in the street layer's crs
+#     crs_id(): authority id of the street layer's crs, e.g. EPSG:2913
+#     polylines(name, fields): yields (fid, [polyline parts of (x, y)], {field: value})
+#     points(name, fields): yields (fid, (x, y), {field: value})
+#     (ProjectInteraction reads the QGIS layers, NetworkLoader the GeoPackages behind them)
+#   transfer_table_path, block_table_path: optional precomputed tables, used when they exist
+# Nothing is read until it's first asked for, and then only once
+class NetworkBuilder:
+    def __init__(self, source, transfer_table_path=None, block_table_path=None):
+        self.source = source
+        self.transfer_table_path = transfer_table_path
+        self.block_table_path = block_table_path
+
+        self.walking_network = None
+        self.route_stop_records = {}
+        self.route_stop_points = []
+        self.transfer_table = None
+        self.block_table = None
+        self.route_index = None
+        self.route_geometries = {}
+        self.headway_table = None
+        self.stop_index = None
+        self.network_data = None
+
+
+    # Everything a search needs, built once
+    def get_network_data(self):
+        if self.network_data is None:
+            self.network_data = NetworkData.NetworkData(self.get_walking_network(), self.get_stop_index(),
+                                                        self.get_route_index(), self.get_headway_table(),
+                                                        self.route_stop_records, self.get_transfer_table())
+        return self.network_data
+
+
+    # Takes everything from a NetworkSnapshot instead of reading the layers
+    def use_snapshot(self, snapshot):
+        network = snapshot.network_data
+        self.network_data = network
+        self.walking_network = network.walking_network
+        self.stop_index = network.stop_index
+        self.route_index = network.route_index
+        self.headway_table = network.headway_table
+        self.transfer_table = network.transfer_table
+        self.block_table = snapshot.block_table
+        self.route_stop_records.clear()
+        self.route_stop_records.update(network.route_stop_records)
+        self.route_geometries.clear()
+        self.route_geometries.update(snapshot.get_route_geometries() or {})
+
+
+    # Loads the street layer (with the route stops snapped onto it) into a WalkingNetwork
+    #   Every walking search afterwards runs against the in-memory graph
+    def get_walking_network(self):
+        if self.walking_network is None:
+            street_parts = [(fid, part) for fid, parts, values in self.source.polylines(streets_name, ())
+                            for part in parts]
+            stop_points = [(fid, x, y) for fid, rte, direction, x, y in self.get_route_stop_points()]
+            self.walking_network = WalkingNetwork.build_walking_network(street_parts, stop_points)
+            print(f"Loaded {self.walking_network}")
+        return self.walking_network
+
+
+    # Reads every route stop once, keeping its attributes for the path records built from searches
+    # Returns a list of (fid, rte, dir, x, y)
+    def get_route_stop_points(self):
+        if not self.route_stop_points:
+            self.route_stop_records.clear()
+            for fid, (x, y), values in self.source.points(route_stops_name, ('fid', 'stop_id', 'rte', 'dir')):
+                self.route_stop_points.append((fid, values['rte'], values['dir'], x, y))
+                self.route_stop_records[fid] = values
+        return self.route_stop_points
+
+
+    # Loads the stop sequence and cumulative ride times of every route pattern once,
+    #   keeping each pattern's geometry for drawing the sections ridden
+    #   Ride times come from each route's KILO_FT_PER_HOUR, as in the old shortest path searches
+    def get_route_index(self):
+        if self.route_index is None:
+            routes = []
+            self.route_geometries.clear()
+            for fid, parts, values in self.source.polylines(routes_name, ('rte', 'dir', 'KILO_FT_PER_HOUR')):
+                routes.append((values['rte'], values['dir'], values['KILO_FT_PER_HOUR'], parts))
+                self.route_geometries.setdefault((values['rte'], values['dir']), []).extend(parts)
+            self.route_index = TransitIndex.build_route_pattern_index(routes, self.get_route_stop_points())
+            print(f"Loaded {self.route_index}")
+        return self.route_index
+
+
+    # Indexes the stop_id, fid and location of every stop once
+    def get_stop_index(self):
+        if self.stop_index is None:
+            stops = [(values['fid'], values['stop_id'], x, y)
+                     for fid, (x, y), values in self.source.points(stops_name, ('fid', 'stop_id'))]
+            self.stop_index = StopIndex.build_stop_index(stops, self.source.crs_id())
+            print(f"Loaded {self.stop_index}")
+        return self.stop_index
+
+
+    # Reads TRIPS_PER_HOUR of every route once, for the waits in Search.add_search_nodes
+    def get_headway_table(self):
+        if self.headway_table is None:
+            self.headway_table = TransitIndex.build_headway_table(
+                (values['rte'], values['dir'], values['TRIPS_PER_HOUR'])
+                for fid, parts, values in self.source.polylines(routes_name, ('rte', 'dir', 'TRIPS_PER_HOUR')))
+            print(f"Loaded {self.headway_table}")
+        return self.headway_table
+
+
+    # Memory maps the transfer table, if one has been built
+    def get_transfer_table(self):
+        if self.transfer_table is None and self.transfer_table_path and os.path.exists(self.transfer_table_path):
+            self.transfer_table = TransferTable.load_transfer_table(self.transfer_table_path)
+            print(f"Loaded {self.transfer_table}")
+        return self.transfer_table
+
+
+    # Memory maps the street to block table, if one has been built
+    def get_block_table(self):
+        if self.block_table is None and self.block_table_path and os.path.exists(self.block_table_path):
+            self.block_table = BlockTable.load_block_table(self.block_table_path)
+            print(f"Loaded {self.block_table}")
+        return self.block_table
+
+
+
+# Splits a coordinate string of the form "x,y [EPSG:1234]" into an (x, y) and crs id
+#   The crs is None when the string doesn't give one
+def parse_coord_string(coord_string):
+    parts = coord_string.split()
+    x, y = (float(value) for value in parts[0].split(','))
+    crs = None
+    if len(parts) > 1:
+        crs = parts[1].split('[')[1].split(']')[0]
+    return (x, y), crs
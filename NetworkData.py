@@ -0,0 +1,208 @@
+import numpy as np
+
+
+walk_feet_per_hour = 14784  #feet walkable in one hour \
+    #assuming a walking speed of 2.8 mph
+
+
+# Everything a search reads, independent of QGIS
+#   walking_network: WalkingNetwork of the streets, with the route stops snapped onto it
+#   stop_index: StopIndex of the stops (walking nodes)
+#   route_index: RoutePatternIndex of the route stops (transit nodes)
+#   headway_table: HeadwayTable of the routes
+#   route_stop_records: route stop fid -> {'fid', 'stop_id', 'rte', 'dir'}
+#   transfer_table: optional TransferTable of precomputed walks from the stops
+#   snapshot_path: the NetworkSnapshot it was loaded from, if any
+# Only read during a search, so one copy can be shared by any number of searches
+#   (or pickled to worker processes, see BatchSearch)
+class NetworkData:
+    def __init__(self, walking_network, stop_index, route_index, headway_table, route_stop_records,
+                 transfer_table=None):
+        self.walking_network = walking_network
+        self.stop_index = stop_index
+        self.route_index = route_index
+        self.headway_table = headway_table
+        self.route_stop_records = route_stop_records
+        self.transfer_table = transfer_table
+        self.snapshot_path = None
+        # RouteStopTable of the route stop records, built on first use (see route_stop_table)
+        self.route_stops = None
+        # Position in the RouteStopTable of every walking network stop, built on first use
+        #   (see route_stops_within)
+        self.walking_stop_positions = None
+
+    def __repr__(self):
+        return (f"NetworkData({self.walking_network}, {self.stop_index}, {self.route_index}, "
+                f"transfer table: {self.transfer_table is not None})")
+
+
+    # Location of a search node in the network's coordinate system
+    def node_point(self, node):
+        if node.is_search_origin:
+            return node.point
+        return self.stop_index.get_point(node.id)
+
+
+    # Network node a walking search starts from, and the cost (in feet) spent to get there
+    def walking_source(self, node):
+        x, y = self.node_point(node)
+        network_node, snap_length = self.walking_network.nearest_node(x, y)
+        return network_node, walk_feet_per_hour * node.time + snap_length
+
+
+    # Street edges walkable from any of the walking sources before time_limit
+    def walked_edges(self, walking_sources, time_limit):
+        return self.walking_network.walked_edges(walking_sources, walk_feet_per_hour * time_limit)
+
+
+    # walked_edges with the time each edge was reached at, edge -> hours
+    def walked_edge_times(self, walking_sources, time_limit):
+        edge_costs = self.walking_network.walked_edge_costs(walking_sources, walk_feet_per_hour * time_limit)
+        return {edge: cost / walk_feet_per_hour for edge, cost in edge_costs.items()}
+
+
+    # Earliest time each street feature is reached at, from edge -> hours
+    #   (a street split into several edges is reached with its first edge)
+    def street_times(self, edge_times):
+        street_times = {}
+        edge_fids = self.walking_network.edge_fids
+        for edge, time in edge_times.items():
+            fid = int(edge_fids[edge])
+            if fid not in street_times or time < street_times[fid]:
+                street_times[fid] = time
+        return street_times
+
+
+    def route_stop_table(self):
+        if self.route_stops is None:
+            self.route_stops = RouteStopTable(self.route_stop_records, self.stop_index, self.headway_table)
+        return self.route_stops
+
+
+    # Route stops a walk from a node could reach in the time remaining, with a lower bound on the
+    #   hours to each, from the straight line to it (see WalkingNetwork.stops_within)
+    #   Bounds are a millionth short, so they stay below transfer table costs rounded to float32
+    # Returns (positions in the RouteStopTable, lower bounds in hours)
+    def route_stops_within(self, node, time_limit):
+        if self.walking_stop_positions is None:
+            self.walking_stop_positions = self.route_stop_table().positions(self.walking_network.stop_fids)
+        x, y = self.node_point(node)
+        stops, bounds = self.walking_network.stops_within(x, y, walk_feet_per_hour * (time_limit - node.time))
+        return self.walking_stop_positions[stops], bounds * (1 - 1e-6) / walk_feet_per_hour
+
+
+    # StopPaths to route stops (fids) reached at a cost in hours, in the order given,
+    #   dropping the ones without a cost (the stop searched from, which is never searched again)
+    def stop_paths(self, route_stop_fids, costs):
+        reached = costs != 0
+        table = self.route_stop_table()
+        return StopPaths(table, table.positions(route_stop_fids[reached]), costs[reached])
+
+
+    # Finds the route stops reachable on foot from a node in the time remaining
+    #   Stops use the precomputed transfer table when there is one, anything else
+    #   (the search origin, or no table) walks the in-memory street network
+    # Returns StopPaths sorted by descending cost in hours
+    # The walked street edges aren't computed here, see walked_edges
+    def reachable_stops_walking(self, node, time_limit):
+        max_distance = walk_feet_per_hour * (time_limit - node.time)
+
+        transfers = None
+        if self.transfer_table is not None and not node.is_search_origin:
+            transfers = self.transfer_table.transfers(node.id, max_distance)
+        if transfers is not None:
+            route_stop_fids, distances = transfers
+        else:
+            x, y = self.node_point(node)
+            route_stop_fids, distances = self.walking_network.search_stop_arrays(x, y, max_distance)
+
+        costs = distances.astype(np.float64) / walk_feet_per_hour
+        reachable = np.flatnonzero(node.time + costs <= time_limit)
+        # Stable, so stops at the same cost keep the order the walk found them in
+        order = reachable[np.argsort(-costs[reachable], kind='stable')]
+        return self.stop_paths(route_stop_fids[order], costs[order])
+
+
+    # Rides the node's route pattern to every downstream stop reachable in the time remaining
+    # Returns StopPaths like reachable_stops_walking, and the (pattern, start measure,
+    #   end measure) span of route ridden, or None
+    def reachable_stops_transit(self, node, time_limit):
+        route_stop_fids, costs, span = self.route_index.downstream(node.id, node.time, time_limit)
+        # Downstream stops cost more the farther along they are, reversed they are by descending cost
+        return self.stop_paths(route_stop_fids[::-1], costs[::-1]), span
+
+
+
+# What a search reads of every route stop record, as arrays over the route stops sorted by fid
+#   fids: route stop fids (the keys of route_stop_records), sorted
+#   label_fids: each record's 'fid', the id of a transit node at it (rides start from it, see
+#     RoutePatternIndex.downstream)
+#   stop_positions: position of its stop (the walk node it labels) in the stop index's
+#     sorted fids, -1 for a stop_id the stop index doesn't have
+#   waits: average wait of its route in hours (half the headway), inf when the route has
+#     no trips, nan when the route isn't in the headway table
+#   route_keys: (rte, dir) of each
+class RouteStopTable:
+    def __init__(self, route_stop_records, stop_index, headway_table):
+        self.fids = np.array(sorted(route_stop_records), dtype=np.int64)
+        records = [route_stop_records[fid] for fid in self.fids.tolist()]
+        self.label_fids = np.array([record['fid'] for record in records], dtype=np.int64)
+        stop_fids = np.array([stop_fid_or_missing(stop_index, record['stop_id']) for record in records],
+                             dtype=np.int64)
+        self.stop_positions = np.where(stop_fids >= 0, np.searchsorted(stop_index.fids, stop_fids), -1)
+        self.route_keys = [(record['rte'], record['dir']) for record in records]
+        trips_per_hour = headway_table.trips_per_hour
+        self.waits = np.array([route_wait(trips_per_hour.get(key, np.nan)) for key in self.route_keys],
+                              dtype=np.float64)
+
+    def __repr__(self):
+        return f"RouteStopTable(route stops: {len(self.fids)})"
+
+    # Positions of route stop fids in the table
+    def positions(self, route_stop_fids):
+        return np.searchsorted(self.fids, route_stop_fids)
+
+
+def stop_fid_or_missing(stop_index, stop_id):
+    try:
+        return stop_index.get_fid(stop_id)
+    except KeyError:
+        return -1
+
+
+def route_wait(trips):
+    if not trips:
+        return np.inf
+    return (1 / trips) / 2
+
+
+
+# Route stops reached by a walk or a ride, sorted by descending cost
+#   route_stops: positions in the network's RouteStopTable
+#   costs: hours to reach each
+# Slicing keeps the table, so the cheapest paths of a walk shed are paths[-count:]
+class StopPaths:
+    __slots__ = ('table', 'route_stops', 'costs')
+
+    def __init__(self, table, route_stops, costs):
+        self.table = table
+        self.route_stops = route_stops
+        self.costs = costs
+
+    def __repr__(self):
+        return f"StopPaths({len(self.costs)} route stops)"
+
+    def __len__(self):
+        return len(self.costs)
+
+    def __getitem__(self, index):
+        return StopPaths(self.table, self.route_stops[index], self.costs[index])
+
+    def stop_positions(self):
+        return self.table.stop_positions[self.route_stops]
+
+    def waits(self):
+        return self.table.waits[self.route_stops]
+
+    def nbytes(self):
+        return self.route_stops.nbytes + self.costs.nbytes
@@ -0,0 +1,211 @@
+import os
+import NetworkBuilder
+import NetworkSnapshot
+import GeoPackage
+import Timetable
+import ResultCache
+
+# Same layers the QGIS project uses
+streets_name = NetworkBuilder.streets_name
+route_stops_name = NetworkBuilder.route_stops_name
+stops_name = NetworkBuilder.stops_name
+routes_name = NetworkBuilder.routes_name
+blocks_name = NetworkBuilder.blocks_name
+
+
+# Loads NetworkData straight from the GeoPackages behind the QGIS project, without QGIS
+#   streets_path: GeoPackage with the street layer (AreaFiles.gpkg)
+#   transit_path: GeoPackage with the stop, route stop and route layers (WorkingFiles.gpkg)
+#   transfer_table_path, block_table_path: optional precomputed tables
+#   gtfs_path: optional GTFS feed (directory or zip) for departure time searches
+#   snapshot_path: optional NetworkSnapshot, read instead of the GeoPackages while it is
+#     up to date, and (re)written from them when it isn't. Without any GeoPackage paths
+#     the snapshot is used as is.
+#   verify_snapshot: check the snapshot's checksum when loading it (see NetworkSnapshot)
+# The network is built as in QGIS (see NetworkBuilder), from the GeoPackages' features
+# Everything is kept in the street layer's crs; other layers are reprojected with pyproj
+#   (only needed when their crs differs)
+class NetworkLoader(NetworkBuilder.NetworkBuilder):
+    def __init__(self, streets_path, transit_path, transfer_table_path=None, block_table_path=None,
+                 snapshot_path=None, gtfs_path=None, verify_snapshot=False):
+        super().__init__(self, transfer_table_path, block_table_path)
+        self.streets_path = streets_path
+        self.transit_path = transit_path
+        self.snapshot_path = snapshot_path
+        self.gtfs_path = gtfs_path
+        self.verify_snapshot = verify_snapshot
+
+        self.streets = None
+        self.transit = None
+        self.snapshot = None
+        self.snapshot_checked = False
+        self.timetables = {}
+
+    def __repr__(self):
+        return f"NetworkLoader({self.streets_path}, {self.transit_path})"
+
+
+    def get_streets(self):
+        if self.streets is None:
+            self.streets = GeoPackage.GeoPackage(self.streets_path)
+        return self.streets
+
+
+    def get_transit(self):
+        if self.transit is None:
+            self.transit = GeoPackage.GeoPackage(self.transit_path)
+        return self.transit
+
+
+    # crs of the street layer, that every search works in
+    def get_crs(self):
+        if self.get_snapshot() is not None:
+            return self.snapshot.network_data.stop_index.crs
+        return self.get_streets().crs(streets_name)
+
+
+    def source_paths(self):
+        return [self.streets_path, self.transit_path, self.transfer_table_path, self.block_table_path]
+
+
+    # Key of the network for the ResultCache
+    #   A snapshot used on its own is keyed by the sources it was built from
+    def get_network_key(self):
+        if not (self.streets_path or self.transit_path) and self.get_snapshot() is not None:
+            stamp = self.snapshot.source_stamp
+        else:
+            stamp = NetworkSnapshot.source_stamp(self.source_paths())
+        return ResultCache.network_key(stamp, self.gtfs_path)
+
+
+    # The snapshot, if there is one and it is up to date with the GeoPackages
+    def get_snapshot(self):
+        if not self.snapshot_checked and self.snapshot_path and os.path.exists(self.snapshot_path):
+            self.snapshot_checked = True
+            stamp = None
+            if self.streets_path or self.transit_path:
+                stamp = NetworkSnapshot.source_stamp(self.source_paths())
+            try:
+                self.snapshot = NetworkSnapshot.load_snapshot(self.snapshot_path, stamp, self.verify_snapshot)
+                print(f"Loaded {self.snapshot}")
+            except ValueError as error:
+                print(f"Not using the snapshot: {error}")
+            else:
+                self.use_snapshot(self.snapshot)
+        return self.snapshot
+
+
+    # Everything a search needs, as ProjectInteraction.get_network_data
+    #   Read from the snapshot when it is up to date, otherwise built from the GeoPackages
+    #   (and written to the snapshot path for next time)
+    def get_network_data(self):
+        if self.network_data is None and self.get_snapshot() is None:
+            super().get_network_data()
+            if self.snapshot_path:
+                self.write_snapshot(self.snapshot_path)
+        return self.network_data
+
+
+    # Compiles everything read from the GeoPackages into a snapshot
+    def write_snapshot(self, path):
+        self.get_route_index()
+        self.snapshot_checked = True
+        self.snapshot = NetworkSnapshot.write_snapshot(path, self.get_network_data(),
+                                                       NetworkSnapshot.source_stamp(self.source_paths()),
+                                                       self.get_block_table(), self.route_geometries)
+        print(f"Wrote {self.snapshot}")
+        return self.snapshot
+
+
+    def get_block_table(self):
+        self.get_snapshot()
+        return super().get_block_table()
+
+
+    # NetworkBuilder source: the features of a layer in the street layer's crs
+    def polylines(self, name, fields):
+        geopackage = self.get_layer_geopackage(name)
+        transform = self.get_transform(geopackage.crs(name))
+        for fid, geometry, values in geopackage.features(name, fields):
+            parts = GeoPackage.polylines(geometry) if geometry is not None else []
+            yield fid, [[transform_point(transform, point) for point in part] for part in parts], values
+
+
+    def points(self, name, fields):
+        geopackage = self.get_layer_geopackage(name)
+        transform = self.get_transform(geopackage.crs(name))
+        for fid, geometry, values in geopackage.features(name, fields):
+            yield fid, transform_point(transform, GeoPackage.point(geometry)), values
+
+
+    def crs_id(self):
+        return self.get_crs()
+
+
+    def get_layer_geopackage(self, name):
+        return self.get_streets() if name == streets_name else self.get_transit()
+
+
+    # Census blocks of a GeoPackage as accessibility matrix origins, (block fid, centroid) in the
+    #   street layer's crs, and block fid -> weight_field (blocks without a value left out), or None
+    def get_block_origins(self, blocks_path, weight_field=None):
+        blocks = GeoPackage.GeoPackage(blocks_path)
+        transform = self.get_transform(blocks.crs(blocks_name))
+        origins = []
+        weights = {} if weight_field else None
+        for fid, geometry, values in blocks.features(blocks_name, (weight_field,) if weight_field else ()):
+            if geometry is None:
+                continue
+            origins.append((fid, transform_point(transform, GeoPackage.centroid(geometry))))
+            if weight_field and values[weight_field] is not None:
+                weights[fid] = float(values[weight_field])
+        blocks.close()
+        return origins, weights
+
+
+    # Trips of the GTFS feed running on a date, read once per date and joined to the stops
+    def get_timetable(self, service_date):
+        if service_date not in self.timetables:
+            if not self.gtfs_path:
+                raise ValueError("A GTFS feed is needed for departure time searches")
+            timetable = Timetable.load_timetable(self.gtfs_path, service_date)
+            network = self.get_network_data()
+            timetable.join_stops(network.stop_index, network.route_stop_records)
+            self.timetables[service_date] = timetable
+            print(f"Loaded {timetable}")
+        return self.timetables[service_date]
+
+
+    # Transform from a crs into the street layer's, or None when they already match
+    def get_transform(self, crs):
+        return get_transform(crs, self.get_crs())
+
+
+    # Converts a coordinate string ("x,y [EPSG:1234]", or just "x,y" in the street layer's crs)
+    #   into an (x, y) in the street layer's crs
+    def get_origin_point(self, coord_string):
+        point, crs = parse_coord_string(coord_string)
+        return transform_point(self.get_transform(crs or self.get_crs()), point)
+
+
+
+# Splits a coordinate string into an (x, y) and crs id (None when it doesn't give one)
+parse_coord_string = NetworkBuilder.parse_coord_string
+
+
+# pyproj transformer between two crs ids, or None when they match
+#   pyproj is only imported here, so it's only needed when some layer's crs differs
+def get_transform(from_crs, to_crs):
+    if from_crs == to_crs:
+        return None
+    try:
+        import pyproj
+    except ImportError:
+        raise ImportError(f"pyproj is needed to reproject from {from_crs} to {to_crs}") from None
+    return pyproj.Transformer.from_crs(from_crs, to_crs, always_xy=True)
+
+
+def transform_point(transform, point):
+    if transform is None:
+        return point
+    return transform.transform(point[0], point[1])
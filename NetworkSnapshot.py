@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+import numpy as np
+import WalkingNetwork
+import TransferTable
+import BlockTable
+import TransitIndex
+import StopIndex
+import NetworkData
+
+
+# Everything built from the project's layers, compiled into one file for fast startup
+#     header          (magic, version, metadata length)
+#     metadata        JSON: crs, pattern keys, headways, route stop records, source stamp,
+#                     the checksum of the arrays, and the dtype, shape and offset of every array
+#     arrays          raw little endian arrays, each starting on a 64 byte boundary
+# Arrays are memory mapped on load, so worker processes share the same pages.
+# snapshot_version changes whenever the layout does, older snapshots are then rejected.
+# The source stamp covers the path, size and modification time of every source file, so a
+#   snapshot built from other files, or before a source changed, is detected as stale
+#   (see load_snapshot). It is not a hash of their contents.
+# The checksum is a sha256 of the whole array region, padding included. It is checked
+#   after writing, and on load when asked to (reading every page defeats the memory map),
+#   so a truncated or corrupted snapshot raises ValueError instead of searching wrong data.
+snapshot_magic = b'PTSNAP01'
+snapshot_version = 3
+header_dtype = np.dtype([('magic', 'S8'),
+                         ('version', '<i8'),
+                         ('metadata_length', '<i8')])
+alignment = 64
+
+
+# A loaded snapshot
+#   network_data: NetworkData read from the snapshot (its transfer table too, if one was included)
+#   block_table: BlockTable or None
+#   route geometries, (rte, dir) -> list of polyline parts, are only unpacked when asked for
+class Snapshot:
+    def __init__(self, path, network_data, block_table, geometry_arrays, source_stamp):
+        self.path = path
+        self.network_data = network_data
+        self.block_table = block_table
+        self.geometry_arrays = geometry_arrays
+        self.source_stamp = source_stamp
+        self.route_geometries = None
+
+    def __repr__(self):
+        return f"Snapshot({self.path}, {self.network_data}, block table: {self.block_table is not None})"
+
+
+    def get_route_geometries(self):
+        if self.route_geometries is None and self.geometry_arrays is not None:
+            keys, key_offsets, part_offsets, x, y = self.geometry_arrays
+            x, y = x.tolist(), y.tolist()
+            part_offsets = part_offsets.tolist()
+            self.route_geometries = {}
+            for key, start, end in zip(keys, key_offsets[:-1].tolist(), key_offsets[1:].tolist()):
+                self.route_geometries[key] = [list(zip(x[part_offsets[part]:part_offsets[part + 1]],
+                                                       y[part_offsets[part]:part_offsets[part + 1]]))
+                                              for part in range(start, end)]
+        return self.route_geometries
+
+
+
+# Staleness stamp of the files a snapshot is built from: a hash of their full paths, sizes
+#   and modification times. Contents aren't read, so checking is as quick as loading, but
+#   a file rewritten with the same size and time, or copied elsewhere, isn't told apart.
+def source_stamp(paths):
+    digest = hashlib.sha256()
+    for path in sorted(set(os.path.normcase(os.path.abspath(path)) for path in paths if path)):
+        digest.update(path.encode())
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f":{stat.st_size}:{stat.st_mtime_ns};".encode())
+        else:
+            digest.update(b":missing;")
+    return digest.hexdigest()
+
+
+# Writes a snapshot of a NetworkData, and optionally a block table and the route geometries
+#   (rte, dir) -> [polyline parts]
+def write_snapshot(path, network, stamp, block_table=None, route_geometries=None):
+    walking_network = network.walking_network
+    stop_index = network.stop_index
+    route_index = network.route_index
+
+    # The stop index keeps stop_ids sorted on their own, put them back in fid order
+    stop_ids = np.empty_like(stop_index.sorted_stop_ids)
+    stop_ids[np.searchsorted(stop_index.fids, stop_index.stop_id_fids)] = stop_index.sorted_stop_ids
+
+    arrays = {'node_x': walking_network.node_x,
+              'node_y': walking_network.node_y,
+              'offsets': walking_network.offsets,
+              'targets': walking_network.targets,
+              'lengths': walking_network.lengths,
+              'arc_segments': walking_network.arc_segments,
+              'segment_edges': walking_network.segment_edges,
+              'edge_fids': walking_network.edge_fids,
+              'edge_segment_counts': walking_network.edge_segment_counts,
+              'stop_fids': walking_network.stop_fids,
+              'stop_nodes': walking_network.stop_nodes,
+              'stop_snap_lengths': walking_network.stop_snap_lengths,
+              'stop_index_fids': stop_index.fids,
+              'stop_index_stop_ids': stop_ids,
+              'stop_index_x': stop_index.x,
+              'stop_index_y': stop_index.y,
+              'pattern_offsets': route_index.pattern_offsets,
+              'route_stop_fids': route_index.route_stop_fids,
+              'ride_times': route_index.ride_times,
+              'measures': route_index.measures}
+    metadata = {'crs': stop_index.crs,
+                'cell_size': walking_network.cell_size,
+                'source_stamp': stamp,
+                'pattern_keys': [list(key) for key in route_index.pattern_keys],
+                'headways': [[rte, direction, trips]
+                             for (rte, direction), trips in network.headway_table.trips_per_hour.items()],
+                'route_stop_records': [[fid, record['fid'], record['stop_id'], record['rte'], record['dir']]
+                                       for fid, record in network.route_stop_records.items()]}
+
+    transfer_table = network.transfer_table
+    if transfer_table is not None:
+        arrays.update({'transfer_stop_fids': transfer_table.stop_fids,
+                       'transfer_offsets': transfer_table.offsets,
+                       'transfer_route_stop_fids': transfer_table.route_stop_fids,
+                       'transfer_costs': transfer_table.costs})
+        metadata['transfer_max_cost'] = transfer_table.max_cost
+
+    if block_table is not None:
+        arrays.update({'block_street_fids': block_table.street_fids,
+                       'block_offsets': block_table.offsets,
+                       'block_fids': block_table.block_fids})
+        metadata['block_distance'] = block_table.distance
+
+    if route_geometries is not None:
+        keys = list(route_geometries)
+        parts = [part for key in keys for part in route_geometries[key]]
+        arrays.update({'geometry_key_offsets': np.cumsum([0] + [len(route_geometries[key]) for key in keys]),
+                       'geometry_part_offsets': np.cumsum([0] + [len(part) for part in parts]),
+                       'geometry_x': np.array([point[0] for part in parts for point in part], dtype=np.float64),
+                       'geometry_y': np.array([point[1] for part in parts for point in part], dtype=np.float64)})
+        metadata['geometry_keys'] = [list(key) for key in keys]
+
+    # Lay the arrays out after the metadata, which has to know where they go
+    arrays = {name: np.ascontiguousarray(array, dtype=np.asarray(array).dtype.newbyteorder('<'))
+              for name, array in arrays.items()}
+    layout = {}
+    offset = 0
+    checksum = hashlib.sha256()
+    for name, array in arrays.items():
+        layout[name] = [array.dtype.str, list(array.shape), offset]
+        offset += aligned(array.nbytes)
+        checksum.update(array.tobytes())
+        checksum.update(bytes(aligned(array.nbytes) - array.nbytes))
+    metadata['arrays'] = layout
+    metadata['checksum'] = checksum.hexdigest()
+    encoded = json.dumps(metadata).encode()
+    data_start = aligned(header_dtype.itemsize + len(encoded))
+
+    header = np.zeros(1, dtype=header_dtype)
+    header['magic'] = snapshot_magic
+    header['version'] = snapshot_version
+    header['metadata_length'] = len(encoded)
+    with open(path, 'wb') as file:
+        header.tofile(file)
+        file.write(encoded)
+        for name, array in arrays.items():
+            file.seek(data_start + layout[name][2])
+            array.tofile(file)
+        file.truncate(data_start + offset)
+    return load_snapshot(path, verify=True)
+
+
+# Rounds a size up to the next alignment boundary
+def aligned(size):
+    return -(-size // alignment) * alignment
+
+
+# Reads a snapshot's metadata
+#   Raises ValueError if the file isn't a snapshot or is from another snapshot_version
+def read_metadata(path):
+    header = np.fromfile(path, dtype=header_dtype, count=1)
+    if len(header) == 0 or header['magic'][0] != snapshot_magic:
+        raise ValueError(f"{path} is not a network snapshot")
+    if header['version'][0] != snapshot_version:
+        raise ValueError(f"{path} is a version {header['version'][0]} snapshot, "
+                         f"expected version {snapshot_version}")
+    with open(path, 'rb') as file:
+        file.seek(header_dtype.itemsize)
+        metadata = json.loads(file.read(int(header['metadata_length'][0])))
+    data_start = aligned(header_dtype.itemsize + int(header['metadata_length'][0]))
+    return metadata, data_start
+
+
+# sha256 of everything in a file from start on, read a chunk at a time
+def file_checksum(path, start, chunk_size=16 * 1024 * 1024):
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as file:
+        file.seek(start)
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+# Memory maps a snapshot written by write_snapshot
+#   stamp: source_stamp of the current sources, a snapshot built from other
+#   sources raises ValueError. None skips the check.
+#   verify: check the arrays against their checksum first, raising ValueError if they differ
+def load_snapshot(path, stamp=None, verify=False):
+    metadata, data_start = read_metadata(path)
+    if stamp is not None and metadata['source_stamp'] != stamp:
+        raise ValueError(f"{path} is stale, its sources have changed since it was built")
+    if verify and file_checksum(path, data_start) != metadata['checksum']:
+        raise ValueError(f"{path} is corrupt, its arrays don't match their checksum")
+
+    def array(name):
+        dtype, shape, offset = metadata['arrays'][name]
+        if not np.prod(shape):
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', offset=data_start + offset, shape=tuple(shape))
+
+    walking_network = WalkingNetwork.WalkingNetwork(
+        array('node_x'), array('node_y'), array('offsets'), array('targets'), array('lengths'),
+        array('arc_segments'), array('segment_edges'), array('edge_fids'), array('edge_segment_counts'),
+        array('stop_fids'), array('stop_nodes'), array('stop_snap_lengths'), metadata['cell_size'])
+    stop_index = StopIndex.StopIndex(array('stop_index_fids'), array('stop_index_stop_ids'),
+                                     array('stop_index_x'), array('stop_index_y'), metadata['crs'])
+    route_index = TransitIndex.RoutePatternIndex([tuple(key) for key in metadata['pattern_keys']],
+                                                 array('pattern_offsets'), array('route_stop_fids'),
+                                                 array('ride_times'), array('measures'))
+    headway_table = TransitIndex.build_headway_table(metadata['headways'])
+    route_stop_records = {fid: {'fid': record_fid, 'stop_id': stop_id, 'rte': rte, 'dir': direction}
+                          for fid, record_fid, stop_id, rte, direction in metadata['route_stop_records']}
+
+    transfer_table = None
+    if 'transfer_max_cost' in metadata:
+        transfer_table = TransferTable.TransferTable(array('transfer_stop_fids'), array('transfer_offsets'),
+                                                     array('transfer_route_stop_fids'), array('transfer_costs'),
+                                                     metadata['transfer_max_cost'])
+    block_table = None
+    if 'block_distance' in metadata:
+        block_table = BlockTable.BlockTable(array('block_street_fids'), array('block_offsets'),
+                                            array('block_fids'), metadata['block_distance'])
+    geometry_arrays = None
+    if 'geometry_keys' in metadata:
+        geometry_arrays = ([tuple(key) for key in metadata['geometry_keys']], array('geometry_key_offsets'),
+                           array('geometry_part_offsets'), array('geometry_x'), array('geometry_y'))
+
+    network = NetworkData.NetworkData(walking_network, stop_index, route_index, headway_table,
+                                      route_stop_records, transfer_table)
+    network.snapshot_path = path
+    return Snapshot(path, network, block_table, geometry_arrays, metadata['source_stamp'])
@@ -0,0 +1,107 @@
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingException,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterFolderDestination,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterField)
+from importlib import reload
+import ServiceAreaSearch
+reload(ServiceAreaSearch)
+
+
+class AccessibilityMatrix(QgsProcessingAlgorithm):
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return AccessibilityMatrix()
+
+    def name(self):
+        return 'accessibilitymatrix'
+
+    def displayName(self):
+        return self.tr('Block Accessibility Matrix')
+
+
+    def shortHelpString(self):
+        return self.tr('Finds the travel time from every census block (searching from its centroid) to every '
+                       'block reachable within the time limit, written as compressed chunks to the output folder. '
+                       'Given a weight field (e.g. jobs), also writes each block\'s total weight of the blocks '
+                       'reachable from it, counting the weights of the blocks given here only. '
+                       'Needs the street block table, and the blocks must be its census_blocks_land_only '
+                       'layer (or a selection of it), whose fids the table lists.')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                'BLOCKS',
+                self.tr('Census Blocks (origins, census_blocks_land_only or a selection of it)'),
+                [QgsProcessing.TypeVectorPolygon],
+                defaultValue=ServiceAreaSearch.blocks_name
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterField(
+                'WEIGHT_FIELD',
+                self.tr('Weight Field (summed over the blocks reachable from each block)'),
+                parentLayerParameterName='BLOCKS',
+                type=QgsProcessingParameterField.Numeric,
+                optional=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'SEARCHTIMELIMIT',
+                self.tr('Search Time Limit (Minutes)')
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'WORKERS',
+                self.tr('Worker Processes (1 searches one block at a time)'),
+                defaultValue=1,
+                minValue=1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                'OUTPUT',
+                self.tr('Matrix Folder')
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        blocks = self.parameterAsSource(parameters, 'BLOCKS', context)
+        # Destinations are read from the block table by fid, so origins and weights have to be
+        #   the features of the layer it was built on
+        blocks_layer = self.parameterAsVectorLayer(parameters, 'BLOCKS', context)
+        table_layer = ServiceAreaSearch.get_layer(ServiceAreaSearch.blocks_name)
+        if blocks_layer is None or blocks_layer.source() != table_layer.source():
+            raise QgsProcessingException(self.tr(f'The street block table lists the blocks of '
+                                                 f'{ServiceAreaSearch.blocks_name}, choose that layer '
+                                                 f'(or a selection of it) as the Census Blocks'))
+        weight_field = self.parameterAsString(parameters, 'WEIGHT_FIELD', context)
+        search_time = self.parameterAsInt(parameters, 'SEARCHTIMELIMIT', context) / 60
+        workers = self.parameterAsInt(parameters, 'WORKERS', context)
+        matrix_path = self.parameterAsString(parameters, 'OUTPUT', context)
+
+        crs = blocks.sourceCrs()
+        origins = []
+        weights = {} if weight_field else None
+        for block in blocks.getFeatures():
+            if feedback.isCanceled():
+                return {}
+            centroid = block.geometry().centroid().asPoint()
+            origins.append((block.id(), f"{centroid.x()},{centroid.y()} [{crs.authid()}]"))
+            if weight_field and block[weight_field] is not None:
+                weights[block.id()] = float(block[weight_field])
+
+        ServiceAreaSearch.main_matrix(origins, search_time, matrix_path, workers, context, feedback, weights)
+        return {'OUTPUT': matrix_path}
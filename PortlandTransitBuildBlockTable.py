@@ -0,0 +1,48 @@
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingException,
+                       QgsProcessingParameterFileDestination)
+from importlib import reload
+import ProjectInteraction
+reload(ProjectInteraction)
+
+
+class BuildBlockTable(QgsProcessingAlgorithm):
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return BuildBlockTable()
+
+    def name(self):
+        return 'buildblocktable'
+
+    def displayName(self):
+        return self.tr('Build Street Block Table')
+
+
+    def shortHelpString(self):
+        return self.tr('Finds the census blocks within 10 ft of every street feature. '
+                       'Service area searches read the reached blocks from this table instead of '
+                       'extracting them by distance from the reached streets.')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                'OUTPUT',
+                self.tr('Block Table'),
+                self.tr('Block tables (*.bin)'),
+                defaultValue=ProjectInteraction.block_table_file
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        path = self.parameterAsFileOutput(parameters, 'OUTPUT', context)
+        table = ProjectInteraction.build_block_table(path, feedback)
+        if table is None:
+            return {}
+
+        feedback.pushInfo(f"Wrote {table} to {path}")
+        return {'OUTPUT': path}
@@ -0,0 +1,45 @@
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingException,
+                       QgsProcessingParameterFileDestination)
+from importlib import reload
+import ProjectInteraction
+reload(ProjectInteraction)
+
+
+class BuildSnapshot(QgsProcessingAlgorithm):
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return BuildSnapshot()
+
+    def name(self):
+        return 'buildnetworksnapshot'
+
+    def displayName(self):
+        return self.tr('Build Network Snapshot')
+
+
+    def shortHelpString(self):
+        return self.tr('Compiles the street network, stops, route patterns, headways, and the transfer and block '
+                       'tables (when built) into one file. Searches memory map it instead of reading the layers, '
+                       'until one of the layers changes.')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                'OUTPUT',
+                self.tr('Network Snapshot'),
+                self.tr('Network snapshots (*.snap)'),
+                defaultValue=ProjectInteraction.snapshot_file
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        path = self.parameterAsFileOutput(parameters, 'OUTPUT', context)
+        snapshot = ProjectInteraction.build_snapshot(path)
+        feedback.pushInfo(f"Wrote {snapshot}")
+        return {'OUTPUT': path}
@@ -0,0 +1,47 @@
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingException,
+                       QgsProcessingParameterFileDestination)
+from importlib import reload
+import ProjectInteraction
+reload(ProjectInteraction)
+
+
+class BuildTransferTable(QgsProcessingAlgorithm):
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return BuildTransferTable()
+
+    def name(self):
+        return 'buildtransfertable'
+
+    def displayName(self):
+        return self.tr('Build Walking Transfer Table')
+
+
+    def shortHelpString(self):
+        return self.tr('Precomputes the walking time from every TriMet stop to all route stops within an hour\'s walk. '
+                       'Service area searches read transfers from this table instead of searching the street network.')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                'OUTPUT',
+                self.tr('Transfer Table'),
+                self.tr('Transfer tables (*.bin)'),
+                defaultValue=ProjectInteraction.transfer_table_file
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        path = self.parameterAsFileOutput(parameters, 'OUTPUT', context)
+        table = ProjectInteraction.build_transfer_table(path, feedback)
+        if table is None:
+            return {}
+
+        feedback.pushInfo(f"Wrote {table} to {path}")
+        return {'OUTPUT': path}
@@ -3,12 +3,16 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingAlgorithm,
                        QgsProcessingException,
                         QgsProcessingParameterNumber,
+                       QgsProcessingParameterBoolean,
                        QgsProcessingParameterVectorDestination,
+                       QgsProcessingParameterFileDestination,
                        QgsProcessingParameterFeatureSource,
                        QgsProcessingParameterField)
 from importlib import reload
 import ServiceAreaSearch
 reload(ServiceAreaSearch)
+import WorkQueue
+reload(WorkQueue)
 
 
 class MultiTransitServiceArea(QgsProcessingAlgorithm):
@@ -27,7 +31,13 @@ class MultiTransitServiceArea(QgsProcessingAlgorithm):
 
 
     def shortHelpString(self):
-        return self.tr('Generates accurate public transit service areas for all points in a point layer given a time limit')
+        return self.tr('Generates accurate public transit service areas for all points in a point layer given a time limit. '
+                       'Saved to a GeoPackage, every service area goes in one table (origin, budget_min, band_min), '
+                       'and a rerun into the same file skips the points already in it. '
+                       'Given a work queue file, the points are queued in it and searched one at a time, '
+                       'recording each one\'s status and time: a rerun only searches the points that '
+                       'aren\'t done (or failed). Other QGIS sessions can work through the same queue at once, '
+                       'each saving to its own GeoPackage. A work queue needs Worker Processes left at 1.')
 
     def initAlgorithm(self, config=None):
         self.addParameter(
@@ -54,6 +64,15 @@ class MultiTransitServiceArea(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'WORKERS',
+                self.tr('Worker Processes (1 searches one point at a time)'),
+                defaultValue=1,
+                minValue=1
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterVectorDestination(
                 'OUTPUT',
@@ -61,26 +80,84 @@ class MultiTransitServiceArea(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                'RESUME',
+                self.tr('Keep the service areas already in the output, skipping their points'),
+                defaultValue=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                'QUEUE',
+                self.tr('Work Queue (searches the points one at a time, resumable)'),
+                fileFilter='SQLite (*.sqlite)',
+                optional=True,
+                createByDefault=False
+            )
+        )
+
     def processAlgorithm(self, parameters, context, feedback):
         start_locations = self.parameterAsSource(parameters, 'STARTLOCATIONS', context)
         search_time = self.parameterAsInt(parameters, 'SEARCHTIMELIMIT', context) / 60
         name_field = parameters['NAME_FIELD']
-
-        crs = start_locations.sourceCrs()
-        points = start_locations.getFeatures()
-        point_count = 0
-        for point in points:
+        workers = self.parameterAsInt(parameters, 'WORKERS', context)
+        output_path = self.parameterAsOutputLayer(parameters, 'OUTPUT', context)
+        resume = self.parameterAsBoolean(parameters, 'RESUME', context)
+        queue_path = self.parameterAsFileOutput(parameters, 'QUEUE', context)
+        if queue_path and workers > 1:
+            raise QgsProcessingException(self.tr('A work queue searches one point at a time, leave Worker Processes '
+                                                 'at 1 (more QGIS sessions can work through the queue together)'))
+
+        # Into one table through one connection when saving to a GeoPackage, otherwise a layer per point
+        writer = None
+        if output_path and output_path.lower().endswith('.gpkg'):
+            writer = ServiceAreaSearch.open_result_writer(output_path, resume)
+        try:
+            if queue_path:
+                self.search_queue(start_locations, search_time, name_field, queue_path, writer, context, feedback)
+            else:
+                self.search_points(start_locations, search_time, name_field, workers, writer, context, feedback)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        if writer is None:
+            return {}
+        return {'OUTPUT': output_path}
+
+    # Searches from every point, one by one or across workers
+    def search_points(self, start_locations, search_time, name_field, workers, writer, context, feedback):
+        origins = []
+        # Points searched one by one share their walks from stops
+        network = ServiceAreaSearch.walk_shed_network() if workers <= 1 else None
+        for name, start_location in self.point_origins(start_locations, name_field):
             if feedback.isCanceled():
-                return {}
-
+                return
+
+            if workers > 1:
+                origins.append((name, start_location))
+            else:
+                ServiceAreaSearch.main(name, start_location, search_time, context, feedback, writer=writer,
+                                       network=network)
+
+        if origins:
+            ServiceAreaSearch.main_batch(origins, search_time, workers, context, feedback, writer)
+
+    # Queues every point (keeping the state of the ones queued before) and works through the queue
+    def search_queue(self, start_locations, search_time, name_field, queue_path, writer, context, feedback):
+        queue = WorkQueue.WorkQueue(queue_path)
+        try:
+            queue.add(self.point_origins(start_locations, name_field), search_time)
+            ServiceAreaSearch.main_queue(queue, context, feedback, writer)
+        finally:
+            queue.close()
+
+    # (name, coordinate string) of every point
+    def point_origins(self, start_locations, name_field):
+        crs = start_locations.sourceCrs()
+        for point_count, point in enumerate(start_locations.getFeatures()):
             name = point[name_field] if point[name_field] is not None else f"Point {point_count}"
             coord = point.geometry().asPoint()
-            start_location = f"{coord.x()},{coord.y()} [{crs.authid()}]"
-
-            ServiceAreaSearch.main(name, start_location, search_time, context, feedback)
-
-            point_count = point_count+1
-
-
-
-        return {}
\ No newline at end of file
+            yield name, f"{coord.x()},{coord.y()} [{crs.authid()}]"
@@ -3,11 +3,16 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingAlgorithm,
                        QgsProcessingException,
                         QgsProcessingParameterNumber,
+                       QgsProcessingParameterDateTime,
+                       QgsProcessingParameterString,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterFileDestination,
                        QgsProcessingParameterVectorDestination,
                        QgsProcessingParameterPoint)
 from importlib import reload
 import ServiceAreaSearch
 reload(ServiceAreaSearch)
+import Profiler
 
 
 class TransitServiceArea(QgsProcessingAlgorithm):
@@ -43,6 +48,49 @@ class TransitServiceArea(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterDateTime(
+                'DEPARTURETIME',
+                self.tr('Departure Time (uses the GTFS timetable, leave empty for average waits)'),
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterDateTime(
+                'DEPARTUREWINDOWEND',
+                self.tr('Latest Departure Time (searches every minute from the departure time, '
+                        'writing the percentage of departures each block is reachable from)'),
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterString(
+                'BANDS',
+                self.tr('Time Bands (Minutes, e.g. 15,30,45,60: one search out to the largest, '
+                        'writing the band each block is reached in)'),
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                'USECACHE',
+                self.tr('Reuse earlier results of searches from the same spot'),
+                defaultValue=False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                'PROFILE',
+                self.tr('Profile (time spent in each phase, as a Chrome trace or JSON lines)'),
+                fileFilter='Chrome trace (*.json);;JSON lines (*.jsonl)',
+                optional=True
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterVectorDestination(
                 'OUTPUT',
@@ -55,10 +103,42 @@ class TransitServiceArea(QgsProcessingAlgorithm):
         search_time_min = self.parameterAsInt(parameters, 'SEARCHTIMELIMIT', context)
         search_time_hour = search_time_min/ 60
         name = f"Point - {search_time_min} minute service area"
+        departure_time = None
+        if parameters.get('DEPARTURETIME'):
+            departure_time = self.parameterAsDateTime(parameters, 'DEPARTURETIME', context).toPyDateTime()
+            name = f"{name} departing {departure_time:%Y-%m-%d %H:%M}"
+        window_end = None
+        if departure_time is not None and parameters.get('DEPARTUREWINDOWEND'):
+            window_end = self.parameterAsDateTime(parameters, 'DEPARTUREWINDOWEND', context).toPyDateTime()
+            if window_end.date() != departure_time.date() or window_end < departure_time:
+                raise QgsProcessingException(self.tr('The latest departure must be later on the same day'))
+            name = f"{name}-{window_end:%H:%M}"
+        bands = None
+        bands_string = self.parameterAsString(parameters, 'BANDS', context)
+        if bands_string:
+            try:
+                bands_min = sorted(set(int(band) for band in bands_string.split(',') if band.strip()))
+            except ValueError:
+                raise QgsProcessingException(self.tr('Time bands must be whole minutes separated by commas'))
+            if window_end is not None:
+                raise QgsProcessingException(self.tr('Time bands can\'t be combined with a departure window'))
+            bands = [band / 60 for band in bands_min]
+            name = name.replace(f"{search_time_min} minute service area",
+                                f"{','.join(str(band) for band in bands_min)} minute service areas")
+        use_cache = self.parameterAsBool(parameters, 'USECACHE', context)
+        profile_path = None
+        if parameters.get('PROFILE'):
+            profile_path = self.parameterAsFileOutput(parameters, 'PROFILE', context)
         if feedback.isCanceled():
             return {}
 
         #print(f"Start Location: {start_location}")
-        ServiceAreaSearch.main(name, start_location, search_time_hour, context, feedback)
+        with Profiler.Profiling(profile_path):
+            if window_end is not None:
+                ServiceAreaSearch.main_profile(name, start_location, search_time_hour, departure_time, window_end,
+                                               context, feedback)
+            else:
+                ServiceAreaSearch.main(name, start_location, search_time_hour, context, feedback, departure_time,
+                                       bands, use_cache)
 
         return {}
\ No newline at end of file
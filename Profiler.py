@@ -0,0 +1,191 @@
+import json
+import os
+import time
+
+
+# Where the time of a search goes, phase by phase
+#   Code reports to the active profiler through phase (a context manager) and, in the search
+#   loops, expansion. While no profiler is active both cost one global lookup.
+#   phases: name -> [calls, total seconds], over everything profiled
+#   counters: name -> count
+#   events: (name, category, start, duration, args) of every phase and node expansion, in
+#     seconds from when profiling started, up to max_events
+# Written as JSON lines (one event per line, then one line per phase total) or as a Chrome
+#   trace (chrome://tracing or https://ui.perfetto.dev), see write
+active = None
+
+
+class Profiler:
+    def __init__(self, record_events=True, max_events=1000000):
+        self.record_events = record_events
+        self.max_events = max_events
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.counters = {}
+        self.events = []
+        self.dropped_events = 0
+
+    def __repr__(self):
+        return (f"Profiler(phases: {len(self.phases)}, events: {len(self.events)}, "
+                f"elapsed: {time.perf_counter() - self.start:.3f} s)")
+
+
+    def phase(self, name, args=None):
+        return Phase(self, name, args)
+
+
+    def add_phase(self, name, start, duration, args=None, category='phase'):
+        totals = self.phases.get(name)
+        if totals is None:
+            totals = self.phases[name] = [0, 0.0]
+        totals[0] += 1
+        totals[1] += duration
+        if self.record_events:
+            if len(self.events) < self.max_events:
+                self.events.append((name, category, start - self.start, duration, args))
+            else:
+                self.dropped_events += 1
+
+
+    # One node searched from, mode "walk", "transit", ..., with the frontier size after it
+    def expansion(self, mode, frontier_size, start, duration):
+        self.add_phase(f"{mode} expansion", start, duration, {'frontier': frontier_size}, 'expansion')
+
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+
+    def print_summary(self):
+        print("Profile:")
+        for name, (calls, seconds) in sorted(self.phases.items(), key=lambda phase: -phase[1][1]):
+            print(f"    {name}: {calls} calls, {seconds:.3f} s total, {seconds / calls * 1000:.3f} ms each")
+        for name, count in sorted(self.counters.items()):
+            print(f"    {name}: {count}")
+        if self.dropped_events:
+            print(f"    {self.dropped_events} events past max_events not recorded")
+
+
+    # Writes the events and totals, as JSON lines for a .jsonl path and a Chrome trace otherwise
+    def write(self, path):
+        if path.lower().endswith('.jsonl'):
+            self.write_json_lines(path)
+        else:
+            self.write_chrome_trace(path)
+        print(f"Wrote profile to {path}")
+
+
+    def write_json_lines(self, path):
+        with open(path, 'w') as file:
+            for name, category, start, duration, args in self.events:
+                record = {'name': name, 'category': category, 'start': start, 'duration': duration}
+                if args:
+                    record.update(args)
+                file.write(json.dumps(record) + '\n')
+            for name, (calls, seconds) in self.phases.items():
+                file.write(json.dumps({'phase': name, 'calls': calls, 'seconds': seconds}) + '\n')
+            for name, count in self.counters.items():
+                file.write(json.dumps({'counter': name, 'count': count}) + '\n')
+
+
+    # Chrome trace event format, complete ("X") events in microseconds
+    def write_chrome_trace(self, path):
+        pid = os.getpid()
+        events = [{'name': name, 'cat': category, 'ph': 'X', 'ts': start * 1e6, 'dur': duration * 1e6,
+                   'pid': pid, 'tid': 0, 'args': args or {}}
+                  for name, category, start, duration, args in self.events]
+        events += [{'name': name, 'ph': 'C', 'ts': (time.perf_counter() - self.start) * 1e6, 'pid': pid,
+                    'args': {'count': count}}
+                   for name, count in self.counters.items()]
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+
+
+# A timed phase, added to its profiler when it exits
+class Phase:
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add_phase(self.name, self.start, time.perf_counter() - self.start, self.args)
+        return False
+
+
+# Stands in for a Phase while profiling is off
+class NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+null_phase = NullPhase()
+
+
+# Context manager timing a phase of the active profiler (doing nothing without one)
+#   with Profiler.phase('dissolve'):
+def phase(name, **args):
+    if active is None:
+        return null_phase
+    return active.phase(name, args)
+
+
+# Decorator timing every call of a function as a phase
+#   @Profiler.timed('dissolve')
+def timed(name):
+    def decorate(function):
+        def timed_function(*args, **kwargs):
+            if active is None:
+                return function(*args, **kwargs)
+            with active.phase(name):
+                return function(*args, **kwargs)
+        timed_function.__name__ = function.__name__
+        timed_function.__doc__ = function.__doc__
+        return timed_function
+    return decorate
+
+
+def count(name, amount=1):
+    if active is not None:
+        active.count(name, amount)
+
+
+def enable(record_events=True):
+    global active
+    active = Profiler(record_events)
+    return active
+
+
+# Stops profiling, returning the profiler that was active
+def disable():
+    global active
+    profiler, active = active, None
+    return profiler
+
+
+# Profiles everything run inside it when path is given, then prints the totals and writes
+#   the profile to path (see Profiler.write). Does nothing without a path.
+class Profiling:
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        if self.path:
+            enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.path:
+            profiler = disable()
+            if profiler is not None:
+                profiler.print_summary()
+                profiler.write(self.path)
+        return False
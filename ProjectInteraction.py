@@ -1,4 +1,6 @@
 import select
+import os
+from importlib import reload
 from qgis.core import (QgsProcessing,
                        QgsProcessingException,
                        QgsProcessingAlgorithm,
@@ -10,248 +12,306 @@ from qgis.core import (QgsProcessing,
                        QgsVectorLayer,
                        QgsGeometry,
                        QgsPointXY,
+                       QgsWkbTypes,
+                       QgsCoordinateReferenceSystem,
+                       QgsCoordinateTransform,
+                       QgsSpatialIndex,
+                       QgsField,
                        QgsVectorFileWriter)
+from qgis.PyQt.QtCore import QVariant
 from qgis import processing
+import WalkingNetwork
+reload(WalkingNetwork)
+import TransferTable
+reload(TransferTable)
+import BlockTable
+reload(BlockTable)
+import TransitIndex
+reload(TransitIndex)
+import StopIndex
+reload(StopIndex)
+import NetworkData
+reload(NetworkData)
+import NetworkBuilder
+reload(NetworkBuilder)
+import NetworkSnapshot
+reload(NetworkSnapshot)
+import Timetable
+reload(Timetable)
+import ResultCache
+reload(ResultCache)
+import Profiler
+reload(Profiler)
+import GeoPackageWriter
+reload(GeoPackageWriter)
+
+streets_name = NetworkBuilder.streets_name
+route_stops_name = NetworkBuilder.route_stops_name
+stops_name = NetworkBuilder.stops_name
+routes_name = NetworkBuilder.routes_name
+blocks_name = NetworkBuilder.blocks_name
+
+# Project layers by name, looked up on first use (see get_layer)
+layers = {}
+
+walk_feet_per_hour = NetworkData.walk_feet_per_hour
+walk_km_per_hour = 4.50616
+ft_to_m = 3.28084
 
-streets_name = '1HrWalkableRoads_NoHighways'
-route_stops_name = 'trimet_route_stops'
-stops_name = 'trimet_stops'
-routes_name = 'trimet_routes'
-blocks_name = 'census_blocks_land_only'
+# Precomputed stop to route stop walks (see build_transfer_table)
+transfer_table_file = os.path.join(os.path.dirname(__file__), 'walk_transfers.bin')
+transfer_table_hours = 1
 
-street_layer = QgsProject.instance().mapLayersByName(streets_name)[0]
-route_stops_layer = QgsProject.instance().mapLayersByName(route_stops_name)[0]
-stops_layer = QgsProject.instance().mapLayersByName(stops_name)[0]
-routes_layer = QgsProject.instance().mapLayersByName(routes_name)[0]
-blocks_layer = QgsProject.instance().mapLayersByName(blocks_name)[0]
+# Precomputed street to census block mapping (see build_block_table)
+block_table_file = os.path.join(os.path.dirname(__file__), 'street_blocks.bin')
+block_distance = 10
 
-walk_feet_per_hour = 14784  #feet walkable in one hour \
-    #assuming a walking speed of 2.8 mph
-walk_km_per_hour = 4.50616
-ft_to_m = 3.28084
+# GTFS feed (a directory or zip) for departure time searches (see get_timetable)
+gtfs_path = os.path.join(os.path.dirname(__file__), 'gtfs.zip')
 
+# Everything above compiled into one file (see build_snapshot)
+snapshot_file = os.path.join(os.path.dirname(__file__), 'network.snap')
 
+# Finished searches kept between runs (see get_result_cache)
+result_cache_file = os.path.join(os.path.dirname(__file__), 'results.sqlite')
+result_cache_bytes = 512 * 1024 * 1024
 
-#finds the time to reach each stop within a street network
-def find_stops_walking(start_node, network, stops, context, feedback):
-    # get the coordinates as a string from the start node
-    lat_lon_str = start_node.get_coord_string()
-
-    # Note: due to this algorithm calculating distances on these layers in feet,
-    #   we have to multiply the km/hr by ft_to_meters to get the correct times
-    #print(f"FSW - network type: {type(network)}, feature count = {network.featureCount()}")
-    #print(f"FSW - stops type: {type(stops)}, feature count = {stops.featureCount()}")
-    #print(f"FSW - lat_lon_str: {lat_lon_str}")
-    #print(f"FSW - default speed: {ft_to_m * walk_km_per_hour}")
-    reachable_stops_id = processing.run("native:shortestpathpointtolayer",
-                                     {'INPUT':network,'STRATEGY': 1,
-                                      'DIRECTION_FIELD':'','VALUE_FORWARD':'',
-                                      'VALUE_BACKWARD':'','VALUE_BOTH':'',
-                                      'DEFAULT_DIRECTION':2,'SPEED_FIELD':'',
-                                      'DEFAULT_SPEED': ft_to_m * walk_km_per_hour,
-                                      'TOLERANCE':0,'START_POINT':lat_lon_str,
-                                      'END_POINTS':stops, 'OUTPUT':'TEMPORARY_OUTPUT'},
-                                    is_child_algorithm=True,
-                                    context=context,
-                                    feedback=feedback)['OUTPUT']
-    reachable_stops = context.getMapLayer(reachable_stops_id)
-    reachable_stops.setName(f"walking_routes from id {start_node.id}")
-    #QgsProject.instance().addMapLayer(reachable_stops)
-    return reachable_stops
-
-
-
-def find_stops_transit(start_node, route, stops, context, feedback):
-    # Select the starting stop by pulling it from the stops layer
-    #start_stop = next(route_stops_layer.getFeatures(QgsFeatureRequest().setFilterFid(start_node.id)))
-
-    # Get the starting coordinates as a string from the start node
-    lat_lon_str = start_node.get_coord_string()
-
-    # Get the path to the route and stops
-    #   (Necessary for running this process with only selected features)
-    #route_uri = route.dataProvider().dataSourceUri()
-    #stops_uri = stops.dataProvider().dataSourceUri()
-
-    direction = start_node.dir
-    reverse = 1 if direction == 0 else 0
-    routes_to_stops_id = processing.run("native:shortestpathpointtolayer",
-                                     {'INPUT': route,
-                                     'STRATEGY': 1, 'DIRECTION_FIELD': 'DIR', 'VALUE_FORWARD': direction,
-                                     'VALUE_BACKWARD': reverse, 'VALUE_BOTH': '', 'DEFAULT_DIRECTION': direction,
-                                     'SPEED_FIELD': 'KILO_FT_PER_HOUR', 'DEFAULT_SPEED': 1, 'TOLERANCE': 0,
-                                     'START_POINT': lat_lon_str,
-                                     'END_POINTS': stops,
-                                    'OUTPUT': 'TEMPORARY_OUTPUT'},
-                                    is_child_algorithm=True,
-                                    context=context,
-                                    feedback=feedback)['OUTPUT']
-    routes_to_stops = context.getMapLayer(routes_to_stops_id)
-    routes_to_stops.setName(f"transit_routes from id {start_node.id}")
-    #QgsProject.instance().addMapLayer(routes_to_stops)
-    return routes_to_stops
+# Memory kept for stop walk sheds during batch and multi origin searches (see TransitSearch.WalkShedCache)
+walk_shed_bytes = 256 * 1024 * 1024
 
+# GeoPackage each result layer is written to on its own (see add_layer_to_gpkg),
+#   batches given an output write every result into one table of it instead (see open_result_writer)
+output_file = r"C:\Users\lukem\Documents\Projects\PortlandTransitIsochrone\SkateparkOutput.gpkg"
 
+# Network data, built from the layers on first use and kept for the session (see get_builder)
+builder = None
+timetables = {}
+result_cache = None
 
-def get_reachable_stops_walking(start_node, time_limit, total_service_area, context, feedback):
-    # Create buffer around start point with radius of
-    # The maximum distance walkable with time remaining
-    max_distance = walk_feet_per_hour * (time_limit - start_node.time)
-    if start_node.is_search_origin:
-        buffer = create_origin_buffer(start_node, max_distance, context, feedback)
-    else:
-        buffer = create_buffer(start_node, max_distance, context, feedback)
 
-    if not buffer:
-        print("No buffer, returning empty from get_reachable_stops_walking")
-        return
 
-    #QgsProject.instance().addMapLayer(buffer)
+# Layer of the current project by name, so importing doesn't need a loaded project
+def get_layer(name):
+    if name not in layers:
+        found = QgsProject.instance().mapLayersByName(name)
+        if not found:
+            raise QgsProcessingException(f"No layer named {name} in the project")
+        layers[name] = found[0]
+    return layers[name]
 
-    # Clip the street layer to only search relevant streets
-    nearby_streets = clip_layer(street_layer, buffer, "clipped streets", context, feedback)
-    #QgsProject.instance().addMapLayer(nearby_streets)
-    
 
-    # Clip stop layer to only search relevant stops
-    nearby_stops = clip_layer(route_stops_layer, buffer, "clipped stops", context, feedback)
-    #QgsProject.instance().addMapLayer(nearby_stops)
+# The project's layers as a NetworkBuilder source, every feature in the street layer's crs
+class ProjectLayers:
+    def crs_id(self):
+        return get_layer(streets_name).crs().authid()
 
-    # Search the network to find all reachable stops
-    search_routes = find_stops_walking(start_node, nearby_streets, nearby_stops, context, feedback)
+    def polylines(self, name, fields):
+        layer = get_layer(name)
+        transform = get_street_transform(layer.crs())
+        for feature in layer.getFeatures():
+            parts = [[street_point(transform, point) for point in part] for part in get_polylines(feature.geometry())]
+            yield feature.id(), parts, {field: feature[field] for field in fields}
 
-    # Get rid of all stops that exceed the time remaining
-    remove_unreachable_stops(search_routes, start_node.time, time_limit)
+    def points(self, name, fields):
+        layer = get_layer(name)
+        transform = get_street_transform(layer.crs())
+        for feature in layer.getFeatures():
+            yield feature.id(), street_point(transform, get_point(feature.geometry())), \
+                  {field: feature[field] for field in fields}
 
-    # Get the walking service area from that node (not just the paths to nearby stops
-    # but all street segments reachable from the node)
-    local_service_area = create_walking_service_area(start_node, nearby_streets, time_limit, context, feedback)
-    new_total_service_area = save_service_area(total_service_area, local_service_area, context, feedback)
 
+# (x, y) of a QgsPointXY in the street layer's crs
+def street_point(transform, point):
+    if transform is not None:
+        point = transform.transform(point)
+    return point.x(), point.y()
 
-    #QgsProject.instance().addMapLayer(search_routes)
 
-    return search_routes, new_total_service_area
+# Builds the network data from the project's layers (see NetworkBuilder), made once per session
+def get_builder():
+    global builder
+    if builder is None:
+        builder = NetworkBuilder.NetworkBuilder(ProjectLayers(), transfer_table_file, block_table_file)
+    return builder
 
 
+# Everything a search needs from the project's layers, loaded once per session
+#   From the snapshot when there is an up to date one, otherwise from the layers
+def get_network_data():
+    if get_builder().network_data is None:
+        load_snapshot()
+    return get_builder().get_network_data()
 
-def get_reachable_stops_transit(start_node, time_limit, total_service_area, context, feedback):
 
-    # Select the route and stops that match the start node's rte and dir
-    isolated_route = extract_by_route(routes_layer, start_node.rte, start_node.dir, context, feedback)
-    isolated_stops = extract_by_route(route_stops_layer, start_node.rte, start_node.dir, context, feedback)
+# Files behind the layers and tables a snapshot is built from
+def get_source_paths():
+    paths = [get_layer(name).source().split('|')[0]
+             for name in (streets_name, route_stops_name, stops_name, routes_name)]
+    return paths + [transfer_table_file, block_table_file]
 
-    # Get the paths (portions of the route) from the start node to all stops on the route
-    search_routes = find_stops_transit(start_node, isolated_route, isolated_stops, context, feedback)
 
-    # Get rid of all stops that exceed the time remaining
-    remove_unreachable_stops(search_routes, start_node.time, time_limit)
+# Cache of finished searches, opened once per session
+def get_result_cache():
+    global result_cache
+    if result_cache is None:
+        result_cache = ResultCache.ResultCache(result_cache_file, result_cache_bytes)
+        print(f"Opened {result_cache}")
+    return result_cache
 
-    new_total_service_area = save_service_area(total_service_area, search_routes, context, feedback)
 
-    #QgsProject.instance().addMapLayer(search_routes)
+# Key of the current network data and GTFS feed for the result cache
+def get_network_key():
+    return ResultCache.network_key(NetworkSnapshot.source_stamp(get_source_paths()), gtfs_path)
 
-    return search_routes, new_total_service_area
 
+# Takes the network data from the snapshot, if it was built from the current sources
+@Profiler.timed('load snapshot')
+def load_snapshot():
+    if not os.path.exists(snapshot_file):
+        return None
+    try:
+        snapshot = NetworkSnapshot.load_snapshot(snapshot_file, NetworkSnapshot.source_stamp(get_source_paths()))
+    except ValueError as error:
+        print(f"Not using the snapshot: {error}")
+        return None
 
+    get_builder().use_snapshot(snapshot)
+    print(f"Loaded {snapshot}")
+    return snapshot
 
-def create_walking_service_area(start_node, streets, total_time, context, feedback):
-    lat_lon_str = start_node.get_coord_string()
-    #print(f"CWSA - streets type: {type(streets)}, feature count = {streets.featureCount()}")
-    service_area_id = processing.run("native:serviceareafrompoint", {
-        'INPUT': streets,
-        'STRATEGY': 1, 'DIRECTION_FIELD': '', 'VALUE_FORWARD': '', 'VALUE_BACKWARD': '', 'VALUE_BOTH': '',
-        'DEFAULT_DIRECTION': 2, 'SPEED_FIELD': '', 'DEFAULT_SPEED': ft_to_m * walk_km_per_hour, 'TOLERANCE': 0,
-        'START_POINT': lat_lon_str, 'TRAVEL_COST2': total_time - start_node.time, 'INCLUDE_BOUNDS': False,
-        'OUTPUT_LINES': 'TEMPORARY_OUTPUT'},
-        is_child_algorithm=True,
-        context=context,
-        feedback=feedback)['OUTPUT_LINES']
-    service_area = context.getMapLayer(service_area_id)
-    return service_area
 
+# Offline stage: compiles the network data, block table and route geometries read from
+#   the layers into one snapshot for NetworkSnapshot.load_snapshot
+def build_snapshot(path):
+    network = NetworkData.NetworkData(get_walking_network(), get_stop_index(), get_route_index(),
+                                      get_headway_table(), get_builder().route_stop_records, get_transfer_table())
+    return NetworkSnapshot.write_snapshot(path, network, NetworkSnapshot.source_stamp(get_source_paths()),
+                                          get_block_table(), get_builder().route_geometries)
 
 
-def save_service_area(total_area, new_area, context, feedback):
+# The parts of the network data, each read from the layers once (see NetworkBuilder)
+def get_walking_network():
+    return get_builder().get_walking_network()
 
-    if total_area is None:
-        total_area = new_area
-    else:
-        #print(f"SSA - total_area type: {type(total_area)}, feature count = {total_area.featureCount()}")
-        #print(f"SSA - new_area type: {type(new_area)}, feature count = {new_area.featureCount()}")
-        total_area_id = processing.run("native:mergevectorlayers", {
-            'LAYERS': [total_area,
-                       new_area], 'CRS': None,
-            'OUTPUT': 'TEMPORARY_OUTPUT'},
-            is_child_algorithm=True,
-            context=context,
-            feedback=feedback)['OUTPUT']
-        total_area = context.getMapLayer(total_area_id)
 
-        if total_area.featureCount() > 7:
-            total_area = dissolve_layer(total_area, context, feedback)
-    return total_area
+# Returns a list of (fid, rte, dir, x, y)
+def get_route_stop_points():
+    return get_builder().get_route_stop_points()
 
 
+def get_route_index():
+    return get_builder().get_route_index()
 
-# ********************************************************************************************************
 
-# Create buffer around the point indicated by a node's layer and id
-# Returns the vector layer containing the buffer
-def create_buffer(node, distance, context, feedback):
-    #print(f"   Creating buffer at coord {node.get_coord_string()} with distance {distance}")
-    select_feature_by_attribute(node.layer, 'fid', node.id, context, feedback)
-    node_extracted = extract_selection(node.layer, context, feedback)
-    
-    buffer_id = processing.run("native:buffer",
-        {'INPUT': node_extracted,
-        'DISTANCE':distance,
-        'SEGMENTS':5,
-        'END_CAP_STYLE':0,'JOIN_STYLE':0,'MITER_LIMIT':2,
-        'DISSOLVE':False,'OUTPUT':'memory:'},
-        is_child_algorithm=True,
-        context=context,
-        feedback=feedback)['OUTPUT']
-    if not buffer_id or not context:
-        return
-    buffer = context.getMapLayer(buffer_id)
-    node.layer.removeSelection()
-    #QgsProject.instance().addMapLayer(buffer)
-    return buffer
-
-
-def create_origin_buffer(node, distance, context, feedback):
-    coord = node.get_coord_string().split()[0]
-    coord_lat = float(coord.split(',')[0])
-    coord_lon = float(coord.split(',')[1])
-    crs = node.get_coord_string().split()[1].split('[')[1]
-    crs = crs.split(']')[0]
-
-    url = "point?crs=" + crs
-    layer = QgsVectorLayer(url, "init_point", "memory")
-
-    feat = QgsFeature()
-    feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(coord_lat, coord_lon)))
-    provider = layer.dataProvider()
-    provider.addFeatures([feat])
-
-    #print(f"COB - layer type: {type(layer)}, feature count = {layer.featureCount()}")
-    buffer_id = processing.run("native:buffer",
-                            {'INPUT': layer,
-                             'DISTANCE': distance,
-                             'SEGMENTS': 5,
-                             'END_CAP_STYLE': 0, 'JOIN_STYLE': 0, 'MITER_LIMIT': 2,
-                             'DISSOLVE': False, 'OUTPUT': 'memory:'},
-                            is_child_algorithm=True,
-                            context=context,
-                            feedback=feedback)['OUTPUT']
-    buffer_output = context.getMapLayer(buffer_id)
-    #QgsProject.instance().addMapLayer(buffer)
-    #QgsProject.instance().addMapLayer(layer)
-    return buffer_output
+def get_polylines(geometry):
+    if QgsWkbTypes.isMultiType(geometry.wkbType()):
+        return geometry.asMultiPolyline()
+    return [geometry.asPolyline()]
+
+
+def get_point(geometry):
+    if QgsWkbTypes.isMultiType(geometry.wkbType()):
+        return geometry.asMultiPoint()[0]
+    return geometry.asPoint()
+
+
+def get_stop_index():
+    return get_builder().get_stop_index()
+
+
+def get_headway_table():
+    return get_builder().get_headway_table()
+
+
+def get_transfer_table():
+    return get_builder().get_transfer_table()
+
+
+# Offline stage: walks from every stop in the stops layer to the route stops within
+#   transfer_table_hours and stores the results for NetworkData.reachable_stops_walking
+def build_transfer_table(path, feedback=None):
+    network = get_walking_network()
+    stop_points = get_stop_index().points()
+    table = TransferTable.build_transfer_table(network, stop_points,
+                                               walk_feet_per_hour * transfer_table_hours, path, feedback)
+    if path == transfer_table_file:
+        get_builder().transfer_table = table
+        if get_builder().network_data is not None:
+            get_builder().network_data.transfer_table = table
+    return table
+
+
+def get_block_table():
+    return get_builder().get_block_table()
+
+
+# Offline stage: finds the blocks within block_distance (in the blocks layer's units,
+#   as get_nearby_blocks measured) of every street feature and stores them for create_block_layer
+def build_block_table(path, feedback=None):
+    transform = None
+    street_layer = get_layer(streets_name)
+    blocks_layer = get_layer(blocks_name)
+    if blocks_layer.crs() != street_layer.crs():
+        transform = QgsCoordinateTransform(street_layer.crs(), blocks_layer.crs(), QgsProject.instance())
+
+    block_geometries = {feature.id(): feature.geometry() for feature in blocks_layer.getFeatures()}
+    spatial_index = QgsSpatialIndex(blocks_layer.getFeatures())
+
+    street_blocks = []
+    street_count = street_layer.featureCount()
+    for count, feature in enumerate(street_layer.getFeatures()):
+        if feedback is not None:
+            if feedback.isCanceled():
+                return None
+            feedback.setProgress(100 * count / street_count)
+
+        geometry = QgsGeometry(feature.geometry())
+        if transform is not None:
+            geometry.transform(transform)
+        candidates = spatial_index.intersects(geometry.boundingBox().buffered(block_distance))
+        street_blocks.append((feature.id(), [block for block in candidates
+                                             if geometry.distance(block_geometries[block]) <= block_distance]))
 
+    table = BlockTable.write_block_table(street_blocks, block_distance, path)
+    if path == block_table_file:
+        get_builder().block_table = table
+    return table
+
+
+# Trips of the GTFS feed running on a date, read once per date and joined to the stops
+@Profiler.timed('load timetable')
+def get_timetable(service_date):
+    if service_date not in timetables:
+        if not os.path.exists(gtfs_path):
+            raise QgsProcessingException(f"No GTFS feed at {gtfs_path}")
+        timetable = Timetable.load_timetable(gtfs_path, service_date)
+        network = get_network_data()
+        timetable.join_stops(network.stop_index, network.route_stop_records)
+        timetables[service_date] = timetable
+        print(f"Loaded {timetable}")
+    return timetables[service_date]
+
+
+# Converts a coordinate string ("x,y [EPSG:1234]") into an (x, y) in the street layer's crs
+def get_origin_point(coord_string):
+    point, crs_id = NetworkBuilder.parse_coord_string(coord_string)
+    if crs_id is None:
+        return point
+    return street_point(get_street_transform(QgsCoordinateReferenceSystem(crs_id)), QgsPointXY(*point))
+
+
+# Transform from a crs into the street layer's, or None when they already match
+def get_street_transform(crs):
+    street_crs = get_layer(streets_name).crs()
+    if crs == street_crs:
+        return None
+    return QgsCoordinateTransform(crs, street_crs, QgsProject.instance())
+
+
+# ********************************************************************************************************
 
 #clips a layer to a buffer
+@Profiler.timed('clip')
 def clip_layer(layer, overlay, name, context, feedback):
     #print(f"CLIPLAYER - layer type: {type(layer)}, feature count = {layer.featureCount()}")
     #print(f"CLIPLAYER - overlay type: {type(overlay)}, feature count = {overlay.featureCount()}")
@@ -271,6 +331,7 @@ def clip_layer(layer, overlay, name, context, feedback):
     return clipped
 
 
+@Profiler.timed('dissolve')
 def dissolve_layer(layer, context, feedback):
     #print(f"DISSOLVE - layer type: {type(layer)}, feature count = {layer.featureCount()}")
     dissolved_id =  processing.run("native:dissolve", {
@@ -282,6 +343,7 @@ def dissolve_layer(layer, context, feedback):
     return context.getMapLayer(dissolved_id)
 
 
+@Profiler.timed('polygonize')
 def polygonize(layer, context, feedback):
     #print(f"POLYGONIZE - layer type: {type(layer)}, feature count = {layer.featureCount()}")
     polygons_id = processing.run("native:polygonize",
@@ -295,9 +357,10 @@ def polygonize(layer, context, feedback):
     return dissolve_layer(polygons, context, feedback)
 
 #return blocks within 10 ft of a feature
+@Profiler.timed('nearby blocks')
 def get_nearby_blocks(feature, context, feedback):
     blocks_id = processing.run("native:extractwithindistance", 
-                   {'INPUT':blocks_layer,
+                   {'INPUT':get_layer(blocks_name),
                     'REFERENCE':feature,'DISTANCE':10,
                     'OUTPUT':'TEMPORARY_OUTPUT'},
                     is_child_algorithm=True,
@@ -306,15 +369,83 @@ def get_nearby_blocks(feature, context, feedback):
     return context.getMapLayer(blocks_id)
 
 
+# Layer of the census blocks near a set of reached walking network edges
+#   Read from the block table, so no geometry is compared (see build_block_table)
+@Profiler.timed('block layer')
+def create_block_layer(edges, context, feedback):
+    street_fids = get_walking_network().edge_fids[sorted(edges)]
+    return select_blocks(get_block_table().blocks(street_fids).tolist(), context, feedback)
+
+
+# Layer of the blocks reachable over a window of departures (a TimetableSearch.ProfileResult),
+#   with the percentage of departures each was reachable from in reachable_pct
+@Profiler.timed('block layer')
+def create_block_percentage_layer(result, context, feedback):
+    percentages = result.block_percentages()
+    layer = select_blocks(list(percentages), context, feedback)
+    provider = layer.dataProvider()
+    provider.addAttributes([QgsField('reachable_pct', QVariant.Double)])
+    layer.updateFields()
+    field = layer.fields().indexOf('reachable_pct')
+    # Block fids are kept as the fid field when the selection is saved
+    provider.changeAttributeValues({feature.id(): {field: percentages[feature['fid']]}
+                                    for feature in layer.getFeatures()})
+    return layer
+
+
+# Layer of census blocks split into nested time bands, block fid -> band limit in hours
+#   The band's limit in minutes goes in band_min, so each band is the blocks with
+#   band_min at or below its limit
+@Profiler.timed('block layer')
+def create_block_band_layer(block_bands, context, feedback):
+    layer = select_blocks(list(block_bands), context, feedback)
+    provider = layer.dataProvider()
+    provider.addAttributes([QgsField('band_min', QVariant.Int)])
+    layer.updateFields()
+    field = layer.fields().indexOf('band_min')
+    provider.changeAttributeValues({feature.id(): {field: round(block_bands[feature['fid']] * 60)}
+                                    for feature in layer.getFeatures()})
+    return layer
+
+
+# Layer of census blocks with a value each, block fid -> value, in a Double field
+@Profiler.timed('block layer')
+def create_block_value_layer(block_values, field_name, context, feedback):
+    layer = select_blocks(list(block_values), context, feedback)
+    provider = layer.dataProvider()
+    provider.addAttributes([QgsField(field_name, QVariant.Double)])
+    layer.updateFields()
+    field = layer.fields().indexOf(field_name)
+    provider.changeAttributeValues({feature.id(): {field: block_values[feature['fid']]}
+                                    for feature in layer.getFeatures()})
+    return layer
+
+
+# Layer of a set of census blocks, by fid
+@Profiler.timed('select blocks')
+def select_blocks(block_fids, context, feedback):
+    blocks_layer = get_layer(blocks_name)
+    blocks_layer.removeSelection()
+    blocks_layer.selectByIds(block_fids)
+    blocks_id = processing.run("native:saveselectedfeatures",
+                               {'INPUT': blocks_layer, 'OUTPUT': 'TEMPORARY_OUTPUT'},
+                               is_child_algorithm=True,
+                               context=context,
+                               feedback=feedback)['OUTPUT']
+    blocks_layer.removeSelection()
+    return context.getMapLayer(blocks_id)
+
+
 def add_layer(layer, name, group):
     layer.setName(name)
     QgsProject.instance().addMapLayer(layer, False)
     group.addLayer(layer)
 
 
+@Profiler.timed('write layer')
 def add_layer_to_gpkg(layer, name):
     layer.setName(name)
-    file = r"C:\Users\lukem\Documents\Projects\PortlandTransitIsochrone\SkateparkOutput.gpkg"
+    file = output_file
 
     save_options = QgsVectorFileWriter.SaveVectorOptions()
     save_options.driverName = "GPKG"
@@ -338,6 +469,27 @@ def add_layer_to_gpkg(layer, name):
         print(f"{name} Exported Successfully!")
 
 
+# Writer of the service areas of a batch into one table of the GeoPackage at path,
+#   in the blocks layer's crs (see GeoPackageWriter)
+#   resume: keep the origins already in the table (the searches skip them), otherwise write over it
+def open_result_writer(path, resume=True):
+    crs = get_layer(blocks_name).crs()
+    writer = GeoPackageWriter.GeoPackageWriter(path, crs.authid(), crs.toWkt())
+    if not resume:
+        writer.clear()
+    print(f"Opened {writer}")
+    return writer
+
+
+# The union of every feature of a polygon layer, as (WKB, envelope) for GeoPackageWriter.add_origin
+@Profiler.timed('union')
+def layer_geometry(layer):
+    geometry = QgsGeometry.unaryUnion([feature.geometry() for feature in layer.getFeatures()])
+    geometry.convertToMultiType()
+    box = geometry.boundingBox()
+    return bytes(geometry.asWkb()), (box.xMinimum(), box.yMinimum(), box.xMaximum(), box.yMaximum())
+
+
 '''
 def clone_layer(layer, name):
     layer.selectAll()
@@ -350,7 +502,44 @@ def clone_layer(layer, name):
 '''
 
 
+# Layer holding the street features of a set of reached walking network edges
+@Profiler.timed('street layer')
+def create_street_layer(edges, context, feedback):
+    network = get_walking_network()
+    street_layer = get_layer(streets_name)
+    street_layer.removeSelection()
+    street_layer.selectByIds(network.edge_fids[sorted(edges)].tolist())
+    streets_id = processing.run("native:saveselectedfeatures",
+                                {'INPUT': street_layer, 'OUTPUT': 'memory:'},
+                                is_child_algorithm=True,
+                                context=context,
+                                feedback=feedback)['OUTPUT']
+    streets = context.getMapLayer(streets_id)
+    street_layer.removeSelection()
+    streets.setName("Reachable_streets")
+    return streets
+
+
+# Layer of the route sections ridden, from the merged spans of a SearchResult
+@Profiler.timed('route layer')
+def create_route_span_layer(spans):
+    index = get_route_index()
+    layer = QgsVectorLayer("MultiLineString?crs=" + get_layer(streets_name).crs().authid(), "Reachable_routes", "memory")
+    route_geometries = get_builder().route_geometries
+    features = []
+    for pattern, start_measure, end_measure in spans:
+        parts = route_geometries[index.pattern_keys[pattern]]
+        polylines = TransitIndex.cut_polyline_parts(parts, start_measure, end_measure)
+        feature = QgsFeature()
+        feature.setGeometry(QgsGeometry.fromMultiPolylineXY(
+            [[QgsPointXY(x, y) for x, y in polyline] for polyline in polylines]))
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
 def create_reachable_stops_layer(stops_dict, context, feedback):
+    stops_layer = get_layer(stops_name)
     stops_layer.removeSelection()
     stops_layer.selectByIds(list(stops_dict.keys()))
     #print(f"CRSL - stops_layer type: {type(stops_layer)}, feature count = {stops_layer.featureCount()}")
@@ -366,17 +555,6 @@ def create_reachable_stops_layer(stops_dict, context, feedback):
     return clone_layer
 
 
-def remove_unreachable_stops(paths, start_time, total_time):
-    unreachable = []
-    for f in paths.getFeatures():
-        if f['cost']:
-            if start_time + f['cost'] > total_time:
-                unreachable.append(f.id())
-        else:
-            unreachable.append(f.id())
-    paths.dataProvider().deleteFeatures(unreachable)
-    paths.triggerRepaint()
-
 def select_feature_by_attribute(layer, field_name, value, context, feedback):
     layer.removeSelection()
     processing.run("qgis:selectbyattribute", {
@@ -388,43 +566,6 @@ def select_feature_by_attribute(layer, field_name, value, context, feedback):
     feedback=feedback)
 
 
-def sort_paths_by_cost(paths):
-    request = QgsFeatureRequest()
-
-    # set order by field
-    clause = QgsFeatureRequest.OrderByClause('cost', ascending=False)
-    orderby = QgsFeatureRequest.OrderBy([clause])
-    request.setOrderBy(orderby)
-    sorted_paths = paths.getFeatures(request)
-
-    return sorted_paths
-
-def select_by_route(layer, rt_num, rt_dir, context, feedback):
-    layer.removeSelection()
-    exp_string = f' "rte" is {rt_num} and "dir" is {rt_dir}'
-    processing.run("qgis:selectbyexpression", {
-        'INPUT': layer,
-        'EXPRESSION': exp_string, 'METHOD': 0},
-        is_child_algorithm=True,
-        context=context,
-        feedback=feedback)
-
-def extract_by_route(layer, rt_num, rt_dir, context, feedback):
-    select_by_route(layer, rt_num, rt_dir, context, feedback)
-    new_layer = extract_selection(layer, context, feedback)
-    layer.removeSelection()
-    return new_layer
-
-def extract_selection(layer, context, feedback):
-    new_layer = processing.run("native:saveselectedfeatures", 
-                               {'INPUT':layer,
-                               'OUTPUT':'TEMPORARY_OUTPUT'},
-                               is_child_algorithm=True,
-                               context=context,
-                               feedback=feedback)['OUTPUT']
-    return new_layer
-
-
 def convert_features_to_list(layer):
     lst = []
     for feature in layer.getFeatures():
@@ -0,0 +1,199 @@
+import os
+import sqlite3
+import time
+import zlib
+import numpy as np
+import NetworkSnapshot
+import Profiler
+from TransitSearch import SearchResult
+
+
+# Finished searches kept on disk, so repeated requests for the same place are answered
+#   without searching again
+#   Results are keyed by (network, origin node, snap, minutes, mode):
+#     network: network_key of the sources the search ran on, so results of older data aren't used
+#     origin node: walking network node nearest the origin
+#     snap: feet from the origin to that node, to the nearest foot (see cached_search)
+#     mode: what kind of search it was, e.g. "headway" or "timetable 2024-05-01 28800"
+#   A search only depends on its origin through the node it snaps to and the walk onto it,
+#   so every origin snapping to the same node within the same foot shares a result
+#   Each result keeps its reached edges with their times (delta encoded and compressed),
+#   so blocks and bands come from it the same way as from a fresh search
+#   Least recently used results are evicted once the cache holds more than max_bytes
+#   Hits and misses are counted for this session and in the file, across sessions
+# cache_version changes with the results table, whose older results are then dropped
+cache_version = 3
+cache_schema = """
+CREATE TABLE IF NOT EXISTS results (
+    network TEXT NOT NULL,
+    node INTEGER NOT NULL,
+    snap INTEGER NOT NULL,
+    minutes REAL NOT NULL,
+    mode TEXT NOT NULL,
+    walk_node_count INTEGER,
+    transit_node_count INTEGER,
+    repeat_count INTEGER,
+    rounds INTEGER,
+    elapsed REAL,
+    edges BLOB,
+    edge_times BLOB,
+    spans BLOB,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (network, node, snap, minutes, mode));
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL);
+"""
+span_dtype = np.dtype([('pattern', '<i4'), ('start', '<f8'), ('end', '<f8')])
+
+
+class ResultCache:
+    def __init__(self, path, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(path)
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != cache_version:
+            self.connection.executescript(f"DROP TABLE IF EXISTS results; PRAGMA user_version = {cache_version};")
+        self.connection.executescript(cache_schema)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self):
+        count, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return (f"ResultCache({self.path}, results: {count}, {size / 1024 / 1024:.1f} of "
+                f"{self.max_bytes / 1024 / 1024:.0f} MiB, hits: {self.hits}, misses: {self.misses}, "
+                f"hit rate: {self.hit_rate():.0%})")
+
+
+    # Hits over lookups, this session (or across every session using the file with all_time)
+    def hit_rate(self, all_time=False):
+        hits, misses = self.hits, self.misses
+        if all_time:
+            stats = dict(self.connection.execute("SELECT name, value FROM stats"))
+            hits, misses = stats.get('hits', 0), stats.get('misses', 0)
+        return hits / (hits + misses) if hits + misses else 0
+
+
+    # The cached SearchResult, named name, or None
+    def get(self, network, node, snap, time_limit, mode, name):
+        row = self.connection.execute(
+            "SELECT walk_node_count, transit_node_count, repeat_count, rounds, elapsed, edges, edge_times, spans "
+            "FROM results WHERE network = ? AND node = ? AND snap = ? AND minutes = ? AND mode = ?",
+            (network, node, snap, cache_minutes(time_limit), mode)).fetchone()
+        with self.connection:
+            if row is None:
+                self.misses += 1
+                self.count('misses')
+                return None
+            self.hits += 1
+            self.count('hits')
+            self.connection.execute(
+                "UPDATE results SET last_used = ? "
+                "WHERE network = ? AND node = ? AND snap = ? AND minutes = ? AND mode = ?",
+                (time.time(), network, node, snap, cache_minutes(time_limit), mode))
+
+        walk_node_count, transit_node_count, repeat_count, rounds, elapsed, edges, edge_times, spans = row
+        edges = np.cumsum(np.frombuffer(zlib.decompress(edges), dtype='<i4')).tolist()
+        times = np.frombuffer(zlib.decompress(edge_times), dtype='<f8').tolist()
+        spans = np.frombuffer(zlib.decompress(spans), dtype=span_dtype).tolist()
+        return SearchResult(name, time_limit, set(edges), spans, walk_node_count, transit_node_count,
+                            repeat_count, elapsed, dict(zip(edges, times)), rounds)
+
+
+    # Keeps a SearchResult that was kept with its edge times, evicting the least recently
+    #   used results if the cache grows past max_bytes
+    #   Edge times are kept as float64, so bands split a cached result as they split a fresh one
+    def put(self, network, node, snap, time_limit, mode, result):
+        edges = np.array(sorted(result.walking_edge_times), dtype='<i4')
+        times = np.array([result.walking_edge_times[edge] for edge in edges.tolist()], dtype='<f8')
+        edge_blob = zlib.compress(np.diff(edges, prepend=0).astype('<i4').tobytes())
+        time_blob = zlib.compress(times.tobytes())
+        span_blob = zlib.compress(np.array(result.transit_spans, dtype=span_dtype).tobytes())
+        size = len(edge_blob) + len(time_blob) + len(span_blob)
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (network, node, snap, cache_minutes(time_limit), mode, result.walk_node_count,
+                 result.transit_node_count, result.repeat_count, result.rounds, result.elapsed,
+                 edge_blob, time_blob, span_blob, size, time.time()))
+            self.evict()
+
+
+    # Drops least recently used results until the cache fits in max_bytes
+    def evict(self):
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for rowid, size in self.connection.execute("SELECT rowid, size FROM results ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.connection.execute("DELETE FROM results WHERE rowid = ?", (rowid,))
+            total -= size
+            evicted += 1
+        self.evictions += evicted
+        self.count('evictions', evicted)
+
+
+    def count(self, name, amount=1):
+        self.connection.execute("INSERT INTO stats VALUES (?, ?) "
+                                "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value", (name, amount))
+
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM results")
+
+
+    def close(self):
+        self.connection.close()
+
+
+
+# Minutes a result is filed under, rounded so hour fractions from different callers match
+def cache_minutes(time_limit):
+    return round(time_limit * 60, 3)
+
+
+# Key of the network a search ran on, from the stamp of its sources (see NetworkSnapshot.source_stamp)
+#   and of the GTFS feed, if there is one
+def network_key(stamp, gtfs_path=None):
+    key = f"{NetworkSnapshot.snapshot_version}:{stamp}"
+    if gtfs_path and os.path.exists(gtfs_path):
+        key = f"{key}:{NetworkSnapshot.source_stamp([gtfs_path])}"
+    return key
+
+
+# Mode a search is cached under
+#   departure_time: datetime of a timetable search, None for the routes' average waits
+#   exact_labels: whether the headway search ran with Search.exact_labels
+def search_mode(departure_time=None, exact_labels=False):
+    if departure_time is not None:
+        seconds = departure_time.hour * 3600 + departure_time.minute * 60 + departure_time.second
+        return f"timetable {departure_time:%Y-%m-%d} {seconds}"
+    return "headway exact" if exact_labels else "headway"
+
+
+# Runs a search from an origin, or takes its result from the cache
+#   search: function of an (x, y) running the search and returning its SearchResult,
+#     kept with its edge times (get_result's keep_times)
+#   feedback: optional, a search cancelled through it is cut short and isn't cached
+#   A search that isn't cached runs from the origin itself, so its result is exactly that of
+#   a search without the cache. Another origin snapping to the same node within the same foot
+#   is answered with it, its walks off by less than a foot (a quarter of a second).
+#   Returns the SearchResult, named name, and whether it came from the cache
+def cached_search(cache, network, key, name, origin_point, time_limit, mode, search, feedback=None):
+    node, snap_length = network.walking_network.nearest_node(*origin_point)
+    snap = round(snap_length)
+    with Profiler.phase('cache lookup'):
+        result = cache.get(key, node, snap, time_limit, mode, name)
+    if result is not None:
+        return result, True
+    result = search(origin_point)
+    result.name = name
+    if feedback is None or not feedback.isCanceled():
+        cache.put(key, node, snap, time_limit, mode, result)
+    return result, False
@@ -0,0 +1,348 @@
+import argparse
+import contextlib
+import csv
+import datetime
+import json
+import os
+import re
+import sys
+import time
+import NetworkLoader
+import ResultCache
+import Profiler
+import AccessibilityMatrix
+import BatchSearch
+import WorkQueue
+from TransitSearch import Search, split_bands
+from TimetableSearch import TimetableSearch, ProfileSearch
+
+
+# Command line and library entry point for service area searches, without QGIS
+#   python ServiceAreaCli.py --streets AreaFiles.gpkg --transit WorkingFiles.gpkg \
+#       --origin "7642303.8,681728.6 [EPSG:2913]" --minutes 30
+#   Adding --snapshot network.snap compiles the GeoPackages into a snapshot on the first run
+#   and memory maps it on the next (see NetworkSnapshot)
+#   Adding --gtfs gtfs.zip --departure 2024-05-01T08:00 searches the timetable of that day
+#   (see TimetableSearch) instead of the routes' average waits, and adding --departure-until 09:00
+#   searches every minute up to then, writing how often each street and block was reachable
+#   Adding --bands 15,30,45 searches once out to 45 minutes and also writes the streets (and blocks)
+#   first reached within each band
+#   Adding --cache results.sqlite answers repeated searches from the same street node from disk
+#   (see ResultCache)
+#   Adding --profile profile.json writes the time spent in each phase of the run as a Chrome trace
+#   (or as JSON lines, for a .jsonl path, see Profiler)
+#   Instead of --origin, --matrix matrix_dir --blocks blocks.gpkg searches from every census block
+#   and streams the travel times to every block reached into an accessibility matrix (see
+#   AccessibilityMatrix), adding --weight-field jobs to sum each block's reachable jobs
+#   Instead of --origin, --queue work.sqlite --origins origins.csv (name and origin columns) queues
+#   the origins and searches them one at a time into --output, a directory of a JSON file per
+#   origin (see WorkQueue): a rerun only searches the origins that aren't done, and any number of
+#   processes started the same way work through the queue together, sharing the directory
+# Writes the reached street fids, route sections (and census block fids, given a block table) as JSON
+
+
+# Searches from an origin coordinate string for a number of minutes
+#   departure_time: optional datetime, to search the GTFS timetable instead
+#   bands: optional list of minutes, to search out to the largest and keep the edge times
+#   cache: optional ResultCache, to answer from an earlier search or keep this one
+# Returns the TransitSearch.SearchResult
+def service_area(loader, name, origin_coords, minutes, departure_time=None, bands=None, cache=None):
+    if bands:
+        minutes = max(bands)
+
+    def search(origin_point):
+        if departure_time is None:
+            s = Search(minutes / 60, loader.get_network_data())
+            s.exact_labels = bool(bands)
+        else:
+            s = TimetableSearch(minutes / 60, loader.get_network_data(),
+                                loader.get_timetable(departure_time.date()), seconds_after_midnight(departure_time))
+        s.init_search(origin_point)
+        result = s.get_result(name, keep_times=bool(bands) or cache is not None)
+        s.print_search_summary()
+        return result
+
+    origin_point = loader.get_origin_point(origin_coords)
+    if cache is None:
+        return search(origin_point)
+    result, cached = ResultCache.cached_search(cache, loader.get_network_data(), loader.get_network_key(), name,
+                                               origin_point, minutes / 60,
+                                               ResultCache.search_mode(departure_time, bool(bands)), search)
+    print(f"{'Cached' if cached else 'Searched'} {result}, {cache}")
+    return result
+
+
+# Searches every minute of a window of departures, window_end a time on window_start's day
+# Returns the TimetableSearch.ProfileResult
+def profile(loader, name, origin_coords, minutes, window_start, window_end):
+    s = ProfileSearch(minutes / 60, loader.get_network_data(), loader.get_timetable(window_start.date()),
+                      seconds_after_midnight(window_start), seconds_after_midnight(window_end),
+                      loader.get_block_table())
+    s.init_search(loader.get_origin_point(origin_coords))
+    result = s.get_result(name)
+    s.print_search_summary()
+    return result
+
+
+# Streams the block to block travel times of every block in blocks_path into a matrix at matrix_path
+#   cutoffs: minutes to sum the weights of the reachable blocks within (defaults to minutes)
+#   workers: searches run across that many processes (see BatchSearch.run_block_rows)
+# Returns a record of the matrix written, with each origin block's weighted sums given a weight_field
+def accessibility_matrix(loader, blocks_path, matrix_path, minutes, weight_field=None, cutoffs=None, workers=1):
+    block_table = loader.get_block_table()
+    if block_table is None:
+        raise ValueError("Accessibility matrices need the street block table (--block-table)")
+    origins, weights = loader.get_block_origins(blocks_path, weight_field)
+    network = loader.get_network_data()
+    if workers > 1:
+        rows = BatchSearch.run_block_rows(network, block_table, origins, minutes / 60, workers)
+    else:
+        rows = AccessibilityMatrix.block_rows(network, block_table, origins, minutes / 60)
+
+    cutoffs = cutoffs or [minutes]
+    aggregates = [AccessibilityMatrix.WeightedSum(weights, cutoffs)] if weights is not None else []
+    writer = AccessibilityMatrix.MatrixWriter(matrix_path, minutes)
+    row_count = AccessibilityMatrix.write_matrix(rows, writer, aggregates, len(origins))
+    print(f"Wrote {row_count} of {len(origins)} rows to {writer}")
+
+    record = {'matrix': matrix_path,
+              'minutes': minutes,
+              'crs': loader.get_crs(),
+              'origins': row_count,
+              'entries': writer.entry_count}
+    if aggregates:
+        record['cutoffs'] = aggregates[0].cutoffs
+        record['accessibility'] = {str(fid): sums for fid, sums in aggregates[0].totals.items()}
+    return record
+
+
+# Works through a WorkQueue, writing each origin's result record into output_dir as it finishes
+#   An origin that raises is marked failed (and retried by the next run) and the rest carry on
+# Returns the queue's status counts
+def queue_worker(loader, queue, output_dir, bands=None, cache=None):
+    os.makedirs(output_dir, exist_ok=True)
+    requeued = queue.requeue_abandoned()
+    if requeued:
+        print(f"Requeued {requeued} origins abandoned by their workers")
+    print(f"Starting {queue}")
+    try:
+        while True:
+            claimed = queue.claim()
+            if not claimed:
+                break
+            name, origin_coords, time_limit = claimed[0]
+            start_time = time.perf_counter()
+            try:
+                result = service_area(loader, name, origin_coords, time_limit * 60, None, bands, cache)
+                write_json(result_record(loader, result, bands), result_path(output_dir, name, time_limit))
+            except Exception as error:
+                queue.fail(name, time_limit, f"{type(error).__name__}: {error}", time.perf_counter() - start_time)
+                print(f"{name} failed: {type(error).__name__}: {error}")
+                continue
+            if not queue.complete(name, time_limit, time.perf_counter() - start_time):
+                print(f"{name} ran past the queue's lease and was requeued, "
+                      f"another worker may search it again")
+    finally:
+        queue.release()
+        queue.print_summary()
+    return queue.counts()
+
+
+# Origins (name, origin) from the name and origin columns of a CSV file
+def read_origins(path):
+    with open(path, newline='') as file:
+        return [(row['name'], row['origin']) for row in csv.DictReader(file)]
+
+
+# File of an origin's result in a queue's output directory
+def result_path(output_dir, name, time_limit):
+    return os.path.join(output_dir, f"{unsafe_characters.sub('_', name)}_{time_limit * 60:g}.json")
+
+
+unsafe_characters = re.compile(r'[^\w.-]')
+
+
+# Writes JSON to a temporary file and moves it into place, so a file that exists is complete
+def write_json(record, path):
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w') as file:
+        json.dump(record, file)
+    os.replace(temporary_path, path)
+
+
+def seconds_after_midnight(departure_time):
+    return departure_time.hour * 3600 + departure_time.minute * 60 + departure_time.second
+
+
+# Plain data of a SearchResult, for writing as JSON
+#   bands: minutes to split the streets and blocks by, when the result kept its edge times
+def result_record(loader, result, bands=None):
+    network = loader.get_network_data()
+    street_fids = sorted(set(network.walking_network.edge_fids[sorted(result.walking_edges)].tolist()))
+    record = {'name': result.name,
+              'minutes': result.time_limit * 60,
+              'crs': loader.get_crs(),
+              'elapsed': result.elapsed,
+              'walk_nodes': result.walk_node_count,
+              'transit_nodes': result.transit_node_count,
+              'repeats': result.repeat_count,
+              'rounds': result.rounds,
+              'streets': street_fids,
+              'routes': [{'rte': rte, 'dir': direction, 'start': start, 'end': end}
+                         for (rte, direction), start, end in
+                         ((network.route_index.pattern_keys[pattern], start, end)
+                          for pattern, start, end in result.transit_spans)]}
+    block_table = loader.get_block_table()
+    if block_table is not None:
+        record['blocks'] = block_table.blocks(street_fids).tolist()
+
+    if bands and result.walking_edge_times is not None:
+        # Each fid is in the first band it is reached within
+        limits = [band / 60 for band in bands]
+        street_times = network.street_times(result.walking_edge_times)
+        record['street_bands'] = band_record(split_bands(street_times, limits))
+        if block_table is not None:
+            record['block_bands'] = band_record(split_bands(block_table.block_times(street_times), limits))
+    return record
+
+
+# band limit in hours -> fids, as minutes (a string, for JSON) -> sorted fids
+def band_record(bands):
+    return {f"{limit * 60:g}": sorted(fids) for limit, fids in bands.items()}
+
+
+# Plain data of a ProfileResult, percentages keyed by fid
+def profile_record(loader, result):
+    record = {'name': result.name,
+              'minutes': result.time_limit * 60,
+              'crs': loader.get_crs(),
+              'elapsed': result.elapsed,
+              'departures': result.departure_count,
+              'streets': result.street_percentages()}
+    if loader.get_block_table() is not None:
+        record['blocks'] = result.block_percentages()
+    return record
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Transit service area of a point in the Portland metro area')
+    parser.add_argument('--origin', default=None,
+                        help='origin as "x,y [EPSG:1234]", or "x,y" in the street layer\'s crs')
+    parser.add_argument('--minutes', default=None, type=float, help='search time limit in minutes')
+    parser.add_argument('--name', default=None, help='name of the result (defaults to the origin)')
+    parser.add_argument('--streets', default=None, help='GeoPackage with the street layer')
+    parser.add_argument('--transit', default=None, help='GeoPackage with the TriMet stop and route layers')
+    parser.add_argument('--transfer-table', default=None, help='precomputed walking transfer table')
+    parser.add_argument('--block-table', default=None, help='precomputed street block table')
+    parser.add_argument('--gtfs', default=None, help='GTFS feed (directory or zip) for --departure')
+    parser.add_argument('--departure', default=None, type=datetime.datetime.fromisoformat,
+                        help='departure date and time, as 2024-05-01T08:00, to search the GTFS timetable')
+    parser.add_argument('--departure-until', default=None, type=datetime.time.fromisoformat,
+                        help='latest departure, as 09:00, to search every minute from --departure')
+    parser.add_argument('--bands', default=None, type=parse_bands,
+                        help='time bands in minutes, as 15,30,45: searches out to the largest instead of --minutes')
+    parser.add_argument('--snapshot', default=None,
+                        help='network snapshot, read instead of the GeoPackages (and rebuilt from them when stale)')
+    parser.add_argument('--verify-snapshot', action='store_true',
+                        help='check the --snapshot against its checksum before using it')
+    parser.add_argument('--cache', default=None, help='SQLite file caching results between runs')
+    parser.add_argument('--cache-mb', default=512, type=float, help='size the cache is kept under, in MiB')
+    parser.add_argument('--profile', default=None,
+                        help='file to write a profile of the run to, a Chrome trace (or JSON lines for .jsonl)')
+    parser.add_argument('--matrix', default=None,
+                        help='directory to write a block to block accessibility matrix to, instead of searching --origin')
+    parser.add_argument('--blocks', default=None, help='GeoPackage with the census block layer, the --matrix origins')
+    parser.add_argument('--weight-field', default=None,
+                        help='block field (e.g. jobs) to sum over the blocks reachable from each block')
+    parser.add_argument('--cutoffs', default=None, type=parse_bands,
+                        help='minutes to sum --weight-field within, as 30,45 (defaults to --minutes)')
+    parser.add_argument('--workers', default=1, type=int, help='worker processes for --matrix')
+    parser.add_argument('--queue', default=None,
+                        help='SQLite work queue to search the --origins through, instead of searching --origin')
+    parser.add_argument('--origins', default=None,
+                        help='CSV file of origins (name and origin columns) to add to the --queue')
+    parser.add_argument('--max-attempts', default=3, type=int, help='times a --queue origin is tried before giving up')
+    parser.add_argument('--output', default=None,
+                        help='JSON file to write (defaults to stdout), the directory of the results with --queue')
+    args = parser.parse_args(argv)
+    if args.queue:
+        if not args.output:
+            parser.error('--queue needs an --output directory')
+        if args.origins and args.minutes is None and not args.bands:
+            parser.error('--origins needs --minutes or --bands')
+        if args.origin or args.matrix or args.departure:
+            parser.error('--queue can\'t be combined with --origin, --matrix or --departure')
+        if args.workers > 1:
+            parser.error('--queue searches one origin at a time, start more processes on the queue instead of --workers')
+    elif args.matrix:
+        if not args.blocks or args.minutes is None:
+            parser.error('--matrix needs --blocks and --minutes')
+        if args.origin or args.bands or args.departure:
+            parser.error('--matrix can\'t be combined with --origin, --bands or --departure')
+    elif not args.origin:
+        parser.error('--origin (or --matrix or --queue) is needed')
+    if args.minutes is None and not args.bands and not args.queue:
+        parser.error('--minutes or --bands is needed')
+    if args.bands and args.departure_until:
+        parser.error('--bands can\'t be combined with --departure-until')
+    if not args.snapshot and not (args.streets and args.transit):
+        parser.error('--streets and --transit are needed without a --snapshot')
+    if args.departure and not args.gtfs:
+        parser.error('--departure needs a --gtfs feed')
+    if args.departure_until and not args.departure:
+        parser.error('--departure-until needs a --departure')
+    return args
+
+
+def parse_bands(value):
+    bands = sorted(set(float(band) for band in value.split(',') if band.strip()))
+    if not bands or bands[0] <= 0:
+        raise argparse.ArgumentTypeError('bands must be positive minutes separated by commas')
+    return bands
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    loader = NetworkLoader.NetworkLoader(args.streets, args.transit, args.transfer_table, args.block_table,
+                                         args.snapshot, args.gtfs, args.verify_snapshot)
+    name = args.name or args.origin
+    # Progress goes to stderr, leaving stdout for the result
+    with contextlib.redirect_stdout(sys.stderr), Profiler.Profiling(args.profile):
+        if args.queue:
+            queue = WorkQueue.WorkQueue(args.queue, args.max_attempts)
+            if args.origins:
+                queue.add(read_origins(args.origins), max(args.bands) / 60 if args.bands else args.minutes / 60)
+            cache = None
+            if args.cache:
+                cache = ResultCache.ResultCache(args.cache, int(args.cache_mb * 1024 * 1024))
+            record = queue_worker(loader, queue, args.output, args.bands, cache)
+            queue.close()
+            if cache is not None:
+                cache.close()
+        elif args.matrix:
+            record = accessibility_matrix(loader, args.blocks, args.matrix, args.minutes, args.weight_field,
+                                          args.cutoffs, args.workers)
+        elif args.departure_until:
+            window_end = datetime.datetime.combine(args.departure.date(), args.departure_until)
+            record = profile_record(loader, profile(loader, name, args.origin, args.minutes,
+                                                    args.departure, window_end))
+        else:
+            cache = None
+            if args.cache:
+                cache = ResultCache.ResultCache(args.cache, int(args.cache_mb * 1024 * 1024))
+            result = service_area(loader, name, args.origin, args.minutes, args.departure, args.bands, cache)
+            record = result_record(loader, result, args.bands)
+            if cache is not None:
+                cache.close()
+
+    # A queue's results are already in its output directory, its status counts go to stdout
+    if args.output and not args.queue:
+        with open(args.output, 'w') as file:
+            json.dump(record, file)
+    else:
+        json.dump(record, sys.stdout)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,320 +1,330 @@
-import bisect
 import time
 from importlib import reload
 import ProjectInteraction
 reload(ProjectInteraction)
 from ProjectInteraction import *
-
-
-from qgis.core import (QgsFeatureRequest,
-                       QgsExpression,
-                       QgsProject)
+import TransitSearch
+reload(TransitSearch)
+from TransitSearch import SearchStart, Search, SearchResult, split_bands, print_elapsed_time
+import BatchSearch
+reload(BatchSearch)
+import TimetableSearch
+reload(TimetableSearch)
+import ResultCache
+reload(ResultCache)
+import AccessibilityMatrix
+reload(AccessibilityMatrix)
+import Profiler
+reload(Profiler)
+import WorkQueue
+reload(WorkQueue)
+
+
+from qgis.core import QgsProject
 from qgis.PyQt import QtGui
 
 
-class SearchStart:
-    def __init__(self, identifier, layer, time, dictionary, is_transit_node, is_search_origin):
-        self.id = identifier
-        self.layer = layer
-        self.time = time
-        self.dictionary = dictionary
-        self.is_transit_node = is_transit_node
-        self.is_search_origin = is_search_origin
-
-    def set_route_dir(self, rte, dir):
-        self.rte = rte
-        self.dir = dir
-
-    def set_coord_string(self, coords):
-        self.coord_string = coords
-
-    def get_coord_string(self):
-        if self.is_search_origin:
-            return self.coord_string
+# Writes the layers of a finished search (a TransitSearch.SearchResult)
+#   writer: optional GeoPackageWriter, to add the result's blocks to as one geometry instead
+@Profiler.timed('write results')
+def get_results(result, context, feedback, writer=None):
+    if writer is None:
+        group = QgsProject.instance().layerTreeRoot().addGroup(result.name)
+    rows = []
+
+    if result.transit_spans:
+        transit_service_area = create_route_span_layer(result.transit_spans)
+        # Perform final dissolve if necessary
+        if transit_service_area.featureCount() > 1:
+            transit_service_area = dissolve_layer(transit_service_area, context, feedback)
+        #add_layer(transit_service_area, f" {result.name } - Accessible transit network", group)
+    else:
+        print("No transit service area found")
+
+    if result.walking_edges:
+        if get_block_table() is not None:
+            # Blocks come straight from the reached edges, the street layer isn't needed
+            polygon_layer = create_block_layer(result.walking_edges, context, feedback)
         else:
-            feature = next(self.layer.getFeatures(QgsFeatureRequest().setFilterFid(self.id)))
-            geo_point = feature.geometry().asPoint()
-            return f"{geo_point.x()},{geo_point.y()} [{self.layer.crs().authid()}]"
-
-    def __repr__(self):
-        mode = "transit" if self.is_transit_node else "walking"
-        return f"id: {self.id}, mode: {mode}, time: {self.time},is_origin: {self.is_search_origin}"
-
-    def __lt__(self, other):
-        return self.time < other.time
-
-class Search:
-    def __init__(self, time_limit, context, feedback):
-        self.time_limit = time_limit
-        self.context = context
-        self.feedback = feedback
-        self.next_nodes = []
-        self.walk_nodes_dictionary = {}
-        self.transit_nodes_dictionary = {}
-        self.repeat_search_threshold = 10
-        self.repeat_count = 0
-        self.walking_service_area = None
-        self.transit_service_area = None
-
-
-    def print_dictionary(self, dictionary):
-        print("Dictionary:")
-        for elem in dictionary:
-            print(f"    {elem}")
-
-
-    def print_search_list(self):
-        print("Next/potential search nodes:")
-        for elem in self.next_nodes[slice(10)]:
-            print(f"    {elem}")
-        print("    ... ")
-
-
-    def print_search_summary(self):
-        print(f"Searched from {len(self.walk_nodes_dictionary.keys())} walk nodes")
-        print(f"Searched from {len(self.transit_nodes_dictionary.keys())} transit nodes")
-        print(f"    Repeated searches from {self.repeat_count} nodes")
-
-
-    def get_results(self, name):
-        root = QgsProject.instance().layerTreeRoot()
-        group = root.addGroup(name)
-
-        if self.transit_service_area is not None:
+            walking_service_area = create_street_layer(result.walking_edges, context, feedback)
             # Perform final dissolve if necessary
-            if self.transit_service_area.featureCount() > 1:
-                self.transit_service_area = dissolve_layer(self.transit_service_area, self.context, self.feedback)
-            #add_layer(self.transit_service_area, f" {name } - Accessible transit network", group)
+            if walking_service_area.featureCount() > 1:
+                walking_service_area = dissolve_layer(walking_service_area, context, feedback)
+            #add_layer(walking_service_area, f" {result.name } - Accessible street network", group)
+            polygon_layer = get_nearby_blocks(walking_service_area, context, feedback)
+        if writer is None:
+            create_polygon(polygon_layer, group, result.name, result.time_limit)
         else:
-            print("No transit service area found")
-
-        if self.walking_service_area is not None:
-            # Perform final dissolve if necessary
-            if self.walking_service_area.featureCount() > 1:
-                self.walking_service_area = dissolve_layer(self.walking_service_area, self.context, self.feedback)
-            #add_layer(self.walking_service_area, f" {name } - Accessible street network", group)
-            self.create_polygon(group, name)
-        else:
-            print("No walking service area found")
-
-
-
-    def create_polygon(self, group, name):
-        polygon_layer = get_nearby_blocks(self.walking_service_area, self.context, self.feedback)
-        renderer = polygon_layer.renderer()
-        #print(renderer.type())
-        symbol = renderer.symbol()
-        symbol.setColor(QtGui.QColor(255,0,0,100))
-        props = polygon_layer.renderer().symbol().symbolLayer(0).properties()
-        #print(f"Properties: {props}")
-        #symbol.setAlpha(.4)
-        #add_layer(polygon_layer, f" {name } - Accessible blocks", group)
-        add_layer_to_gpkg(polygon_layer, f"{name}_{self.time_limit*60}")
-
-    # Get the feature ID for the correct layer
-    #   If the search that yielded this feature was a transit search:
-    #       Node to be added should be from simple stops layer, with its fid
-    #   Otherwise, just add the fid from what was the route_stops layer
-    def get_correct_fid(self, feature, get_stop_fid):
-        if get_stop_fid:
-            stop_id = str(feature['stop_id'])
-            expr = QgsExpression("stop_id = " + stop_id)
-            stop_feature = next(stops_layer.getFeatures(QgsFeatureRequest(expr)))
-            return stop_feature['fid']
-        return feature['fid']
-
-
-    def should_add_search_node(self, key, dictionary, start_time):
-        if key not in dictionary:
-            return True
-
-        #return time < dictionary[key]
-
-
-        time_remaining = self.time_limit - start_time
-        prev_time_remaining = self.time_limit - dictionary[key]
-        if time_remaining > prev_time_remaining * self.repeat_search_threshold:
-            self.repeat_count += 1
-            return True
-
-        return False
-
-
-    # Takes a path to a new node and adds it to correct list
-    def add_search_node(self, feature, departing_time, add_to_walk_search, next_dictionary, next_layer):
-        if departing_time >= self.time_limit:
+            rows.append((None,) + layer_geometry(polygon_layer))
+    else:
+        print("No walking service area found")
+
+    if writer is not None:
+        writer.add_origin(result.name, result.time_limit, rows)
+
+
+
+# Writes the blocks of a finished search kept with its edge times (get_result's keep_times),
+#   split into nested bands by time limits (hours)
+#   With the block table, as one layer with each block's band in band_min,
+#   otherwise as one layer per band, each holding everything within its limit
+#   writer: optional GeoPackageWriter, to add each band as one geometry instead
+@Profiler.timed('write results')
+def get_band_results(result, limits, context, feedback, writer=None):
+    rows = []
+    if not result.walking_edge_times:
+        print("No walking service area found")
+    elif get_block_table() is not None:
+        street_times = get_network_data().street_times(result.walking_edge_times)
+        bands = split_bands(get_block_table().block_times(street_times), limits)
+        if writer is None:
+            block_bands = {fid: limit for limit, fids in bands.items() for fid in fids}
+            polygon_layer = create_block_band_layer(block_bands, context, feedback)
+            add_layer_to_gpkg(polygon_layer, f"{result.name}_{max(limits)*60}_bands")
             return
-        feature_key = self.get_correct_fid(feature, add_to_walk_search)
-
-        if self.should_add_search_node(feature_key, next_dictionary, departing_time):
-            next_dictionary[feature_key] = departing_time
-            node = SearchStart(feature_key,
-                               next_layer,
-                               departing_time, next_dictionary, not add_to_walk_search, False)
-            if not add_to_walk_search:
-                node.set_route_dir(feature['rte'], feature['dir'])
-            if self.next_nodes:
-                bisect.insort(self.next_nodes, node)
+        fids = []
+        for limit, band_fids in bands.items():
+            fids.extend(band_fids)
+            if fids:
+                rows.append((limit,) + layer_geometry(select_blocks(fids, context, feedback)))
+    else:
+        if writer is None:
+            group = QgsProject.instance().layerTreeRoot().addGroup(result.name)
+        edges = set()
+        for limit, band_edges in split_bands(result.walking_edge_times, limits).items():
+            edges.update(band_edges)
+            if not edges:
+                continue
+            walking_service_area = create_street_layer(edges, context, feedback)
+            if walking_service_area.featureCount() > 1:
+                walking_service_area = dissolve_layer(walking_service_area, context, feedback)
+            polygon_layer = get_nearby_blocks(walking_service_area, context, feedback)
+            if writer is None:
+                create_polygon(polygon_layer, group, result.name, limit)
             else:
-                self.next_nodes.append(node)
-
-
-    # Iterates over stops encountered in a search
-    # If a stop has a cost associated with it (it could be reached), sends it off for saving
-    def add_search_nodes(self, paths, node, add_to_walk_search):
-        next_search_layer = stops_layer if add_to_walk_search else route_stops_layer
-        next_dictionary = self.walk_nodes_dictionary if add_to_walk_search else self.transit_nodes_dictionary
-
-        for f in paths:
-            if f['cost']:
-                if node.is_search_origin or add_to_walk_search:
-                    departure_time = node.time + f['cost']
-                else:
-                    # Select the route that will depart from this stop
-                    select_by_route(routes_layer, f['rte'], f['dir'], self.context, self.feedback)
-                    if not routes_layer.selectedFeatures():
-                        continue
-                    next_route = routes_layer.selectedFeatures()[0]
-                    if next_route['TRIPS_PER_HOUR'] == 0:
-                        continue
-
-                    # Average wait is half of the headway of the route
-                    avg_wait = (1 / next_route['TRIPS_PER_HOUR']) / 2
-                    departure_time = node.time + f['cost'] + avg_wait
-                    routes_layer.removeSelection()
-
-                self.add_search_node(f, departure_time, add_to_walk_search, next_dictionary, next_search_layer)
-
-
-    # Select next node from which to begin a search
-    def pick_next(self):
-        # If no more searchable nodes, return none
-        if not self.next_nodes: return
-
-        # Get next candidate by popping it from list
-        node = self.next_nodes.pop(0)
-
-        # Only begin a search if the node in the search list has the same time as it's dictionary match
-        # Nodes may be entered multiple times if a faster start time is found
-        # The dictionary entry will contain the fastest start time
-        if node.time == node.dictionary[node.id]:
-            return node
-
-        return self.pick_next()
-
-
-    def update_walking_dictionary(self, path_features, start_search_time):
-        for f in path_features:
-            cost = f['cost']
-
-            feature_key = self.get_correct_fid(f, True)
-            if cost:
-                if (feature_key not in self.walk_nodes_dictionary.keys() or
-                        start_search_time + cost < self.walk_nodes_dictionary[feature_key]):
-                    self.walk_nodes_dictionary[feature_key] = start_search_time + cost
-
-
-    # Update the dictionary with the times a trip departed from each stop on route
-    # Assume a sorted list of paths to each stop
-    # Will also clean the paths layer to remove unreachable stops
-    # And stops beyond another encountered, better, depart time
-    def update_network_dictionary(self, path_features, start_search_time):
-        met_better_departure = False
-        for f in path_features:
-            fid = f['fid']
-            cost = f['cost']
-            if cost and fid in self.transit_nodes_dictionary and self.transit_nodes_dictionary[fid] < start_search_time + cost:
-                met_better_departure = True
-            if not met_better_departure and cost:
-                self.transit_nodes_dictionary[fid] = start_search_time + cost
-
-
-    def perform_transit_search(self, node):
-        paths_to_stops, self.transit_service_area = get_reachable_stops_transit(node, self.time_limit, self.transit_service_area,
-                                                                                self.context, self.feedback)
-        path_features_sorted = sort_paths_by_cost(paths_to_stops)
-        #print(f"Sorted path features: {path_features_sorted} and len: {len(list(path_features_sorted))}")
-        self.update_network_dictionary(path_features_sorted,node.time)
-        self.add_search_nodes(paths_to_stops.getFeatures(), node, True)
-
-
-    def perform_walk_search(self, node):
-        result = get_reachable_stops_walking(node, self.time_limit, self.walking_service_area,
-                                                                                self.context, self.feedback)
-        if not result:
-            print("No result from perform_walk_search, returning")
-            return
-        paths_to_stops, self.walking_service_area = result
-        path_features_sorted = sort_paths_by_cost(paths_to_stops)
-        self.update_walking_dictionary(paths_to_stops.getFeatures(), node.time)
-        self.add_search_nodes(path_features_sorted, node, False)
-
-
-    def perform_search(self):
-        while self.next_nodes:
-            next_origin = self.pick_next()
-            if next_origin:
-                #mode = "transit" if search_origin.is_transit_node else "walking"
-                # print(f"Beginning {mode} search from point {next_origin.id}")
-
-                if next_origin.is_transit_node:
-                    self.perform_transit_search(next_origin)
-                else:
-                    self.perform_walk_search(next_origin)
-            del next_origin
-            if self.feedback.isCanceled():
-                print("Cancelling search. Generating partial service layers.")
-
-                return
-        # print("Search complete")
+                rows.append((limit,) + layer_geometry(polygon_layer))
+
+    if writer is not None:
+        writer.add_origin(result.name, max(limits), rows)
+
+
+
+def create_polygon(polygon_layer, group, name, time_limit):
+    renderer = polygon_layer.renderer()
+    #print(renderer.type())
+    symbol = renderer.symbol()
+    symbol.setColor(QtGui.QColor(255,0,0,100))
+    props = polygon_layer.renderer().symbol().symbolLayer(0).properties()
+    #print(f"Properties: {props}")
+    #symbol.setAlpha(.4)
+    #add_layer(polygon_layer, f" {name } - Accessible blocks", group)
+    add_layer_to_gpkg(polygon_layer, f"{name}_{time_limit*60}")
+
+
+# departure_time: optional datetime, searching the GTFS timetable of its day
+#   (see TimetableSearch) instead of the average waits of the routes layer
+# bands: optional list of time limits (hours) to split the service area into, from one
+#   search out to the largest of them (search_time is then ignored)
+# use_cache: answer from the result cache when the same search has been run before, from an
+#   origin snapping onto the same street node (see ResultCache)
+# writer: optional GeoPackageWriter to add the result to, skipping the search when it already has it
+# network: optional network data for headway searches, e.g. one walk_shed_network shared by
+#   the searches of a batch run one at a time, the session's network data by default
+def main(name, origin_coords, search_time, context, feedback, departure_time=None, bands=None, use_cache=False,
+         writer=None, network=None):
+    if network is None:
+        network = get_network_data()
+    if bands:
+        search_time = max(bands)
+    if writer is not None and writer.has_origin(name, search_time):
+        print(f"{name} is already in {writer}, skipping it")
+        return
+    searches = []
+
+    def search(origin_point):
+        if departure_time is None:
+            s = Search(search_time, network, feedback)
+            # Bands need every node's earliest time, not just the first one found
+            s.exact_labels = bool(bands)
+        else:
+            s = TimetableSearch.TimetableSearch(search_time, get_network_data(),
+                                                get_timetable(departure_time.date()),
+                                                seconds_after_midnight(departure_time), feedback)
+        s.init_search(origin_point)
+        searches.append(s)
+        return s.get_result(name, keep_times=bool(bands) or use_cache)
+
+    origin_point = get_origin_point(origin_coords)
+    if use_cache:
+        result, cached = ResultCache.cached_search(get_result_cache(), network, get_network_key(), name,
+                                                   origin_point, search_time,
+                                                   ResultCache.search_mode(departure_time, bool(bands)), search,
+                                                   feedback)
+        print(f"{'Cached' if cached else 'Searched'} {result}, {get_result_cache()}")
+    else:
+        result = search(origin_point)
+    if writer is not None and feedback.isCanceled():
+        # A cancelled search stopped part way, keep it out of the output so it's searched again
+        print(f"Cancelled {name}, not writing it")
+        return
 
+    start_time = time.perf_counter()
+    if bands:
+        get_band_results(result, bands, context, feedback, writer)
+    else:
+        get_results(result, context, feedback, writer)
+    end_time = time.perf_counter()
+    print(f"    + Elapsed time performing final dissolves: {print_elapsed_time(end_time - start_time)}")
 
-    def init_search(self, origin_coords):
-        # Prep starting node
-        init_node = SearchStart(None, None, 0,
-                                self.transit_nodes_dictionary, False, True)
-        init_node.set_coord_string(origin_coords)
+    for s in searches:
+        s.print_search_summary()
 
-        # Prep node search list and dictionary
-        self.next_nodes.append(init_node)
-        init_node.dictionary[init_node.id] = init_node.time
 
-        # Perform and time the search
-        start_time = time.perf_counter()
-        self.perform_search()
-        end_time = time.perf_counter()
-        print(f"Elapsed search time: {print_elapsed_time(end_time - start_time)}")
+# The session's network data wrapped in a walk shed cache (see TransitSearch.WalkShedCache),
+#   for searches run one after another to share the walks from the stops they all reach
+def walk_shed_network():
+    return TransitSearch.WalkShedCache(get_network_data(), walk_shed_bytes)
 
 
+# Searches every minute of a window of departures (datetimes on the same day) at once
+#   (see TimetableSearch.ProfileSearch), writing the blocks reachable from any of them
+#   with the percentage of departures each was reachable from
+def main_profile(name, origin_coords, search_time, window_start, window_end, context, feedback):
+    if get_block_table() is None:
+        raise QgsProcessingException("Departure window searches need the street block table, "
+                                     "run Build Street Block Table first")
+    s = TimetableSearch.ProfileSearch(search_time, get_network_data(), get_timetable(window_start.date()),
+                                      seconds_after_midnight(window_start), seconds_after_midnight(window_end),
+                                      get_block_table(), feedback=feedback)
+    s.init_search(get_origin_point(origin_coords))
+    result = s.get_result(name)
+    print(f"Finished {result}")
 
+    if result.block_counts:
+        polygon_layer = create_block_percentage_layer(result, context, feedback)
+        add_layer_to_gpkg(polygon_layer, f"{name}_{search_time*60}")
+    else:
+        print("No walking service area found")
 
+    s.print_search_summary()
 
-def print_elapsed_time(seconds):
-    sec = seconds % (24 * 3600)
-    hour = sec // 3600
-    sec %= 3600
-    min = sec // 60
-    sec %= 60
-    #print("seconds value in hours:", hour)
-    #print("seconds value in minutes:", min)
-    #return "%02d:%02d:%02d" % (hour, min, sec)
-    return "%02d:%02d:%02d" % (hour, min, sec)
 
+def seconds_after_midnight(departure_time):
+    return departure_time.hour * 3600 + departure_time.minute * 60 + departure_time.second
 
-def main(name, origin_coords, search_time, context, feedback):
-    s = Search(search_time, context, feedback)
-    s.init_search(origin_coords)
-    #s.clean_up
 
+# Searches from many origins (name, coordinate string) across worker processes
+#   Results are written as they arrive, so a cancelled batch keeps what was finished
+#   writer: optional GeoPackageWriter to add the results to, origins it already has are skipped
+def main_batch(origins, search_time, workers, context, feedback, writer=None):
+    network = get_network_data()
+    origins = pending_origins(origins, search_time, writer)
+    origin_points = [(name, get_origin_point(origin_coords)) for name, origin_coords in origins]
 
     start_time = time.perf_counter()
-    s.get_results(name)
+    result_count = 0
+    for result in BatchSearch.run_batch(network, origin_points, search_time, workers, feedback,
+                                        walk_shed_bytes):
+        print(f"Finished {result}")
+        get_results(result, context, feedback, writer)
+        result_count += 1
+        feedback.setProgress(100 * result_count / len(origin_points))
     end_time = time.perf_counter()
-    print(f"    + Elapsed time performing final dissolves: {print_elapsed_time(end_time - start_time)}")
+    print(f"Searched from {result_count} of {len(origin_points)} origins "
+          f"with {workers} workers in {print_elapsed_time(end_time - start_time)}")
+
+
+# The origins a writer doesn't have yet, all of them without one
+def pending_origins(origins, search_time, writer):
+    if writer is None:
+        return list(origins)
+    pending = [(name, origin_coords) for name, origin_coords in origins if not writer.has_origin(name, search_time)]
+    if len(pending) < len(origins):
+        print(f"Skipping {len(origins) - len(pending)} origins already in {writer}")
+    return pending
+
+
+# Works through a WorkQueue of origins, searching each with main, until there are none left
+#   to claim (other QGIS or command line workers can work through the same queue meanwhile,
+#   each writing to its own output)
+#   An origin that raises is marked failed and the rest carry on; it is retried on the next run,
+#   up to the queue's max_attempts, along with anything left pending by a cancel or a crash
+#   writer: optional GeoPackageWriter, done origins whose rows it lost to a crash (they weren't
+#     committed yet) are searched again
+def main_queue(queue, context, feedback, writer=None):
+    network = walk_shed_network()
+    requeued = queue.requeue_abandoned()
+    if requeued:
+        print(f"Requeued {requeued} origins abandoned by their workers")
+    if writer is not None:
+        lost = [(origin, time_limit) for origin, time_limit in queue.done()
+                if not writer.has_origin(origin, time_limit)]
+        if lost:
+            print(f"Requeued {len(lost)} done origins missing from {writer}")
+            queue.requeue(lost)
+
+    total = sum(queue.counts().values())
+    print(f"Starting {queue}")
+    try:
+        while not feedback.isCanceled():
+            claimed = queue.claim()
+            if not claimed:
+                break
+            name, origin_coords, search_time = claimed[0]
+            start_time = time.perf_counter()
+            try:
+                main(name, origin_coords, search_time, context, feedback, writer=writer, network=network)
+            except Exception as error:
+                queue.fail(name, search_time, f"{type(error).__name__}: {error}", time.perf_counter() - start_time)
+                print(f"{name} failed: {type(error).__name__}: {error}")
+                continue
+            if feedback.isCanceled():
+                # A cancelled search is cut short and isn't written (see main), it goes back to pending
+                break
+            if not queue.complete(name, search_time, time.perf_counter() - start_time):
+                print(f"{name} ran past the queue's lease and was requeued, "
+                      f"another worker may search it again")
+            feedback.setProgress(100 * queue.counts().get('done', 0) / total)
+    finally:
+        queue.release()
+        queue.print_summary()
+
+
+# Block to block travel times from many origin blocks (fid, coordinate string of a point in it),
+#   streamed into an accessibility matrix at matrix_path (see AccessibilityMatrix)
+#   weights: optional block fid -> weight, summed over the blocks each origin reaches within
+#     search_time into a layer of the origin blocks, in accessibility
+def main_matrix(origins, search_time, matrix_path, workers, context, feedback, weights=None):
+    if get_block_table() is None:
+        raise QgsProcessingException("Accessibility matrices need the street block table, "
+                                     "run Build Street Block Table first")
+    network = get_network_data()
+    origin_points = [(fid, get_origin_point(origin_coords)) for fid, origin_coords in origins]
+    if workers > 1:
+        rows = BatchSearch.run_block_rows(network, get_block_table(), origin_points, search_time, workers,
+                                          feedback, walk_shed_bytes)
+    else:
+        rows = AccessibilityMatrix.block_rows(network, get_block_table(), origin_points, search_time,
+                                              feedback, walk_shed_bytes)
+
+    aggregate = None if weights is None else AccessibilityMatrix.WeightedSum(weights, [search_time * 60])
+    writer = AccessibilityMatrix.MatrixWriter(matrix_path, search_time * 60)
+
+    def progress(rows):
+        for row_count, row in enumerate(rows, 1):
+            feedback.setProgress(100 * row_count / len(origin_points))
+            yield row
 
-    s.print_search_summary()
-
-    del s
+    start_time = time.perf_counter()
+    row_count = AccessibilityMatrix.write_matrix(progress(rows), writer, [aggregate] if aggregate else [],
+                                                 len(origin_points))
+    print(f"Wrote {row_count} of {len(origin_points)} rows to {writer} "
+          f"in {print_elapsed_time(time.perf_counter() - start_time)}")
+
+    if aggregate is not None and aggregate.totals:
+        totals = {fid: sums[0] for fid, sums in aggregate.totals.items()}
+        add_layer_to_gpkg(create_block_value_layer(totals, 'accessibility', context, feedback),
+                          f"accessibility_{search_time*60:g}")
 
 
 #main("7642303.8,681728.6 [EPSG:2913]", .5)
\ No newline at end of file
@@ -0,0 +1,59 @@
+import numpy as np
+
+
+# Lookups from a stop's stop_id to its fid, and from its fid to its coordinates
+#   Both are sorted arrays searched with np.searchsorted, built once and shared by every search.
+#   Coordinates are kept in the crs given (the street network's), named by its authid.
+class StopIndex:
+    def __init__(self, fids, stop_ids, x, y, crs):
+        self.crs = crs
+
+        order = np.argsort(stop_ids, kind='stable')
+        self.sorted_stop_ids = stop_ids[order]
+        self.stop_id_fids = fids[order]
+
+        order = np.argsort(fids, kind='stable')
+        self.fids = fids[order]
+        self.x = x[order]
+        self.y = y[order]
+
+    def __len__(self):
+        return len(self.fids)
+
+    def __repr__(self):
+        return f"StopIndex(stops: {len(self)}, crs: {self.crs})"
+
+
+    def get_fid(self, stop_id):
+        index = np.searchsorted(self.sorted_stop_ids, stop_id)
+        if index == len(self.sorted_stop_ids) or self.sorted_stop_ids[index] != stop_id:
+            raise KeyError(f"No stop with stop_id {stop_id}")
+        return int(self.stop_id_fids[index])
+
+
+    def get_point(self, fid):
+        index = np.searchsorted(self.fids, fid)
+        if index == len(self.fids) or self.fids[index] != fid:
+            raise KeyError(f"No stop with fid {fid}")
+        return float(self.x[index]), float(self.y[index])
+
+
+    def get_coord_string(self, fid):
+        x, y = self.get_point(fid)
+        return f"{x},{y} [{self.crs}]"
+
+
+    # Every stop as (fid, x, y)
+    def points(self):
+        return list(zip(self.fids.tolist(), self.x.tolist(), self.y.tolist()))
+
+
+
+# Builds a StopIndex from (fid, stop_id, x, y) rows
+def build_stop_index(stops, crs):
+    stops = list(stops)
+    return StopIndex(np.array([stop[0] for stop in stops], dtype=np.int64),
+                     np.array([stop[1] for stop in stops], dtype=np.int64),
+                     np.array([stop[2] for stop in stops], dtype=np.float64),
+                     np.array([stop[3] for stop in stops], dtype=np.float64),
+                     crs)
@@ -0,0 +1,213 @@
+import csv
+import datetime
+import io
+import os
+import zipfile
+import numpy as np
+
+
+# Scheduled trips of one service day from a GTFS feed, laid out for RAPTOR
+#   Trips are grouped into timetable routes: trips of the same GTFS route and direction
+#   that visit the same stops in the same order, sorted by departure.
+#   Route r owns
+#     stops      route_stops[route_stop_offsets[r]:route_stop_offsets[r + 1]] (n stops)
+#     trips      route_trip_offsets[r]:route_trip_offsets[r + 1] (m trips)
+#     times      arrivals/departures[route_time_offsets[r]:...], m rows of n, in seconds after midnight
+#   The routes serving stop s are stop_routes[stop_route_offsets[s]:stop_route_offsets[s + 1]],
+#     with the stop's position along each in stop_route_positions
+#   route_keys: (GTFS route_id, direction_id) of every route
+#   stop_ids: GTFS stop_id of every stop
+class Timetable:
+    def __init__(self, service_date, stop_ids, route_keys, route_stop_offsets, route_stops,
+                 route_trip_offsets, route_time_offsets, arrivals, departures):
+        self.service_date = service_date
+        self.stop_ids = stop_ids
+        self.route_keys = route_keys
+        self.route_stop_offsets = route_stop_offsets
+        self.route_stops = route_stops
+        self.route_trip_offsets = route_trip_offsets
+        self.route_time_offsets = route_time_offsets
+        self.arrivals = arrivals
+        self.departures = departures
+        self.stop_lookup = {stop_id: stop for stop, stop_id in enumerate(stop_ids)}
+
+        # Routes through each stop (CSR)
+        route_counts = np.diff(route_stop_offsets)
+        stop_route_routes = np.repeat(np.arange(len(route_keys), dtype=np.int32), route_counts)
+        positions = np.arange(len(route_stops), dtype=np.int32) - np.repeat(route_stop_offsets[:-1], route_counts)
+        order = np.argsort(route_stops, kind='stable')
+        self.stop_routes = stop_route_routes[order]
+        self.stop_route_positions = positions[order]
+        self.stop_route_offsets = np.zeros(len(stop_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(route_stops, minlength=len(stop_ids)), out=self.stop_route_offsets[1:])
+
+        # Filled in by join_stops
+        self.stop_fids = None
+        self.route_stop_stops = {}
+
+    def __repr__(self):
+        return (f"Timetable({self.service_date}, stops: {len(self.stop_ids)}, routes: {len(self.route_keys)}, "
+                f"trips: {self.route_trip_offsets[-1]})")
+
+
+    def stop_count(self):
+        return len(self.stop_ids)
+
+
+    # Stops of a route, as a list of stop indices
+    def get_route_stops(self, route):
+        return self.route_stops[self.route_stop_offsets[route]:self.route_stop_offsets[route + 1]].tolist()
+
+
+    # (route, position) pairs of the routes through a stop
+    def get_stop_routes(self, stop):
+        start, end = self.stop_route_offsets[stop], self.stop_route_offsets[stop + 1]
+        return zip(self.stop_routes[start:end].tolist(), self.stop_route_positions[start:end].tolist())
+
+
+    # Arrival and departure times of a route's trips, each an (m trips, n stops) array
+    def get_route_times(self, route):
+        stop_count = self.route_stop_offsets[route + 1] - self.route_stop_offsets[route]
+        trip_count = self.route_trip_offsets[route + 1] - self.route_trip_offsets[route]
+        start = self.route_time_offsets[route]
+        end = start + stop_count * trip_count
+        return (self.arrivals[start:end].reshape(trip_count, stop_count),
+                self.departures[start:end].reshape(trip_count, stop_count))
+
+
+    # Joins the GTFS stops to the stops layer and the route stops snapped onto the walking network
+    #   Matched on stop_id, numerically when both are numbers (TriMet's are)
+    #   stop_fids: stops layer fid of each GTFS stop, -1 when it isn't in the layer
+    #   route_stop_stops: route stop fid -> GTFS stop, for walks found on the street network
+    def join_stops(self, stop_index, route_stop_records):
+        self.stop_fids = np.full(len(self.stop_ids), -1, dtype=np.int64)
+        for stop, stop_id in enumerate(self.stop_ids):
+            try:
+                self.stop_fids[stop] = stop_index.get_fid(int(stop_id))
+            except (KeyError, ValueError):
+                pass
+
+        self.route_stop_stops = {}
+        for fid, record in route_stop_records.items():
+            stop = self.find_stop(record['stop_id'])
+            if stop is not None:
+                self.route_stop_stops[fid] = stop
+
+
+    def find_stop(self, stop_id):
+        stop = self.stop_lookup.get(str(stop_id))
+        if stop is None and isinstance(stop_id, float) and stop_id.is_integer():
+            stop = self.stop_lookup.get(str(int(stop_id)))
+        return stop
+
+
+
+# Seconds after midnight of a GTFS time ("25:10:00" is 1:10 am the next day)
+def parse_time(value):
+    hours, minutes, seconds = value.strip().split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value.strip(), '%Y%m%d').date()
+
+
+# Rows of a GTFS file as dictionaries, from a feed directory or zip file
+#   Returns an empty list for an optional file that isn't in the feed
+def read_gtfs_file(path, name):
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as feed:
+            if name not in feed.namelist():
+                return []
+            with feed.open(name) as file:
+                return list(csv.DictReader(io.TextIOWrapper(file, encoding='utf-8-sig')))
+    file_path = os.path.join(path, name)
+    if not os.path.exists(file_path):
+        return []
+    with open(file_path, newline='', encoding='utf-8-sig') as file:
+        return list(csv.DictReader(file))
+
+
+# service_ids running on a date, from calendar.txt and its calendar_dates.txt exceptions
+def active_services(path, service_date):
+    weekday = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday'][service_date.weekday()]
+    services = set()
+    for row in read_gtfs_file(path, 'calendar.txt'):
+        if (row[weekday].strip() == '1' and
+                parse_date(row['start_date']) <= service_date <= parse_date(row['end_date'])):
+            services.add(row['service_id'])
+    for row in read_gtfs_file(path, 'calendar_dates.txt'):
+        if parse_date(row['date']) == service_date:
+            if row['exception_type'].strip() == '1':
+                services.add(row['service_id'])
+            else:
+                services.discard(row['service_id'])
+    return services
+
+
+# Reads the trips of a GTFS feed (directory or zip) running on service_date into a Timetable
+#   Stop times without a time are interpolated between the timed stops around them
+def load_timetable(path, service_date):
+    services = active_services(path, service_date)
+    trip_keys = {}
+    for row in read_gtfs_file(path, 'trips.txt'):
+        if row['service_id'] in services:
+            trip_keys[row['trip_id']] = (row['route_id'], int(row.get('direction_id') or 0))
+
+    trip_stop_times = {}
+    for row in read_gtfs_file(path, 'stop_times.txt'):
+        if row['trip_id'] in trip_keys:
+            arrival, departure = row['arrival_time'].strip(), row['departure_time'].strip()
+            trip_stop_times.setdefault(row['trip_id'], []).append(
+                (int(row['stop_sequence']), row['stop_id'],
+                 parse_time(arrival or departure) if arrival or departure else None,
+                 parse_time(departure or arrival) if arrival or departure else None))
+
+    stop_lookup = {}
+    patterns = {}
+    for trip_id, stop_times in trip_stop_times.items():
+        stop_times.sort()
+        if len(stop_times) < 2:
+            continue
+        stops = tuple(stop_lookup.setdefault(stop_id, len(stop_lookup)) for sequence, stop_id, a, d in stop_times)
+        arrivals = interpolate_times([arrival for sequence, stop_id, arrival, departure in stop_times])
+        departures = interpolate_times([departure for sequence, stop_id, arrival, departure in stop_times])
+        if arrivals is None:
+            continue
+        patterns.setdefault((trip_keys[trip_id], stops), []).append((departures[0], arrivals, departures))
+
+    route_keys = []
+    route_stop_offsets, route_trip_offsets, route_time_offsets = [0], [0], [0]
+    route_stops, arrivals, departures = [], [], []
+    for (key, stops), trips in sorted(patterns.items(), key=lambda pattern: (pattern[0][0], pattern[0][1])):
+        trips.sort(key=lambda trip: trip[0])
+        route_keys.append(key)
+        route_stops.extend(stops)
+        route_stop_offsets.append(len(route_stops))
+        route_trip_offsets.append(route_trip_offsets[-1] + len(trips))
+        for first_departure, trip_arrivals, trip_departures in trips:
+            arrivals.extend(trip_arrivals)
+            departures.extend(trip_departures)
+        route_time_offsets.append(len(arrivals))
+
+    stop_ids = [None] * len(stop_lookup)
+    for stop_id, stop in stop_lookup.items():
+        stop_ids[stop] = stop_id
+    return Timetable(service_date, stop_ids, route_keys,
+                     np.array(route_stop_offsets, dtype=np.int64),
+                     np.array(route_stops, dtype=np.int32),
+                     np.array(route_trip_offsets, dtype=np.int64),
+                     np.array(route_time_offsets, dtype=np.int64),
+                     np.array(arrivals, dtype=np.int32),
+                     np.array(departures, dtype=np.int32))
+
+
+# Fills in missing (None) times linearly between the known ones
+#   Returns None when the first or last time is missing
+def interpolate_times(times):
+    if times[0] is None or times[-1] is None:
+        return None
+    known = [index for index, time in enumerate(times) if time is not None]
+    if len(known) == len(times):
+        return times
+    return np.interp(np.arange(len(times)), known, [times[index] for index in known]).round().astype(int).tolist()
@@ -0,0 +1,379 @@
+import time
+import numpy as np
+import NetworkData
+import Profiler
+from TransitSearch import ServiceAreaAccumulator, SearchResult, print_elapsed_time
+
+
+# Departure time aware search over a GTFS Timetable, in place of the headway model of TransitSearch
+#   Earliest arrivals at every stop are found round by round (RAPTOR): round k rides
+#   every route through a stop improved in round k - 1, taking the earliest trip that can
+#   still be caught there, then walks on from every stop it improved.
+#   Walks between stops use the transfer table, or the street network, as Search does.
+# Results are the same SearchResult as Search, so they are written by the same code
+#   time_limit: hours
+#   departure_time: seconds after midnight of the timetable's service day
+class TimetableSearch:
+    def __init__(self, time_limit, network, timetable, departure_time, feedback=None, max_rounds=8):
+        self.time_limit = time_limit
+        self.network = network
+        self.timetable = timetable
+        self.departure_time = departure_time
+        self.feedback = feedback
+        self.max_rounds = max_rounds
+        self.arrival_limit = departure_time + time_limit * 3600
+
+        self.arrivals = np.full(timetable.stop_count(), np.inf)
+        # How each stop was last improved, (route, boarding position, alighting position) for a ride
+        self.ride_labels = {}
+        self.walks = {}
+        self.origin_walks = None
+        self.stop_sources = {}
+        self.rounds = 0
+        self.routes_scanned = 0
+        self.origin_source = None
+        self.service_area = ServiceAreaAccumulator()
+        self.elapsed = 0
+
+        if timetable.stop_fids is None:
+            timetable.join_stops(network.stop_index, network.route_stop_records)
+        self.stop_measures = pattern_stop_measures(network)
+
+
+    def print_search_summary(self):
+        print(f"Departing {format_time(self.departure_time)}, reached {len(self.reached_stops())} stops "
+              f"({len(self.ride_labels)} by transit)")
+        print(f"    {self.rounds} rounds, {self.routes_scanned} routes scanned, "
+              f"walks from {len(self.walks)} stops")
+        print(f"    Service area: {self.service_area}")
+
+
+    # Searches from an origin point, given in the network's coordinate system
+    def init_search(self, origin_point):
+        start_time = time.perf_counter()
+        with Profiler.phase('search'):
+            self.search_rounds(self.walk_from_origin(origin_point))
+            self.collect_service_area()
+        self.elapsed = time.perf_counter() - start_time
+        print(f"Elapsed search time: {print_elapsed_time(self.elapsed)}")
+
+
+    # Rides and walks round by round from the marked stops until nothing improves
+    # Returns False if the search was cancelled
+    def search_rounds(self, marked):
+        rounds = 0
+        while marked and rounds < self.max_rounds:
+            if self.feedback is not None and self.feedback.isCanceled():
+                print("Cancelling search. Generating partial service layers.")
+                return False
+            rounds += 1
+            with Profiler.phase('ride routes', round=rounds, marked=len(marked)):
+                improved = self.ride_routes(marked)
+            with Profiler.phase('walk from stops', round=rounds, improved=len(improved)):
+                marked = self.walk_from_stops(improved)
+        self.rounds += rounds
+        return True
+
+
+    # Arrivals at the stops walkable from the origin, the stops marked for the first round
+    #   The walk itself is only searched once, departures after the first reuse it
+    def walk_from_origin(self, origin_point):
+        if self.origin_walks is None:
+            self.origin_walks = []
+            walking_network = self.network.walking_network
+            node, snap_length = walking_network.nearest_node(*origin_point)
+            if node is not None:
+                self.origin_source = (node, snap_length)
+                max_cost = NetworkData.walk_feet_per_hour * self.time_limit
+                settled = walking_network.bounded_dijkstra([self.origin_source], max_cost)
+                for fid, cost in walking_network.stop_costs(settled, max_cost):
+                    stop = self.timetable.route_stop_stops.get(fid)
+                    if stop is not None:
+                        self.origin_walks.append((stop, cost / NetworkData.walk_feet_per_hour * 3600))
+
+        marked = set()
+        for stop, walk_time in self.origin_walks:
+            arrival = self.departure_time + walk_time
+            if arrival < self.arrivals[stop]:
+                self.arrivals[stop] = arrival
+                self.ride_labels.pop(stop, None)
+                marked.add(stop)
+        return marked
+
+
+    # One round of rides from the marked stops
+    # Returns the stops whose arrival improved
+    def ride_routes(self, marked):
+        timetable = self.timetable
+        previous = self.arrivals.copy()
+
+        # Each route only needs scanning from the first marked stop along it
+        queue = {}
+        for stop in marked:
+            for route, position in timetable.get_stop_routes(stop):
+                if position < queue.get(route, np.inf):
+                    queue[route] = position
+
+        improved = set()
+        for route, first_position in queue.items():
+            self.routes_scanned += 1
+            stops = timetable.get_route_stops(route)
+            arrivals, departures = timetable.get_route_times(route)
+            trip = None
+            boarded = None
+            for position in range(first_position, len(stops)):
+                stop = stops[position]
+                if trip is not None:
+                    arrival = arrivals[trip, position]
+                    if arrival < self.arrivals[stop] and arrival <= self.arrival_limit:
+                        self.arrivals[stop] = arrival
+                        self.ride_labels[stop] = (route, boarded, position)
+                        improved.add(stop)
+
+                # Catch an earlier trip here if this stop was reached in time for one
+                #   (trips are sorted by departure, and assumed not to overtake each other)
+                if previous[stop] <= self.arrival_limit and (trip is None or previous[stop] <= departures[trip, position]):
+                    earlier = int(np.searchsorted(departures[:, position], previous[stop]))
+                    if earlier < len(departures) and (trip is None or earlier < trip):
+                        trip = earlier
+                        boarded = position
+        return improved
+
+
+    # Walks on from the stops improved by a round's rides
+    # Returns every stop improved, for the next round
+    def walk_from_stops(self, improved):
+        marked = set(improved)
+        for stop in improved:
+            remaining = self.arrival_limit - self.arrivals[stop]
+            for other, walk_time in self.get_walks(stop):
+                if walk_time > remaining:
+                    break
+                arrival = self.arrivals[stop] + walk_time
+                if arrival < self.arrivals[other]:
+                    self.arrivals[other] = arrival
+                    self.ride_labels.pop(other, None)
+                    marked.add(other)
+        return marked
+
+
+    # (stop, seconds) walkable from a stop within the time limit, sorted by time
+    #   Found once per stop for the whole time limit, then cut short by the time remaining
+    def get_walks(self, stop):
+        walks = self.walks.get(stop)
+        if walks is None:
+            walks = []
+            fid = int(self.timetable.stop_fids[stop])
+            if fid >= 0:
+                max_cost = NetworkData.walk_feet_per_hour * self.time_limit
+                transfers = None
+                if self.network.transfer_table is not None:
+                    transfers = self.network.transfer_table.transfers(fid, max_cost)
+                if transfers is not None:
+                    stop_costs = zip(transfers[0].tolist(), transfers[1].tolist())
+                else:
+                    x, y = self.network.stop_index.get_point(fid)
+                    stop_costs = self.network.walking_network.search_stops_from_point(x, y, max_cost)
+
+                best = {}
+                for route_stop_fid, cost in stop_costs:
+                    other = self.timetable.route_stop_stops.get(route_stop_fid)
+                    if other is not None and other != stop and cost < best.get(other, np.inf):
+                        best[other] = cost
+                walks = sorted(((other, cost / NetworkData.walk_feet_per_hour * 3600) for other, cost in best.items()),
+                               key=lambda walk: walk[1])
+            self.walks[stop] = walks
+        return walks
+
+
+    # Stops reached before the arrival limit, as an array of stop indices
+    def reached_stops(self):
+        return np.flatnonzero(self.arrivals <= self.arrival_limit)
+
+
+    # (network node, cost in feet) to walk on from the origin and every stop reached,
+    #   each starting with the time already spent getting there
+    def walking_sources(self):
+        sources = [self.origin_source] if self.origin_source is not None else []
+        for stop in self.reached_stops().tolist():
+            source = self.get_stop_source(stop)
+            if source is not None:
+                hours = (self.arrivals[stop] - self.departure_time) / 3600
+                sources.append((source[0], NetworkData.walk_feet_per_hour * hours + source[1]))
+        return sources
+
+
+    # Network node a stop snaps to and the snap length, or None if it isn't on the network
+    def get_stop_source(self, stop):
+        if stop not in self.stop_sources:
+            source = None
+            fid = int(self.timetable.stop_fids[stop])
+            if fid >= 0:
+                node, snap_length = self.network.walking_network.nearest_node(*self.network.stop_index.get_point(fid))
+                if node is not None:
+                    source = (node, snap_length)
+            self.stop_sources[stop] = source
+        return self.stop_sources[stop]
+
+
+    # Walking sources and ridden route sections of everything reached, for get_result
+    #   The walked streets are found in one pass from all the walking sources
+    def collect_service_area(self):
+        for node, cost in self.walking_sources():
+            self.service_area.add_walking_source(node, cost)
+
+        for route, boarded, alighted in self.ride_labels.values():
+            span = self.ride_span(route, boarded, alighted)
+            if span is not None:
+                self.service_area.add_transit_span(*span)
+
+
+    # (pattern, start measure, end measure) of a ride, on the route layer's pattern of the same
+    #   route and direction, or None when the route or its stops aren't in the route layers
+    def ride_span(self, route, boarded, alighted):
+        route_id, direction = self.timetable.route_keys[route]
+        stops = self.timetable.get_route_stops(route)
+        start = self.stop_measures.get((route_id, direction, self.timetable.stop_ids[stops[boarded]]))
+        end = self.stop_measures.get((route_id, direction, self.timetable.stop_ids[stops[alighted]]))
+        if start is None or end is None:
+            return None
+        return start[0], min(start[1], end[1]), max(start[1], end[1])
+
+
+    # keep_times: also keep the time each edge was reached at (see TransitSearch.Search.get_result)
+    def get_result(self, name, keep_times=False):
+        walking_edge_times = None
+        with Profiler.phase('walked edges'):
+            if keep_times:
+                walking_edge_times = {}
+                if self.service_area.walking_sources:
+                    walking_edge_times = self.network.walked_edge_times(self.service_area.walking_source_list(),
+                                                                        self.time_limit)
+                walking_edges = set(walking_edge_times)
+            else:
+                walking_edges = set()
+                if self.service_area.walking_sources:
+                    walking_edges = self.network.walked_edges(self.service_area.walking_source_list(),
+                                                              self.time_limit)
+        return SearchResult(name, self.time_limit, walking_edges, self.service_area.transit_spans(),
+                            len(self.reached_stops()), len(self.ride_labels),
+                            0, self.elapsed, walking_edge_times, self.rounds)
+
+
+
+
+# How often each street and block is reachable over a window of departures
+#   departure_count: departures searched
+#   street_counts: street feature fid -> departures it was reachable from
+#   block_counts: census block fid -> departures it was reachable from (empty without a block table)
+class ProfileResult:
+    def __init__(self, name, time_limit, window_start, window_end, departure_count, street_counts, block_counts,
+                 elapsed):
+        self.name = name
+        self.time_limit = time_limit
+        self.window_start = window_start
+        self.window_end = window_end
+        self.departure_count = departure_count
+        self.street_counts = street_counts
+        self.block_counts = block_counts
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return (f"ProfileResult({self.name}, {self.time_limit * 60:.0f} min, departing {format_time(self.window_start)}"
+                f"-{format_time(self.window_end)}, departures: {self.departure_count}, "
+                f"streets: {len(self.street_counts)}, blocks: {len(self.block_counts)}, "
+                f"elapsed: {print_elapsed_time(self.elapsed)})")
+
+
+    # Share of the departures each block (or street, without a block table) was reachable from
+    def block_percentages(self):
+        return {fid: 100 * count / self.departure_count for fid, count in self.block_counts.items()}
+
+    def street_percentages(self):
+        return {fid: 100 * count / self.departure_count for fid, count in self.street_counts.items()}
+
+
+
+# A TimetableSearch for every departure in a window, sharing one set of labels
+#   Departures are searched from the latest to the earliest (rRAPTOR). An arrival found
+#   for a later departure can still be made from an earlier one by waiting at the origin,
+#   so the labels are kept and each earlier departure only has to improve on them,
+#   which touches far fewer stops than searching it from scratch.
+#   window_start, window_end: seconds after midnight, every step seconds in between is searched
+#   block_table: optional BlockTable, to count reachable blocks as well as streets
+class ProfileSearch(TimetableSearch):
+    def __init__(self, time_limit, network, timetable, window_start, window_end, block_table=None,
+                 step=60, feedback=None, max_rounds=8):
+        TimetableSearch.__init__(self, time_limit, network, timetable, window_end, feedback, max_rounds)
+        self.window_start = window_start
+        self.window_end = window_end
+        self.step = step
+        self.block_table = block_table
+        self.departure_count = 0
+        self.street_counts = {}
+        self.block_counts = {}
+
+
+    def print_search_summary(self):
+        print(f"Departing every {self.step} s from {format_time(self.window_start)} to {format_time(self.window_end)}, "
+              f"searched {self.departure_count} departures")
+        print(f"    {self.rounds} rounds, {self.routes_scanned} routes scanned, "
+              f"walks from {len(self.walks)} stops")
+
+
+    def init_search(self, origin_point):
+        start_time = time.perf_counter()
+        street_fids = []
+        block_fids = []
+        for departure_time in range(self.window_end, self.window_start - 1, -self.step):
+            self.departure_time = departure_time
+            self.arrival_limit = departure_time + self.time_limit * 3600
+            with Profiler.phase('departure', departure=format_time(departure_time)):
+                if not self.search_rounds(self.walk_from_origin(origin_point)):
+                    break
+
+            with Profiler.phase('walked edges'):
+                sources = self.walking_sources()
+                edges = self.network.walked_edges(sources, self.time_limit) if sources else set()
+                fids = np.unique(self.network.walking_network.edge_fids[sorted(edges)])
+                street_fids.append(fids)
+                if self.block_table is not None:
+                    block_fids.append(self.block_table.blocks(fids))
+            self.departure_count += 1
+
+        self.street_counts = count_fids(street_fids)
+        self.block_counts = count_fids(block_fids)
+        self.elapsed = time.perf_counter() - start_time
+        print(f"Elapsed search time: {print_elapsed_time(self.elapsed)}")
+
+
+    def get_result(self, name):
+        return ProfileResult(name, self.time_limit, self.window_start, self.window_end, self.departure_count,
+                             self.street_counts, self.block_counts, self.elapsed)
+
+
+
+# fid -> number of the arrays it appears in
+def count_fids(fid_arrays):
+    if not fid_arrays:
+        return {}
+    fids, counts = np.unique(np.concatenate(fid_arrays), return_counts=True)
+    return dict(zip(fids.tolist(), counts.tolist()))
+
+
+# (rte, dir, stop_id) -> (pattern, measure) of every route stop in the route index
+#   Keys are strings, as GTFS route_ids and stop_ids are
+def pattern_stop_measures(network):
+    route_index = network.route_index
+    measures = {}
+    for pattern, (rte, direction) in enumerate(route_index.pattern_keys):
+        start, end = route_index.pattern_offsets[pattern], route_index.pattern_offsets[pattern + 1]
+        for fid, measure in zip(route_index.route_stop_fids[start:end].tolist(),
+                                route_index.measures[start:end].tolist()):
+            stop_id = network.route_stop_records[fid]['stop_id']
+            measures[(str(rte), int(direction), str(stop_id))] = (pattern, measure)
+    return measures
+
+
+def format_time(seconds):
+    return "%02d:%02d" % (seconds // 3600, seconds % 3600 // 60)
@@ -0,0 +1,97 @@
+import numpy as np
+
+
+# Precomputed walking transfers from every stop to the route stops around it
+#   Stored as one flat binary file so it can be memory mapped instead of parsed:
+#     header                  (magic, stop count, transfer count, max walking cost)
+#     stop_fids[stop count]   sorted stop fids, int64
+#     offsets[stop count + 1] start of each stop's transfers, int64
+#     route_stop_fids[count]  reachable route stop fids, int64
+#     costs[count]            walking cost to each route stop in feet, float32
+#   A stop's transfers are sorted by cost, so a smaller budget is just a shorter prefix
+transfer_table_magic = b'PTXFER01'
+header_dtype = np.dtype([('magic', 'S8'),
+                         ('stop_count', '<i8'),
+                         ('transfer_count', '<i8'),
+                         ('max_cost', '<f8')])
+
+
+class TransferTable:
+    def __init__(self, stop_fids, offsets, route_stop_fids, costs, max_cost):
+        self.stop_fids = stop_fids
+        self.offsets = offsets
+        self.route_stop_fids = route_stop_fids
+        self.costs = costs
+        self.max_cost = max_cost
+
+    def __repr__(self):
+        return (f"TransferTable(stops: {len(self.stop_fids)}, transfers: {len(self.costs)}, "
+                f"max cost: {self.max_cost:.0f} ft)")
+
+
+    # Returns (route stop fids, costs) of the transfers from a stop within max_cost
+    #   or None if the table can't answer (unknown stop or a budget beyond the table's)
+    def transfers(self, stop_fid, max_cost):
+        if max_cost > self.max_cost:
+            return None
+        index = np.searchsorted(self.stop_fids, stop_fid)
+        if index == len(self.stop_fids) or self.stop_fids[index] != stop_fid:
+            return None
+        start, end = self.offsets[index], self.offsets[index + 1]
+        end = start + np.searchsorted(self.costs[start:end], max_cost, side='right')
+        return self.route_stop_fids[start:end], self.costs[start:end]
+
+
+
+# Runs a walking search from every stop and writes the results as a transfer table
+#   stop_points: iterable of (stop fid, x, y) in the network's coordinate system
+#   feedback: optional QgsProcessingFeedback-like object for progress and cancelling
+def build_transfer_table(network, stop_points, max_cost, path, feedback=None):
+    stop_points = sorted(stop_points)
+    stop_fids = []
+    offsets = [0]
+    route_stop_fids = []
+    costs = []
+    for count, (fid, x, y) in enumerate(stop_points):
+        if feedback is not None:
+            if feedback.isCanceled():
+                return None
+            feedback.setProgress(100 * count / len(stop_points))
+
+        transfers = sorted(network.search_stops_from_point(x, y, max_cost), key=lambda transfer: transfer[1])
+        stop_fids.append(fid)
+        route_stop_fids.extend(route_stop for route_stop, cost in transfers)
+        costs.extend(cost for route_stop, cost in transfers)
+        offsets.append(len(costs))
+
+    header = np.zeros(1, dtype=header_dtype)
+    header['magic'] = transfer_table_magic
+    header['stop_count'] = len(stop_fids)
+    header['transfer_count'] = len(costs)
+    header['max_cost'] = max_cost
+    with open(path, 'wb') as file:
+        header.tofile(file)
+        np.array(stop_fids, dtype='<i8').tofile(file)
+        np.array(offsets, dtype='<i8').tofile(file)
+        np.array(route_stop_fids, dtype='<i8').tofile(file)
+        np.array(costs, dtype='<f4').tofile(file)
+    return load_transfer_table(path)
+
+
+# Memory maps a transfer table written by build_transfer_table
+def load_transfer_table(path):
+    header = np.fromfile(path, dtype=header_dtype, count=1)
+    if len(header) == 0 or header['magic'][0] != transfer_table_magic:
+        raise ValueError(f"{path} is not a transfer table")
+    stop_count = int(header['stop_count'][0])
+    transfer_count = int(header['transfer_count'][0])
+
+    offset = header_dtype.itemsize
+    stop_fids = np.memmap(path, dtype='<i8', mode='r', offset=offset, shape=(stop_count,))
+    offset += stop_fids.nbytes
+    offsets = np.memmap(path, dtype='<i8', mode='r', offset=offset, shape=(stop_count + 1,))
+    offset += offsets.nbytes
+    route_stop_fids = np.memmap(path, dtype='<i8', mode='r', offset=offset, shape=(transfer_count,))
+    offset += route_stop_fids.nbytes
+    costs = np.memmap(path, dtype='<f4', mode='r', offset=offset, shape=(transfer_count,))
+    return TransferTable(stop_fids, offsets, route_stop_fids, costs, float(header['max_cost'][0]))
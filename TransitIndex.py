@@ -0,0 +1,172 @@
+import numpy as np
+
+
+# Ordered stops and cumulative ride times of every route pattern (rte, dir)
+#   Patterns are stored back to back in flat arrays, pattern p owning positions
+#   pattern_offsets[p]:pattern_offsets[p + 1], ordered along the route's direction of travel.
+#   ride_times are hours from the start of the pattern, measures are feet along the route.
+# Riding from a stop is then a slice of the pattern after the stop's position
+class RoutePatternIndex:
+    def __init__(self, pattern_keys, pattern_offsets, route_stop_fids, ride_times, measures):
+        self.pattern_keys = pattern_keys
+        self.pattern_offsets = pattern_offsets
+        self.route_stop_fids = route_stop_fids
+        self.ride_times = ride_times
+        self.measures = measures
+
+        self.pattern_lookup = {key: pattern for pattern, key in enumerate(pattern_keys)}
+        self.stop_patterns = np.repeat(np.arange(len(pattern_keys), dtype=np.int32),
+                                       np.diff(pattern_offsets))
+        self.stop_positions = {fid: position for position, fid in enumerate(route_stop_fids.tolist())}
+
+    def __repr__(self):
+        return f"RoutePatternIndex(patterns: {len(self.pattern_keys)}, stops: {len(self.route_stop_fids)})"
+
+
+    # (pattern, position, ride time in hours from the start of the pattern) of a route stop,
+    #   or None for a route stop not on any pattern
+    def ride_start(self, route_stop_fid):
+        position = self.stop_positions.get(route_stop_fid)
+        if position is None:
+            return None
+        return int(self.stop_patterns[position]), position, float(self.ride_times[position])
+
+
+    # Route stops downstream of a route stop that can be reached by riding before time_limit
+    # Returns (route stop fids, ride costs in hours, span) where span is the
+    #   (pattern, start measure, end measure) of route ridden, or None if nothing was reached
+    def downstream(self, route_stop_fid, start_time, time_limit):
+        position = self.stop_positions.get(route_stop_fid)
+        if position is None:
+            return self.route_stop_fids[:0], self.ride_times[:0], None
+
+        pattern = self.stop_patterns[position]
+        end = self.pattern_offsets[pattern + 1]
+        start_ride = self.ride_times[position]
+        end = position + 1 + np.searchsorted(self.ride_times[position + 1:end],
+                                             start_ride + time_limit - start_time, side='right')
+        if end == position + 1:
+            return self.route_stop_fids[:0], self.ride_times[:0], None
+
+        costs = self.ride_times[position + 1:end] - start_ride
+        span = (int(pattern), float(self.measures[position]), float(self.measures[end - 1]))
+        return self.route_stop_fids[position + 1:end], costs, span
+
+
+
+# Trips per hour of every route pattern (rte, dir), read once from the routes layer
+#   Never modified after loading, so lookups don't touch any layer's selection.
+#   hits and misses count lookups of known and unknown patterns (see count_lookups).
+class HeadwayTable:
+    def __init__(self, trips_per_hour):
+        self.trips_per_hour = trips_per_hour
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"HeadwayTable(patterns: {len(self.trips_per_hour)}, hits: {self.hits}, misses: {self.misses})"
+
+
+    # Counts the lookups of a search's boardings, from the average waits it looked up
+    #   in the RouteStopTable (half the headway, nan when the pattern is unknown)
+    def count_lookups(self, waits):
+        unknown = int(np.count_nonzero(np.isnan(waits)))
+        self.misses += unknown
+        self.hits += len(waits) - unknown
+
+
+
+# Builds a HeadwayTable from (rte, dir, trips per hour) rows
+#   The first row of a pattern wins, as the first selected route feature used to
+def build_headway_table(routes):
+    trips_per_hour = {}
+    for rte, direction, trips in routes:
+        trips_per_hour.setdefault((rte, direction), trips)
+    return HeadwayTable(trips_per_hour)
+
+
+# Builds a RoutePatternIndex from plain python data
+#   routes: iterable of (rte, dir, speed in thousands of feet per hour, [polyline parts])
+#   route_stops: iterable of (fid, rte, dir, x, y)
+# Each stop is located on its route by projecting it onto the nearest route segment
+#   (parts are measured in the order given, in their digitized direction)
+def build_route_pattern_index(routes, route_stops):
+    route_segments = {}
+    for rte, direction, speed, parts in routes:
+        segments = route_segments.setdefault((rte, direction), [])
+        feet_per_hour = (speed if speed else 1) * 1000
+        for part in parts:
+            for start, end in zip(part[:-1], part[1:]):
+                segments.append((start[0], start[1], end[0], end[1], feet_per_hour))
+
+    pattern_stops = {}
+    for fid, rte, direction, x, y in route_stops:
+        if (rte, direction) in route_segments:
+            pattern_stops.setdefault((rte, direction), []).append((fid, x, y))
+
+    pattern_keys = []
+    pattern_offsets = [0]
+    route_stop_fids, ride_times, measures = [], [], []
+    for key in sorted(pattern_stops):
+        segments = np.array(route_segments[key], dtype=np.float64).reshape(-1, 5)
+        located = locate_on_segments(segments, pattern_stops[key])
+        located.sort(key=lambda stop: stop[1])
+        pattern_keys.append(key)
+        route_stop_fids.extend(fid for fid, measure, ride_time in located)
+        measures.extend(measure for fid, measure, ride_time in located)
+        ride_times.extend(ride_time for fid, measure, ride_time in located)
+        pattern_offsets.append(len(route_stop_fids))
+
+    return RoutePatternIndex(pattern_keys,
+                             np.array(pattern_offsets, dtype=np.int64),
+                             np.array(route_stop_fids, dtype=np.int64),
+                             np.array(ride_times, dtype=np.float64),
+                             np.array(measures, dtype=np.float64))
+
+
+# Projects points onto a chain of segments (rows of ax, ay, bx, by, feet per hour)
+# Returns (fid, measure in feet, ride time in hours) for each (fid, x, y)
+def locate_on_segments(segments, points):
+    ax, ay, bx, by, feet_per_hour = segments.T
+    dx, dy = bx - ax, by - ay
+    segment_lengths = np.hypot(dx, dy)
+    squared_lengths = np.where(segment_lengths > 0, segment_lengths ** 2, 1)
+    start_measures = np.concatenate([[0], np.cumsum(segment_lengths)[:-1]])
+    start_times = np.concatenate([[0], np.cumsum(segment_lengths / feet_per_hour)[:-1]])
+
+    located = []
+    for fid, x, y in points:
+        along = np.clip(((x - ax) * dx + (y - ay) * dy) / squared_lengths, 0, 1)
+        distances = np.hypot(ax + along * dx - x, ay + along * dy - y)
+        nearest = int(np.argmin(distances))
+        offset = along[nearest] * segment_lengths[nearest]
+        located.append((fid, float(start_measures[nearest] + offset),
+                        float(start_times[nearest] + offset / feet_per_hour[nearest])))
+    return located
+
+
+# Cuts the section between two measures out of a chain of polyline parts
+# Returns a list of polylines (one per part the section touches)
+def cut_polyline_parts(parts, start_measure, end_measure):
+    polylines = []
+    measure = 0
+    for part in parts:
+        polyline = []
+        for start, end in zip(part[:-1], part[1:]):
+            length = ((end[0] - start[0]) ** 2 + (end[1] - start[1]) ** 2) ** 0.5
+            segment_start, segment_end = measure, measure + length
+            measure = segment_end
+            if segment_end < start_measure or segment_start > end_measure or length == 0:
+                continue
+            cut_start = interpolate(start, end, (max(start_measure, segment_start) - segment_start) / length)
+            cut_end = interpolate(start, end, (min(end_measure, segment_end) - segment_start) / length)
+            if not polyline:
+                polyline.append(cut_start)
+            polyline.append(cut_end)
+        if len(polyline) > 1:
+            polylines.append(polyline)
+    return polylines
+
+
+def interpolate(start, end, fraction):
+    return (start[0] + (end[0] - start[0]) * fraction, start[1] + (end[1] - start[1]) * fraction)
@@ -0,0 +1,523 @@
+import bisect
+import heapq
+import sys
+import time
+from collections import OrderedDict
+import numpy as np
+import Profiler
+
+
+# A node being searched from, made when it is popped from the frontier
+#   id: stop fid of a walk node, route stop fid of a transit node, None for the origin
+#   point: the origin's location, in the network's coordinate system
+class SearchStart:
+    __slots__ = ('id', 'time', 'is_transit_node', 'is_search_origin', 'point')
+
+    def __init__(self, identifier, time, is_transit_node, is_search_origin, point=None):
+        self.id = identifier
+        self.time = time
+        self.is_transit_node = is_transit_node
+        self.is_search_origin = is_search_origin
+        self.point = point
+
+    def __repr__(self):
+        mode = "transit" if self.is_transit_node else "walking"
+        return f"id: {self.id}, mode: {mode}, time: {self.time},is_origin: {self.is_search_origin}"
+
+
+# Times of every node of a search, in one preallocated array over dense node indices
+#   Transit nodes come first, in the order of the network's RouteStopTable, then walk nodes
+#   in the order of its StopIndex, then the search origin. Unlabelled nodes are np.inf.
+#   The frontier and StopPaths only carry indices, a node's fid is looked up when it is
+#   searched from (see Search.search_start)
+class NodeLabels:
+    __slots__ = ('times', 'walk_offset', 'origin')
+
+    def __init__(self, network):
+        self.walk_offset = len(network.route_stop_table().fids)
+        self.origin = self.walk_offset + len(network.stop_index)
+        self.times = np.full(self.origin + 1, np.inf)
+
+    def __repr__(self):
+        return f"NodeLabels({self.walk_count()} walk nodes, {self.transit_count()} transit nodes)"
+
+    def __len__(self):
+        return len(self.times)
+
+    def walk_count(self):
+        return int(np.count_nonzero(self.times[self.walk_offset:self.origin] != np.inf))
+
+    # The origin counts as a transit node, results have always counted it with them
+    def transit_count(self):
+        return int(np.count_nonzero(self.times[:self.walk_offset] != np.inf)) + int(self.times[self.origin] != np.inf)
+
+    def labelled(self):
+        return self.times != np.inf
+
+
+# Collects what a search reaches, for a single union once the search is done
+#   Walking searches are kept as (network node, cost already spent) sources, only the
+#   cheapest per node since it reaches everything a dearer one would. Rides are kept as
+#   (start, end) measure intervals per route pattern, merged as they arrive.
+#   Both are bounded by the size of the network, however many expansions a search makes.
+class ServiceAreaAccumulator:
+    def __init__(self):
+        self.walking_sources = {}
+        self.transit_intervals = {}
+
+    def add_walking_source(self, node, cost):
+        if cost < self.walking_sources.get(node, float('inf')):
+            self.walking_sources[node] = cost
+
+    def add_transit_span(self, pattern, start, end):
+        intervals = self.transit_intervals.setdefault(pattern, [])
+        index = bisect.bisect_left(intervals, (start, end))
+        # Absorb the neighbours the new interval overlaps
+        if index > 0 and intervals[index - 1][1] >= start:
+            index -= 1
+            start = intervals[index][0]
+            end = max(end, intervals[index][1])
+            del intervals[index]
+        while index < len(intervals) and intervals[index][0] <= end:
+            end = max(end, intervals[index][1])
+            del intervals[index]
+        intervals.insert(index, (start, end))
+
+    def walking_source_list(self):
+        return list(self.walking_sources.items())
+
+    # (pattern, start measure, end measure) of every merged section ridden
+    def transit_spans(self):
+        return [(pattern, start, end) for pattern, intervals in sorted(self.transit_intervals.items())
+                for start, end in intervals]
+
+    # Approximate bytes held, containers and entries
+    def memory_size(self):
+        size = sys.getsizeof(self.walking_sources) + sys.getsizeof(self.transit_intervals)
+        size += len(self.walking_sources) * (sys.getsizeof(0) + sys.getsizeof(0.0))
+        for intervals in self.transit_intervals.values():
+            size += sys.getsizeof(intervals) + len(intervals) * (sys.getsizeof((0.0, 0.0)) + 2 * sys.getsizeof(0.0))
+        return size
+
+    def __repr__(self):
+        return (f"{len(self.walking_sources)} walking sources, "
+                f"{sum(len(intervals) for intervals in self.transit_intervals.values())} route sections, "
+                f"~{self.memory_size() / 1024:.0f} KiB")
+
+
+# Network data wrapper remembering the walk shed of every stop searched from
+#   A stop's walk shed is its walking expansion with the whole time remaining: the route
+#   stops reachable from it, by descending cost. Any later expansion from the stop with
+#   less time remaining (by the same or another search) is the cheapest end of it, cut off
+#   with a binary search. A larger budget than the shed was found with searches it again.
+#   Sheds are kept up to about max_bytes, dropping the least recently used beyond that.
+class WalkShedCache:
+    def __init__(self, network, max_bytes=256 * 1024 * 1024):
+        self.network = network
+        self.max_bytes = max_bytes
+        # stop fid -> (time remaining it was searched with, StopPaths, ascending costs, bytes)
+        self.walk_sheds = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getattr__(self, name):
+        return getattr(self.network, name)
+
+    def __repr__(self):
+        return (f"{self.hits} reused, {self.misses} searched, {len(self.walk_sheds)} kept "
+                f"(~{self.size / 1024 / 1024:.1f} MiB), {self.evictions} dropped")
+
+    # Picklable as the network it wraps, the sheds stay behind (see BatchSearch)
+    def __reduce__(self):
+        return WalkShedCache, (self.network, self.max_bytes)
+
+
+    def reachable_stops_walking(self, node, time_limit):
+        if node.is_search_origin:
+            return self.network.reachable_stops_walking(node, time_limit)
+
+        time_remaining = time_limit - node.time
+        walk_shed = self.walk_sheds.get(node.id)
+        if walk_shed is not None and walk_shed[0] >= time_remaining:
+            self.hits += 1
+            self.walk_sheds.move_to_end(node.id)
+        else:
+            self.misses += 1
+            walk_shed = self.search_walk_shed(node.id, time_remaining)
+
+        shed_time, paths, costs, size = walk_shed
+        # Paths reachable from the node, as the network filters them (node.time + cost <= time_limit)
+        count = int(np.searchsorted(costs, time_remaining, side='right'))
+        while count and node.time + costs[count - 1] > time_limit:
+            count -= 1
+        while count < len(costs) and node.time + costs[count] <= time_limit:
+            count += 1
+        return paths[len(paths) - count:]
+
+
+    def search_walk_shed(self, stop_fid, time_remaining):
+        full_node = SearchStart(stop_fid, 0, False, False)
+        paths = self.network.reachable_stops_walking(full_node, time_remaining)
+        # Ascending, a view of the paths' costs
+        costs = paths.costs[::-1]
+        size = sys.getsizeof(paths) + paths.nbytes()
+
+        if stop_fid in self.walk_sheds:
+            self.size -= self.walk_sheds.pop(stop_fid)[3]
+        walk_shed = self.walk_sheds[stop_fid] = (time_remaining, paths, costs, size)
+        self.size += size
+        while self.size > self.max_bytes and len(self.walk_sheds) > 1:
+            self.size -= self.walk_sheds.popitem(last=False)[1][3]
+            self.evictions += 1
+        return walk_shed
+
+
+# What a finished search found, small enough to send between processes
+#   walking_edges: ids of the walking network edges reached
+#   transit_spans: (pattern, start measure, end measure) of the route sections ridden, merged
+# What a finished search reached, and how much work it took
+#   repeat_count: nodes searched again after being reached sooner (see Search)
+#   rounds: rounds of a TimetableSearch, 0 for other searches
+class SearchResult:
+    def __init__(self, name, time_limit, walking_edges, transit_spans, walk_node_count, transit_node_count,
+                 repeat_count, elapsed, walking_edge_times=None, rounds=0):
+        self.name = name
+        self.time_limit = time_limit
+        self.walking_edges = walking_edges
+        # edge -> hours it was reached at, only kept when asked for (see get_result)
+        self.walking_edge_times = walking_edge_times
+        self.transit_spans = transit_spans
+        self.walk_node_count = walk_node_count
+        self.transit_node_count = transit_node_count
+        self.repeat_count = repeat_count
+        self.rounds = rounds
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return (f"SearchResult({self.name}, {self.time_limit * 60:.0f} min, edges: {len(self.walking_edges)}, "
+                f"spans: {len(self.transit_spans)}, elapsed: {print_elapsed_time(self.elapsed)})")
+
+
+class Search:
+    def __init__(self, time_limit, network, feedback=None):
+        self.time_limit = time_limit
+        self.network = network
+        self.feedback = feedback
+        self.labels = NodeLabels(network)
+        # Frontier of (time, push order * node_stride + node index) entries kept as a binary heap
+        #   Equal times are popped in push order, first in first out
+        #   A node is pushed again whenever it gets a better time; the older entries
+        #   are left in place and skipped as stale when popped (see pick_next)
+        self.next_nodes = []
+        self.node_stride = len(self.labels)
+        self.push_count = 0
+        self.frontier_high_water = 0
+        self.stale_pops = 0
+        self.origin_point = None
+        self.repeat_search_threshold = 10
+        self.repeat_count = 0
+        # Search a node again whenever it is reached sooner, instead of by repeat_search_threshold
+        #   Slower, but then every node's time is its earliest arrival (needed by get_result's edge times)
+        self.exact_labels = False
+        # Earliest boarding time less the ride time to it of the rides that labelled every stop they
+        #   reached, by route pattern position, each position holding the least of the rides
+        #   boarded at or before it on its pattern, to skip boardings they dominate (see boarding_dominated)
+        self.ride_offsets = np.full(len(network.route_index.route_stop_fids), np.inf)
+        self.dominated_boardings = 0
+        # Skip walking searches that can't improve any label (see walk_search_dominated)
+        self.prune = True
+        self.pruned_walk_searches = 0
+        self.pruning_checks = 0
+        self.service_area = ServiceAreaAccumulator()
+        self.elapsed = 0
+
+
+    def print_search_list(self):
+        print("Next/potential search nodes:")
+        for time, entry in heapq.nsmallest(10, self.next_nodes):
+            print(f"    {self.search_start(entry % self.node_stride, time)}")
+        print("    ... ")
+
+
+    def print_search_summary(self):
+        print(f"Searched from {self.labels.walk_count()} walk nodes")
+        print(f"Searched from {self.labels.transit_count()} transit nodes")
+        print(f"    Repeated searches from {self.repeat_count} nodes")
+        print(f"    Frontier high-water mark: {self.frontier_high_water} nodes, {self.stale_pops} stale entries skipped")
+        headways = self.network.headway_table
+        print(f"    Headway lookups: {headways.hits} hits, {headways.misses} misses")
+        print(f"    Skipped {self.dominated_boardings} boardings dominated by earlier rides")
+        print(f"    Pruned {self.pruned_walk_searches} of {self.pruning_checks} walking searches checked")
+        if isinstance(self.network, WalkShedCache):
+            print(f"    Walk sheds: {self.network}")
+        print(f"    Service area: {self.service_area}")
+
+
+    # Collects what the search reached
+    #   The walked streets of every walking search are found here, in one pass
+    # keep_times: also keep the time each edge was reached at, for splitting into bands
+    #   (see split_bands), only exact when the search ran with exact_labels
+    def get_result(self, name, keep_times=False):
+        walking_edge_times = None
+        with Profiler.phase('walked edges'):
+            if keep_times:
+                walking_edge_times = {}
+                if self.service_area.walking_sources:
+                    walking_edge_times = self.network.walked_edge_times(self.service_area.walking_source_list(),
+                                                                        self.time_limit)
+                walking_edges = set(walking_edge_times)
+            else:
+                walking_edges = set()
+                if self.service_area.walking_sources:
+                    walking_edges = self.network.walked_edges(self.service_area.walking_source_list(),
+                                                              self.time_limit)
+        return SearchResult(name, self.time_limit, walking_edges, self.service_area.transit_spans(),
+                            self.labels.walk_count(), self.labels.transit_count(),
+                            self.repeat_count, self.elapsed, walking_edge_times)
+
+
+    def should_add_search_node(self, index, start_time):
+        label = self.labels.times[index]
+        if label == np.inf:
+            return True
+
+        if self.exact_labels:
+            return start_time < label
+
+
+        time_remaining = self.time_limit - start_time
+        prev_time_remaining = self.time_limit - label
+        if time_remaining > prev_time_remaining * self.repeat_search_threshold:
+            self.repeat_count += 1
+            return True
+
+        return False
+
+
+    # Labels a node reached at departing_time and adds it to the frontier, if it should be
+    def add_search_node(self, index, departing_time):
+        if departing_time >= self.time_limit:
+            return
+
+        if self.should_add_search_node(index, departing_time):
+            self.labels.times[index] = departing_time
+            self.push_node(index, departing_time)
+
+
+    # Adds a node to the frontier
+    #   The push order breaks ties between equal times, so they are searched first in first out
+    def push_node(self, index, time):
+        heapq.heappush(self.next_nodes, (time, self.push_count * self.node_stride + index))
+        self.push_count += 1
+        self.frontier_high_water = max(self.frontier_high_water, len(self.next_nodes))
+
+
+    # Adds the stops of a search's StopPaths that can be departed from before the time limit
+    #   Departures (and the wait for the route departing from each stop, skipping routes
+    #   that aren't known or have no trips) are found for every path at once, and so are the
+    #   stops reached sooner than their labels, the only ones add_search_node can add
+    def add_search_nodes(self, paths, node, add_to_walk_search):
+        departure_times = node.time + paths.costs
+        if add_to_walk_search:
+            stops = paths.stop_positions()
+            indices = stops + self.labels.walk_offset
+        else:
+            stops = None
+            indices = paths.route_stops
+            if not node.is_search_origin:
+                waits = paths.waits()
+                self.network.headway_table.count_lookups(waits)
+                departure_times = departure_times + waits
+
+        # Unknown routes (nan) and routes without trips (inf) are never departed
+        departing = np.flatnonzero(departure_times < self.time_limit)
+        if stops is not None:
+            departing = departing[stops[departing] >= 0]
+        indices, departure_times = indices[departing], departure_times[departing]
+        # Labels only get earlier while the paths are added, so this keeps every stop that can be
+        sooner = departure_times < self.labels.times[indices]
+        for index, departure_time in zip(indices[sooner].tolist(), departure_times[sooner].tolist()):
+            self.add_search_node(index, departure_time)
+
+
+    # Select next node from which to begin a search
+    # Returns (node index, time), or None
+    def pick_next(self):
+        times = self.labels.times
+        while self.next_nodes:
+            # Get next candidate by popping it from the heap
+            time, entry = heapq.heappop(self.next_nodes)
+            index = entry % self.node_stride
+
+            # Only begin a search if the node in the search list has the same time as its label
+            # Nodes may be entered multiple times if a faster start time is found
+            # The label will contain the fastest start time
+            if time == times[index]:
+                return index, time
+            self.stale_pops += 1
+
+        # If no more searchable nodes, return none
+        return None
+
+
+    # The SearchStart of a node index, with the fid the network looks it up by
+    def search_start(self, index, time):
+        labels = self.labels
+        if index == labels.origin:
+            return SearchStart(None, time, False, True, self.origin_point)
+        if index < labels.walk_offset:
+            return SearchStart(int(self.network.route_stop_table().label_fids[index]), time, True, False)
+        return SearchStart(int(self.network.stop_index.fids[index - labels.walk_offset]), time, False, False)
+
+
+    # Walk nodes of the stops walked to get the earliest of the arrivals at them
+    def update_walking_labels(self, paths, start_search_time):
+        stops = paths.stop_positions()
+        labelled = stops >= 0
+        np.minimum.at(self.labels.times, stops[labelled] + self.labels.walk_offset,
+                      start_search_time + paths.costs[labelled])
+
+
+    # Update the labels with the times a trip departed from each stop on route
+    # Paths are sorted by descending cost, so stops beyond another encountered,
+    #   better, depart time are left alone
+    # Returns whether every stop was labelled
+    def update_transit_labels(self, paths, start_search_time):
+        times = self.labels.times
+        arrivals = start_search_time + paths.costs
+        better = np.flatnonzero(times[paths.route_stops] < arrivals)
+        end = better[0] if len(better) else len(arrivals)
+        times[paths.route_stops[:end]] = arrivals[:end]
+        return end == len(arrivals)
+
+
+    def perform_transit_search(self, node):
+        ride = self.network.route_index.ride_start(node.id)
+        if ride is not None and self.boarding_dominated(node, *ride):
+            self.dominated_boardings += 1
+            return
+        paths_to_stops, span = self.network.reachable_stops_transit(node, self.time_limit)
+        if span is not None:
+            self.service_area.add_transit_span(*span)
+        if self.update_transit_labels(paths_to_stops, node.time) and ride is not None:
+            pattern, position, ride_time = ride
+            end = self.network.route_index.pattern_offsets[pattern + 1]
+            np.minimum(self.ride_offsets[position:end], node.time - ride_time, out=self.ride_offsets[position:end])
+        self.add_search_nodes(paths_to_stops, node, True)
+
+
+    # Whether a boarding is dominated by an earlier ride on the same route pattern, one boarded
+    #   at or before this stop that passed it no later than this boarding
+    #   That ride labelled every stop it reached, with times no later than riding on from here
+    #   would give, over a span reaching at least as far, so this ride would change nothing
+    def boarding_dominated(self, node, pattern, position, ride_time):
+        return self.ride_offsets[position] <= node.time - ride_time
+
+
+    def perform_walk_search(self, node):
+        # The walked streets of every walking search are found in one pass at the end
+        self.service_area.add_walking_source(*self.network.walking_source(node))
+        if self.prune and not node.is_search_origin and self.walk_search_dominated(node):
+            self.pruned_walk_searches += 1
+            return
+        paths_to_stops = self.network.reachable_stops_walking(node, self.time_limit)
+        self.update_walking_labels(paths_to_stops, node.time)
+        self.add_search_nodes(paths_to_stops, node, False)
+
+
+    # Whether a walking search from a node would change nothing
+    #   Every route stop in reach of it already has a walk label no later than the node's time
+    #   plus the straight line walk there, and a transit label no later than that plus the
+    #   route's wait (or can't be departed before the time limit). Walks are never shorter than
+    #   the straight line, so the search would only find later times, which
+    #   update_walking_labels and add_search_nodes both ignore.
+    def walk_search_dominated(self, node):
+        self.pruning_checks += 1
+        route_stops, bounds = self.network.route_stops_within(node, self.time_limit)
+        table = self.network.route_stop_table()
+        times = self.labels.times
+        arrivals = node.time + bounds
+        stops = table.stop_positions[route_stops]
+        if np.any((arrivals < times[stops + self.labels.walk_offset]) & (stops >= 0)):
+            return False
+        departures = arrivals + table.waits[route_stops]
+        return not np.any((departures < self.time_limit) & (departures < times[route_stops]))
+
+
+    def perform_search(self):
+        while self.next_nodes:
+            self.search_next()
+            if self.feedback is not None and self.feedback.isCanceled():
+                print("Cancelling search. Generating partial service layers.")
+
+                return
+        # print("Search complete")
+
+
+    # Pops the next node from the frontier and searches from it
+    def search_next(self):
+        picked = self.pick_next()
+        if picked:
+            next_origin = self.search_start(*picked)
+            #mode = "transit" if search_origin.is_transit_node else "walking"
+            # print(f"Beginning {mode} search from point {next_origin.id}")
+            profiler = Profiler.active
+            if profiler is not None:
+                start_time = time.perf_counter()
+
+            if next_origin.is_transit_node:
+                self.perform_transit_search(next_origin)
+            else:
+                self.perform_walk_search(next_origin)
+
+            if profiler is not None:
+                profiler.expansion("transit" if next_origin.is_transit_node else "walk", len(self.next_nodes),
+                                   start_time, time.perf_counter() - start_time)
+
+
+    # Searches from an origin point, given in the network's coordinate system
+    def init_search(self, origin_point):
+        self.push_origin(origin_point)
+
+        # Perform and time the search
+        start_time = time.perf_counter()
+        with Profiler.phase('search'):
+            self.perform_search()
+        end_time = time.perf_counter()
+        self.elapsed = end_time - start_time
+        print(f"Elapsed search time: {print_elapsed_time(self.elapsed)}")
+
+
+    def push_origin(self, origin_point):
+        # Prep starting node and its label
+        self.origin_point = origin_point
+        self.push_node(self.labels.origin, 0)
+        self.labels.times[self.labels.origin] = 0
+
+
+
+# Splits times (key -> hours) into bands by the smallest limit (hours) each falls within
+#   Returns band limit -> list of keys, leaving out keys beyond the largest limit
+#   Bands are nested: everything within a limit is in its band or a smaller one
+def split_bands(times, limits):
+    limits = sorted(limits)
+    bands = {limit: [] for limit in limits}
+    for key, time in times.items():
+        band = bisect.bisect_left(limits, time)
+        if band < len(limits):
+            bands[limits[band]].append(key)
+    return bands
+
+
+def print_elapsed_time(seconds):
+    sec = seconds % (24 * 3600)
+    hour = sec // 3600
+    sec %= 3600
+    min = sec // 60
+    sec %= 60
+    #print("seconds value in hours:", hour)
+    #print("seconds value in minutes:", min)
+    #return "%02d:%02d:%02d" % (hour, min, sec)
+    return "%02d:%02d:%02d" % (hour, min, sec)
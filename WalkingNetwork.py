@@ -0,0 +1,356 @@
+import heapq
+import math
+import numpy as np
+
+
+# Compact in-memory walking network
+#   Every street vertex is a graph node and every segment between two vertices is an
+#   undirected arc. Arcs are stored in CSR form: the neighbours of node n are
+#   targets[offsets[n]:offsets[n + 1]], with matching lengths (in feet) and segment ids.
+#   Segments belong to an edge (one part of a street feature), which is the unit
+#   reported back as "reached" so it can be mapped onto the street layer again.
+#   Stops (route stop features) are snapped to their nearest node once, at build time.
+class WalkingNetwork:
+    def __init__(self, node_x, node_y, offsets, targets, lengths, arc_segments,
+                 segment_edges, edge_fids, edge_segment_counts,
+                 stop_fids, stop_nodes, stop_snap_lengths, cell_size=500.0):
+        self.node_x = node_x
+        self.node_y = node_y
+        self.offsets = offsets
+        self.targets = targets
+        self.lengths = lengths
+        self.arc_segments = arc_segments
+        self.segment_edges = segment_edges
+        self.edge_fids = edge_fids
+        self.edge_segment_counts = edge_segment_counts
+        self.cell_size = cell_size
+        self._grid = None
+        self.set_stops(stop_fids, stop_nodes, stop_snap_lengths)
+
+    def set_stops(self, stop_fids, stop_nodes, stop_snap_lengths):
+        self.stop_fids = stop_fids
+        self.stop_nodes = stop_nodes
+        self.stop_snap_lengths = stop_snap_lengths
+        self._stop_grid = None
+
+        # Stops grouped by the node they are snapped to (CSR again)
+        self.node_stops = np.argsort(stop_nodes, kind='stable').astype(np.int32)
+        counts = np.bincount(stop_nodes, minlength=self.node_count())
+        self.node_stop_offsets = np.zeros(self.node_count() + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.node_stop_offsets[1:])
+
+    def node_count(self):
+        return len(self.node_x)
+
+    def edge_count(self):
+        return len(self.edge_fids)
+
+    def stop_count(self):
+        return len(self.stop_fids)
+
+    def __repr__(self):
+        return (f"WalkingNetwork(nodes: {self.node_count()}, arcs: {len(self.targets)}, "
+                f"edges: {self.edge_count()}, stops: {self.stop_count()})")
+
+
+    # Uniform grid over the nodes, built on first use, for snapping points to the network
+    def _get_grid(self):
+        if self._grid is None:
+            grid = {}
+            cells_x = np.floor(self.node_x / self.cell_size).astype(np.int64).tolist()
+            cells_y = np.floor(self.node_y / self.cell_size).astype(np.int64).tolist()
+            for node, cell in enumerate(zip(cells_x, cells_y)):
+                grid.setdefault(cell, []).append(node)
+            self._grid = grid
+        return self._grid
+
+
+    # Returns (node, distance) for the network node closest to a point
+    # Searches rings of grid cells outward until no closer node can exist
+    def nearest_node(self, x, y):
+        grid = self._get_grid()
+        if not grid:
+            return None, math.inf
+        cx = math.floor(x / self.cell_size)
+        cy = math.floor(y / self.cell_size)
+        best_node, best_dist = None, math.inf
+        ring = 0
+        max_ring = len(grid) + 1
+        while ring <= max_ring:
+            for cell in ring_cells(cx, cy, ring):
+                for node in grid.get(cell, ()):
+                    dist = math.hypot(self.node_x[node] - x, self.node_y[node] - y)
+                    if dist < best_dist:
+                        best_node, best_dist = node, dist
+            # Any node outside this ring is at least ring * cell_size away
+            if best_node is not None and best_dist <= ring * self.cell_size:
+                break
+            ring += 1
+        return best_node, best_dist
+
+
+    # Stops grouped by the cell of the node they are snapped to, on the same grid as the nodes,
+    #   built on first use by stops_within
+    #   The cells of the stops' bounding box are numbered row by row, so the cells of one row
+    #   of a query square are a single slice of the stops sorted by cell
+    def _get_stop_grid(self):
+        if self._stop_grid is None:
+            stop_x = self.node_x[self.stop_nodes]
+            stop_y = self.node_y[self.stop_nodes]
+            cells_x = np.floor(stop_x / self.cell_size).astype(np.int64)
+            cells_y = np.floor(stop_y / self.cell_size).astype(np.int64)
+            min_x = int(cells_x.min()) if len(cells_x) else 0
+            min_y = int(cells_y.min()) if len(cells_y) else 0
+            columns = int(cells_x.max()) - min_x + 1 if len(cells_x) else 1
+            rows = int(cells_y.max()) - min_y + 1 if len(cells_y) else 0
+            cells = (cells_y - min_y) * columns + (cells_x - min_x)
+            order = np.argsort(cells, kind='stable')
+            self._stop_grid = (min_x, min_y, columns, rows, cells[order], order, stop_x[order], stop_y[order],
+                               np.asarray(self.stop_snap_lengths)[order])
+        return self._stop_grid
+
+
+    # Stops a walk from a point could reach within max_cost, with a lower bound on the cost of each:
+    #   the straight line to the stop's node plus its snap length, which no walk along the
+    #   streets (or snapping onto them) can beat
+    #   Only the stops in the grid cells around the max_cost disc are measured
+    # Returns (stop indices, bounds)
+    def stops_within(self, x, y, max_cost):
+        min_x, min_y, columns, rows, cells, order, stop_x, stop_y, snap_lengths = self._get_stop_grid()
+        first_x = max(math.floor((x - max_cost) / self.cell_size) - min_x, 0)
+        last_x = min(math.floor((x + max_cost) / self.cell_size) - min_x, columns - 1)
+        first_y = max(math.floor((y - max_cost) / self.cell_size) - min_y, 0)
+        last_y = min(math.floor((y + max_cost) / self.cell_size) - min_y, rows - 1)
+        if first_x > last_x or first_y > last_y:
+            return order[:0], snap_lengths[:0]
+
+        row_cells = np.arange(first_y, last_y + 1) * columns
+        starts = np.searchsorted(cells, row_cells + first_x, side='left')
+        counts = np.searchsorted(cells, row_cells + last_x, side='right') - starts
+        positions = np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        bounds = np.hypot(stop_x[positions] - x, stop_y[positions] - y) + snap_lengths[positions]
+        within = np.flatnonzero(bounds <= max_cost)
+        return order[positions[within]], bounds[within]
+
+
+    # Bounded Dijkstra from one or more (node, starting cost) sources
+    # Returns a dictionary of node -> cost for every node settled within max_cost
+    def bounded_dijkstra(self, sources, max_cost):
+        settled = {}
+        heap = [(cost, node) for node, cost in sources if cost <= max_cost]
+        heapq.heapify(heap)
+        offsets, targets, lengths = self.offsets, self.targets, self.lengths
+        while heap:
+            cost, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled[node] = cost
+            start, end = offsets[node], offsets[node + 1]
+            for target, length in zip(targets[start:end].tolist(), lengths[start:end].tolist()):
+                new_cost = cost + length
+                if new_cost <= max_cost and target not in settled:
+                    heapq.heappush(heap, (new_cost, target))
+        return settled
+
+
+    # Cost to reach each stop from the settled nodes of a search
+    # Returns a list of (stop fid, cost)
+    def stop_costs(self, settled, max_cost):
+        stop_fids, costs = self.stop_cost_arrays(settled, max_cost)
+        return list(zip(stop_fids.tolist(), costs.tolist()))
+
+
+    # stop_costs as (stop fids, costs) arrays, in the same order
+    #   Every settled node's stops are gathered from the CSR arrays at once
+    def stop_cost_arrays(self, settled, max_cost):
+        nodes = np.fromiter(settled.keys(), dtype=np.int64, count=len(settled))
+        node_costs = np.fromiter(settled.values(), dtype=np.float64, count=len(settled))
+        starts = self.node_stop_offsets[nodes]
+        counts = self.node_stop_offsets[nodes + 1] - starts
+        # Position of every stop in node_stops, node by node
+        positions = np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        stops = self.node_stops[positions]
+        costs = np.repeat(node_costs, counts) + self.stop_snap_lengths[stops]
+        reachable = costs <= max_cost
+        return self.stop_fids[stops[reachable]], costs[reachable]
+
+
+    # Edges reached within max_cost, walked along at least part of their length
+    # A segment is reached when it can be fully traversed from either of its nodes,
+    #   an edge is reached when any of its segments is (a street the walk runs out partway
+    #   along is reached, as the partial lines of QGIS's service areas were)
+    def reached_edges(self, settled, max_cost):
+        segments = set()
+        offsets, lengths, arc_segments = self.offsets, self.lengths, self.arc_segments
+        for node, cost in settled.items():
+            start, end = offsets[node], offsets[node + 1]
+            for length, segment in zip(lengths[start:end].tolist(), arc_segments[start:end].tolist()):
+                if cost + length <= max_cost:
+                    segments.add(segment)
+        return {int(self.segment_edges[segment]) for segment in segments}
+
+
+    # Cost (in feet) at which each edge is reached, for edges within max_cost
+    #   A segment costs the least of starting from either node and walking its length,
+    #   an edge costs the least of its segments, so reached_edges(settled, c) is exactly
+    #   the edges costing c or less
+    def edge_costs(self, settled, max_cost):
+        if not settled:
+            return {}
+        nodes = np.fromiter(settled.keys(), dtype=np.int64, count=len(settled))
+        node_costs = np.fromiter(settled.values(), dtype=np.float64, count=len(settled))
+        degrees = self.offsets[nodes + 1] - self.offsets[nodes]
+        arcs = np.concatenate([np.arange(self.offsets[node], self.offsets[node + 1]) for node in nodes.tolist()])
+        arc_costs = np.repeat(node_costs, degrees) + self.lengths[arcs]
+
+        edge_costs = np.full(self.edge_count(), np.inf)
+        np.minimum.at(edge_costs, self.segment_edges[self.arc_segments[arcs]], arc_costs)
+        edges = np.flatnonzero(edge_costs <= max_cost)
+        return dict(zip(edges.tolist(), edge_costs[edges].tolist()))
+
+
+    # Walking search from an arbitrary point (snapped to the nearest node)
+    def search_from_point(self, x, y, max_cost):
+        node, snap_length = self.nearest_node(x, y)
+        if node is None:
+            return WalkResult([], set())
+        return self.search([(node, snap_length)], max_cost)
+
+
+    def search(self, sources, max_cost):
+        settled = self.bounded_dijkstra(sources, max_cost)
+        return WalkResult(self.stop_costs(settled, max_cost), self.reached_edges(settled, max_cost))
+
+
+    # Stop costs only, for searches whose walked edges are collected later on
+    def search_stops_from_point(self, x, y, max_cost):
+        node, snap_length = self.nearest_node(x, y)
+        if node is None:
+            return []
+        return self.stop_costs(self.bounded_dijkstra([(node, snap_length)], max_cost), max_cost)
+
+
+    # search_stops_from_point as (stop fids, costs) arrays
+    def search_stop_arrays(self, x, y, max_cost):
+        node, snap_length = self.nearest_node(x, y)
+        if node is None:
+            return self.stop_fids[:0], self.stop_snap_lengths[:0]
+        return self.stop_cost_arrays(self.bounded_dijkstra([(node, snap_length)], max_cost), max_cost)
+
+
+    # Edges walkable from a set of (node, cost already spent) sources in one pass
+    # A single Dijkstra seeded with every source at its starting cost reaches a segment exactly
+    #   when some one source does, so this is the union of the edges reached from each source
+    def walked_edges(self, sources, max_cost):
+        return self.reached_edges(self.bounded_dijkstra(sources, max_cost), max_cost)
+
+
+    # walked_edges with the cost each edge was reached at, edge -> cost
+    def walked_edge_costs(self, sources, max_cost):
+        return self.edge_costs(self.bounded_dijkstra(sources, max_cost), max_cost)
+
+
+
+# Stop costs (stop fid, cost) and reached edges of a single walking search (costs in feet)
+class WalkResult:
+    def __init__(self, stop_costs, edges):
+        self.stop_costs = stop_costs
+        self.edges = edges
+
+    def __repr__(self):
+        return f"WalkResult(stops: {len(self.stop_costs)}, edges: {len(self.edges)})"
+
+
+
+# Grid cells on the border of the square ring at distance `ring` around (cx, cy)
+def ring_cells(cx, cy, ring):
+    if ring == 0:
+        yield (cx, cy)
+        return
+    for dx in range(-ring, ring + 1):
+        yield (cx + dx, cy - ring)
+        yield (cx + dx, cy + ring)
+    for dy in range(-ring + 1, ring):
+        yield (cx - ring, cy + dy)
+        yield (cx + ring, cy + dy)
+
+
+# Builds a WalkingNetwork from plain python data
+#   street_parts: iterable of (feature id, [(x, y), ...]) polylines, one per feature part
+#   stop_points: iterable of (feature id, x, y)
+# Vertices are joined when their coordinates match to within a thousandth of a foot
+def build_walking_network(street_parts, stop_points, cell_size=500.0):
+    node_lookup = {}
+    node_x, node_y = [], []
+
+    def node_for(point):
+        key = (round(point[0], 3), round(point[1], 3))
+        node = node_lookup.get(key)
+        if node is None:
+            node = len(node_x)
+            node_lookup[key] = node
+            node_x.append(float(point[0]))
+            node_y.append(float(point[1]))
+        return node
+
+    segment_u, segment_v, segment_lengths, segment_edges = [], [], [], []
+    edge_fids, edge_segment_counts = [], []
+    for fid, points in street_parts:
+        edge = len(edge_fids)
+        count = 0
+        previous = None
+        for point in points:
+            node = node_for(point)
+            if previous is not None and node != previous:
+                segment_u.append(previous)
+                segment_v.append(node)
+                segment_lengths.append(math.hypot(node_x[node] - node_x[previous],
+                                                  node_y[node] - node_y[previous]))
+                segment_edges.append(edge)
+                count += 1
+            previous = node
+        if count:
+            edge_fids.append(fid)
+            edge_segment_counts.append(count)
+
+    node_count = len(node_x)
+    segment_u = np.array(segment_u, dtype=np.int32)
+    segment_v = np.array(segment_v, dtype=np.int32)
+    segment_lengths = np.array(segment_lengths, dtype=np.float64)
+
+    # Each segment is walkable in both directions, so it becomes two arcs
+    sources = np.concatenate([segment_u, segment_v])
+    targets = np.concatenate([segment_v, segment_u])
+    lengths = np.concatenate([segment_lengths, segment_lengths])
+    arc_segments = np.concatenate([np.arange(len(segment_u), dtype=np.int32)] * 2)
+    order = np.argsort(sources, kind='stable')
+    offsets = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=node_count), out=offsets[1:])
+
+    network = WalkingNetwork(np.array(node_x, dtype=np.float64),
+                             np.array(node_y, dtype=np.float64),
+                             offsets,
+                             targets[order],
+                             lengths[order],
+                             arc_segments[order],
+                             np.array(segment_edges, dtype=np.int32),
+                             np.array(edge_fids, dtype=np.int64),
+                             np.array(edge_segment_counts, dtype=np.int32),
+                             np.zeros(0, dtype=np.int64),
+                             np.zeros(0, dtype=np.int32),
+                             np.zeros(0, dtype=np.float64),
+                             cell_size)
+
+    stop_fids, stop_nodes, stop_snap_lengths = [], [], []
+    for fid, x, y in stop_points:
+        node, snap_length = network.nearest_node(x, y)
+        if node is None:
+            continue
+        stop_fids.append(fid)
+        stop_nodes.append(node)
+        stop_snap_lengths.append(snap_length)
+
+    network.set_stops(np.array(stop_fids, dtype=np.int64),
+                      np.array(stop_nodes, dtype=np.int32),
+                      np.array(stop_snap_lengths, dtype=np.float64))
+    return network
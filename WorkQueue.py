@@ -0,0 +1,176 @@
+import os
+import socket
+import sqlite3
+import time
+
+
+# Durable queue of the origins of a batch, so a batch interrupted by a crash or reboot picks
+#   up where it stopped: rerunning it only searches the origins that aren't done
+#   Each origin is an item, keyed by its name and time limit in minutes (like the rows of a
+#   GeoPackageWriter), with its coordinate string:
+#     status: pending, running (claimed by a worker), done or failed
+#     attempts: how many times it was claimed; items are given up on (failed) after max_attempts
+#     worker, started, finished, seconds: who ran it last and how long it took, to find
+#       the origins that are slow or keep failing (see slowest)
+#     error: what went wrong, for failed items
+#   Workers claim items in their own transactions (BEGIN IMMEDIATE), so any number of
+#   processes, QGIS or the command line, can work through the same queue at once
+#   The queue only coordinates who searches what: each QGIS worker needs its own output
+#   GeoPackage (a GeoPackageWriter holds its write transaction across many origins), while
+#   command line workers can share an output directory (one file per origin)
+#   Items a worker claimed but never finished (it crashed) go back to pending once their
+#   claim is older than lease_seconds (see requeue_abandoned)
+queue_schema = """
+CREATE TABLE IF NOT EXISTS items (
+    origin TEXT NOT NULL,
+    minutes REAL NOT NULL,
+    coords TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    started REAL,
+    finished REAL,
+    seconds REAL,
+    error TEXT,
+    PRIMARY KEY (origin, minutes));
+CREATE INDEX IF NOT EXISTS items_status ON items (status);
+"""
+
+
+class WorkQueue:
+    def __init__(self, path, max_attempts=3, lease_seconds=3600):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        # Transactions are begun and committed here, not by sqlite3
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.executescript(queue_schema)
+        self.worker = worker_name()
+
+    def __repr__(self):
+        counts = self.counts()
+        return (f"WorkQueue({self.path}, " +
+                ", ".join(f"{status}: {counts.get(status, 0)}" for status in ('pending', 'running', 'done', 'failed'))
+                + ")")
+
+
+    # Adds (origin name, coordinate string) items for a time limit (hours),
+    #   keeping the state of any already queued
+    def add(self, origins, time_limit):
+        self.connection.execute("BEGIN IMMEDIATE")
+        self.connection.executemany("INSERT OR IGNORE INTO items (origin, minutes, coords) VALUES (?, ?, ?)",
+                                    ((str(name), item_minutes(time_limit), coords) for name, coords in origins))
+        self.connection.execute("COMMIT")
+
+
+    # Claims up to count items to run, pending ones first, then failed ones with attempts left
+    #   (failed by another worker or an earlier run, this worker doesn't retry its own failures)
+    # Returns [(origin name, coordinate string, time limit in hours)]
+    def claim(self, count=1):
+        self.connection.execute("BEGIN IMMEDIATE")
+        rows = self.connection.execute(
+            "SELECT origin, coords, minutes FROM items "
+            "WHERE status = 'pending' OR (status = 'failed' AND attempts < ? AND worker != ?) "
+            "ORDER BY status = 'failed', rowid LIMIT ?", (self.max_attempts, self.worker, count)).fetchall()
+        self.connection.executemany(
+            "UPDATE items SET status = 'running', attempts = attempts + 1, worker = ?, started = ?, "
+            "finished = NULL, seconds = NULL WHERE origin = ? AND minutes = ?",
+            ((self.worker, time.time(), origin, minutes) for origin, coords, minutes in rows))
+        self.connection.execute("COMMIT")
+        return [(origin, coords, minutes / 60) for origin, coords, minutes in rows]
+
+
+    # Marks a claimed item done, seconds: how long it took (from its claim, when not given)
+    #   Returns False, leaving the item alone, when this worker no longer holds its claim
+    #   (it ran past lease_seconds and was requeued, maybe claimed by another worker meanwhile)
+    def complete(self, origin, time_limit, seconds=None):
+        return self.finish(origin, time_limit, 'done', seconds, None)
+
+
+    def fail(self, origin, time_limit, error, seconds=None):
+        return self.finish(origin, time_limit, 'failed', seconds, str(error))
+
+
+    def finish(self, origin, time_limit, status, seconds, error):
+        now = time.time()
+        return self.connection.execute(
+            "UPDATE items SET status = ?, finished = ?, seconds = COALESCE(?, ? - started), error = ? "
+            "WHERE origin = ? AND minutes = ? AND status = 'running' AND worker = ?",
+            (status, now, seconds, now, error, str(origin), item_minutes(time_limit), self.worker)).rowcount == 1
+
+
+    # Puts this worker's unfinished claims back, e.g. on cancelling
+    def release(self):
+        self.connection.execute("UPDATE items SET status = 'pending', attempts = attempts - 1 "
+                                "WHERE status = 'running' AND worker = ?", (self.worker,))
+
+
+    # Items claimed more than lease_seconds ago and never finished (their worker crashed or was
+    #   killed) go back to pending, or to failed when they have used up their attempts
+    #   Returns how many were requeued
+    def requeue_abandoned(self):
+        cutoff = time.time() - self.lease_seconds
+        self.connection.execute("BEGIN IMMEDIATE")
+        self.connection.execute("UPDATE items SET status = 'failed', error = 'abandoned by its worker' "
+                                "WHERE status = 'running' AND started < ? AND attempts >= ?",
+                                (cutoff, self.max_attempts))
+        requeued = self.connection.execute("UPDATE items SET status = 'pending' "
+                                           "WHERE status = 'running' AND started < ?", (cutoff,)).rowcount
+        self.connection.execute("COMMIT")
+        return requeued
+
+
+    # Sets done items back to pending, e.g. the ones whose results never made it to disk
+    #   items: (origin name, time limit in hours)
+    def requeue(self, items):
+        self.connection.executemany("UPDATE items SET status = 'pending' WHERE status = 'done' "
+                                    "AND origin = ? AND minutes = ?",
+                                    ((str(origin), item_minutes(time_limit)) for origin, time_limit in items))
+
+
+    # (origin name, time limit in hours) of the done items
+    def done(self):
+        return [(origin, minutes / 60) for origin, minutes in
+                self.connection.execute("SELECT origin, minutes FROM items WHERE status = 'done'")]
+
+
+    # status -> number of items
+    def counts(self):
+        return dict(self.connection.execute("SELECT status, COUNT(*) FROM items GROUP BY status"))
+
+
+    # The count slowest finished items, as (origin, minutes, seconds, attempts, status)
+    def slowest(self, count=10):
+        return self.connection.execute("SELECT origin, minutes, seconds, attempts, status FROM items "
+                                       "WHERE seconds IS NOT NULL ORDER BY seconds DESC LIMIT ?",
+                                       (count,)).fetchall()
+
+
+    # Failed items, as (origin, minutes, attempts, error)
+    def failures(self):
+        return self.connection.execute("SELECT origin, minutes, attempts, error FROM items "
+                                       "WHERE status = 'failed' ORDER BY rowid").fetchall()
+
+
+    def print_summary(self, count=5):
+        print(f"Queue: {self}")
+        print("  Slowest:")
+        for origin, minutes, seconds, attempts, status in self.slowest(count):
+            print(f"    {origin} ({minutes:g} min): {seconds:.2f} s, {status} after {attempts} attempts")
+        for origin, minutes, attempts, error in self.failures():
+            print(f"  {origin} ({minutes:g} min) failed after {attempts} attempts: {error}")
+
+
+    def close(self):
+        self.connection.close()
+
+
+
+# Minutes items are keyed by, rounded the same way as GeoPackageWriter.budget_minutes
+def item_minutes(time_limit):
+    return round(time_limit * 60, 3)
+
+
+# Name of this process as a queue worker, host:pid
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Benchmark
+import NetworkSnapshot
+
+
+# A snapshot whose arrays were changed after it was written is rejected when verified
+class SnapshotChecksumTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'network.snap')
+        NetworkSnapshot.write_snapshot(self.path, Benchmark.make_network(10, 264, 3), 'stamp')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def test_verified_after_writing(self):
+        snapshot = NetworkSnapshot.load_snapshot(self.path, 'stamp', verify=True)
+        self.assertEqual(snapshot.source_stamp, 'stamp')
+
+
+    def test_corrupt_arrays_rejected(self):
+        metadata, data_start = NetworkSnapshot.read_metadata(self.path)
+        with open(self.path, 'r+b') as file:
+            file.seek(data_start + metadata['arrays']['lengths'][2])
+            value = file.read(1)
+            file.seek(-1, os.SEEK_CUR)
+            file.write(bytes([value[0] ^ 0xff]))
+
+        # Loading without verifying still maps the file as it is
+        NetworkSnapshot.load_snapshot(self.path)
+        with self.assertRaises(ValueError):
+            NetworkSnapshot.load_snapshot(self.path, verify=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Benchmark
+import ResultCache
+import TransitSearch
+
+
+# An origin answered through the cache, searched or read back, gets exactly what a search
+#   without the cache finds, edge times included
+class ResultCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        size, spacing, step = Benchmark.scales['small']
+        cls.network = Benchmark.make_network(size, spacing, step)
+        cls.origins = Benchmark.make_origins(size, spacing, 4)
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ResultCache.ResultCache(os.path.join(self.directory.name, 'results.sqlite'))
+
+    def tearDown(self):
+        self.cache.close()
+        self.directory.cleanup()
+
+
+    def search(self, origin_point, time_limit=0.5):
+        search = TransitSearch.Search(time_limit, self.network)
+        search.exact_labels = True
+        search.init_search(origin_point)
+        return search.get_result('', keep_times=True)
+
+
+    def cached_search(self, point):
+        return ResultCache.cached_search(self.cache, self.network, 'network', '', point, 0.5,
+                                         ResultCache.search_mode(exact_labels=True), self.search)
+
+
+    def test_same_as_uncached(self):
+        for name, point in self.origins:
+            expected = self.search(point)
+            for cached in (False, True):
+                result, hit = self.cached_search(point)
+                with self.subTest(origin=name, cached=cached):
+                    self.assertEqual(hit, cached)
+                    self.assertEqual(result.walking_edges, expected.walking_edges)
+                    self.assertEqual(result.transit_spans, expected.transit_spans)
+                    self.assertEqual(result.walking_edge_times, expected.walking_edge_times)
+
+
+    def test_snap_distance_in_key(self):
+        name, (x, y) = self.origins[0]
+        self.cached_search((x, y))
+        node, snap_length = self.network.walking_network.nearest_node(x, y)
+        node_point = (float(self.network.walking_network.node_x[node]),
+                      float(self.network.walking_network.node_y[node]))
+        if round(snap_length):
+            self.assertFalse(self.cached_search(node_point)[1])
+        self.assertTrue(self.cached_search((x, y))[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Benchmark
+import TransitSearch
+
+
+# Walks are only pruned when they can't improve any label, so a search must find exactly the
+#   same with pruning as without it
+class SearchPruningTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        size, spacing, step = Benchmark.scales['small']
+        cls.network = Benchmark.make_network(size, spacing, step)
+        cls.origins = Benchmark.make_origins(size, spacing, 8)
+
+
+    def search(self, point, time_limit, prune):
+        search = TransitSearch.Search(time_limit, self.network)
+        search.prune = prune
+        search.init_search(point)
+        return search, search.get_result('')
+
+
+    def test_same_results(self):
+        pruned = 0
+        for time_limit in (0.25, 0.5, 1):
+            for name, point in self.origins:
+                search, result = self.search(point, time_limit, True)
+                unpruned, expected = self.search(point, time_limit, False)
+                pruned += search.pruned_walk_searches
+                with self.subTest(origin=name, time_limit=time_limit):
+                    self.assertEqual(unpruned.pruned_walk_searches, 0)
+                    self.assertEqual(result.walking_edges, expected.walking_edges)
+                    self.assertEqual(result.transit_spans, expected.transit_spans)
+                    self.assertEqual(search.labels.times.tolist(), unpruned.labels.times.tolist())
+        self.assertGreater(pruned, 0)
+
+
+    def test_stops_within(self):
+        walking_network = self.network.walking_network
+        x, y = self.origins[0][1]
+        for max_cost in (0, 300, 2000, 1e6):
+            stops, bounds = walking_network.stops_within(x, y, max_cost)
+            stop_x = walking_network.node_x[walking_network.stop_nodes]
+            stop_y = walking_network.node_y[walking_network.stop_nodes]
+            expected = ((stop_x - x) ** 2 + (stop_y - y) ** 2) ** 0.5 + walking_network.stop_snap_lengths
+            with self.subTest(max_cost=max_cost):
+                self.assertEqual(sorted(stops.tolist()), sorted((expected <= max_cost).nonzero()[0].tolist()))
+                self.assertTrue(all(abs(bound - expected[stop]) < 1e-6 for stop, bound in zip(stops, bounds)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Benchmark
+import TransitSearch
+
+
+# Searches sharing a walk shed cache, one after another as a batch runs them, must each find
+#   exactly what searching from the origin without the cache finds
+class WalkShedCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        size, spacing, step = Benchmark.scales['small']
+        cls.network = Benchmark.make_network(size, spacing, step)
+        cls.origins = Benchmark.make_origins(size, spacing, 12)
+        # Origins close together share most of their walk sheds, and the same origin twice shares all of them
+        x, y = cls.origins[0][1]
+        cls.origins += [("near 0", (x + 40, y - 25)), ("same as 0", (x, y))]
+
+
+    def assert_same_results(self, time_limit):
+        cache = TransitSearch.WalkShedCache(self.network)
+        for name, point in self.origins:
+            search = TransitSearch.Search(time_limit, cache)
+            search.init_search(point)
+            result = search.get_result(name)
+
+            search = TransitSearch.Search(time_limit, self.network)
+            search.init_search(point)
+            expected = search.get_result(name)
+            with self.subTest(origin=name):
+                self.assertTrue(expected.walking_edges and expected.transit_spans)
+                self.assertEqual(result.walking_edges, expected.walking_edges)
+                self.assertEqual(sorted(result.transit_spans), sorted(expected.transit_spans))
+
+
+    def test_short_searches(self):
+        self.assert_same_results(0.25)
+
+
+    def test_long_searches(self):
+        self.assert_same_results(0.75)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import WalkingNetwork
+
+
+# A street is reached when any one of its segments can be walked end to end, so a walk running
+#   out partway along a street still reaches it
+class ReachedEdgesTest(unittest.TestCase):
+    def setUp(self):
+        # Street 10 runs east from the origin in three 100 foot segments, 11 north in one,
+        #   13 carries on north for 150 feet and 12 on east for 100
+        self.network = WalkingNetwork.build_walking_network(
+            [(10, [(0, 0), (100, 0), (200, 0), (300, 0)]),
+             (11, [(0, 0), (0, 100)]),
+             (12, [(300, 0), (400, 0)]),
+             (13, [(0, 100), (0, 250)])], [])
+        self.origin, snap_length = self.network.nearest_node(0, 0)
+
+
+    def reached_fids(self, sources, max_cost):
+        edges = self.network.walked_edges(sources, max_cost)
+        return sorted(int(self.network.edge_fids[edge]) for edge in edges)
+
+
+    def test_partly_walked_street_is_reached(self):
+        # Only the first of street 10's segments is walkable, and none of street 13's
+        self.assertEqual(self.reached_fids([(self.origin, 0)], 150), [10, 11])
+        self.assertEqual(self.reached_fids([(self.origin, 0)], 99), [])
+        self.assertEqual(self.reached_fids([(self.origin, 0)], 400), [10, 11, 12, 13])
+
+
+    def test_edge_costs_match_reached_edges(self):
+        settled = self.network.bounded_dijkstra([(self.origin, 0)], 400)
+        costs = self.network.edge_costs(settled, 400)
+        self.assertEqual({int(self.network.edge_fids[edge]): cost for edge, cost in costs.items()},
+                         {10: 100, 11: 100, 12: 400, 13: 250})
+        for max_cost in (0, 99, 100, 150, 250, 399, 400):
+            with self.subTest(max_cost=max_cost):
+                self.assertEqual(self.network.reached_edges(settled, max_cost),
+                                 {edge for edge, cost in costs.items() if cost <= max_cost})
+
+
+    def test_one_pass_is_union_of_sources(self):
+        far_end, snap_length = self.network.nearest_node(400, 0)
+        sources = [(self.origin, 50), (far_end, 0)]
+        union = set()
+        for source in sources:
+            union |= self.network.walked_edges([source], 150)
+        self.assertEqual(self.network.walked_edges(sources, 150), union)
+        self.assertEqual(self.reached_fids(sources, 150), [10, 11, 12])
+
+
+if __name__ == '__main__':
+    unittest.main()